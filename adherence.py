@@ -0,0 +1,64 @@
+# /medication-reminder-app/adherence.py
+import os
+from datetime import date, timedelta
+
+# Range reported when a request gives no `from` date.
+ADHERENCE_DEFAULT_DAYS = int(os.getenv("ADHERENCE_DEFAULT_DAYS", 90))
+GRANULARITIES = ("day", "week", "month")
+
+def parse_range(args, today=None):
+    """
+    Reads `from`, `to` (YYYY-MM-DD, inclusive) and `granularity` from query arguments.
+    Defaults to the last ADHERENCE_DEFAULT_DAYS days, by day. Returns (first, last, granularity, error).
+    """
+    today = today or date.today()
+    try:
+        last = date.fromisoformat(args.get('to')) if args.get('to') else today
+        first = date.fromisoformat(args.get('from')) if args.get('from') else last - timedelta(days=ADHERENCE_DEFAULT_DAYS - 1)
+    except ValueError:
+        return None, None, None, "from and to must be dates in YYYY-MM-DD format."
+    if first > last:
+        return None, None, None, "from must not be after to."
+    granularity = args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return None, None, None, f"granularity must be one of: {', '.join(GRANULARITIES)}."
+    return first, last, granularity, None
+
+def period_start(day, granularity):
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())  # Monday
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def _totals(counts):
+    """Counts plus the adherence rate: taken / (taken + missed). Pending doses aren't due yet."""
+    due = counts["taken"] + counts["missed"]
+    return dict(counts, adherence=round(counts["taken"] / due, 4) if due else None)
+
+def build_report(rows, first, last, granularity):
+    """
+    Turns adherence_daily rows (day, medication_id, medicine_name, taken, missed, pending)
+    into a summary, per-period totals and per-medication totals. The work is proportional
+    to the days and medications in the range, never to the number of doses.
+    """
+    summary = {"taken": 0, "missed": 0, "pending": 0}
+    periods, medications = {}, {}
+    for row in rows:
+        period = periods.setdefault(period_start(row["day"], granularity), {"taken": 0, "missed": 0, "pending": 0})
+        medication = medications.setdefault(row["medication_id"], {
+            "medication_id": row["medication_id"], "medicine_name": row["medicine_name"],
+            "taken": 0, "missed": 0, "pending": 0,
+        })
+        for key in ("taken", "missed", "pending"):
+            summary[key] += row[key]
+            period[key] += row[key]
+            medication[key] += row[key]
+    return {
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "granularity": granularity,
+        "summary": _totals(summary),
+        "periods": [dict(_totals(counts), start=start.isoformat()) for start, counts in sorted(periods.items())],
+        "medications": sorted((_totals(m) for m in medications.values()), key=lambda m: m["medicine_name"] or ""),
+    }
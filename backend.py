@@ -1,13 +1,24 @@
 # /medication-reminder-app/backend.py
-from flask import Flask, request, jsonify, session, g
-from werkzeug.security import generate_password_hash, check_password_hash
-from database import get_db_connection, release_db_connection
-import psycopg2.extras
-from datetime import datetime, timedelta, date
-from twilio.rest import Client
-import smtplib
-from email.mime.text import MIMEText
+from flask import Flask, Response, request, jsonify, session, g, stream_with_context
+from database import pool_stats
+from repository import DatabaseErrors, IntegrityErrors, get_storage
+from datetime import datetime, timedelta
+from outbox import start_dispatcher
+from sweeper import MISSED_LOOKBACK_DAYS, bump_data_revision, process_missed_doses, start_sweeper_thread
+from events import broker, start_event_listener
+from scheduler import SCHEDULER_SWEEP_INTERVAL_SECONDS, DoseScheduler, mark_doses_missed
+from cache import ScheduleCache
+from adherence import build_report, parse_range
+from recurrence import parse_rule
+from timezones import DEFAULT_TIMEZONE, local_today, valid_timezone
+import hashing
+import metrics
+import csv
+import io
+import json
 import os
+import queue
+import threading
 from functools import wraps
 
 app = Flask(__name__)
@@ -15,70 +26,26 @@ app = Flask(__name__)
 # It's best practice to load this from an environment variable.
 # Generate a strong key with: python -c 'import secrets; print(secrets.token_hex(16))'
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'a-default-secret-key-for-dev-only')
+# Upper bound on the items accepted by one bulk request.
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
 
-# --- Twilio Configuration ---
-# IMPORTANT: To send real SMS, replace with your actual Twilio credentials.
-# For better security, use environment variables in a real application.
-TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'ACxxxxxxxxxxxxxxxxxxxxxxxxxxxxx')
-TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'your_auth_token')
-TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '+15017122661') # Your Twilio number
-
-# --- Email (SMTP) Configuration ---
-SMTP_SERVER = os.environ.get('SMTP_SERVER')
-SMTP_PORT = int(os.environ.get('SMTP_PORT', 587)) # 587 is common for TLS
-SMTP_USER = os.environ.get('SMTP_USER')
-SMTP_PASS = os.environ.get('SMTP_PASS')
-
-def send_sms(to_number, body):
-    """Sends an SMS using Twilio. Includes a simulation mode."""
-    if 'ACxxxxxxxx' in TWILIO_ACCOUNT_SID or 'your_auth_token' in TWILIO_AUTH_TOKEN:
-        print("\n--- SMS SIMULATION ---")
-        print(f"To: {to_number}\nBody: {body}")
-        print("--- (To send real SMS, update Twilio credentials in your .env file) ---\n")
-        return "simulated"
-    try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        message = client.messages.create(body=body, from_=TWILIO_PHONE_NUMBER, to=to_number)
-        print(f"SMS sent to {to_number}. SID: {message.sid}")
-        return message.sid
-    except Exception as e:
-        print(f"Error sending SMS to {to_number}: {e}")
-        return None
-
-def send_email(to_email, subject, body):
-    """Sends an email using SMTP. Includes a simulation mode."""
-    if not all([SMTP_SERVER, SMTP_USER, SMTP_PASS]):
-        print("\n--- EMAIL SIMULATION ---")
-        print(f"To: {to_email}\nSubject: {subject}\nBody: {body}")
-        print("--- (To send real emails, update SMTP credentials in your .env file) ---\n")
-        return "simulated"
-
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = SMTP_USER
-    msg['To'] = to_email
-
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls() # Secure the connection
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
-            print(f"Email sent successfully to {to_email}")
-        return "sent"
-    except Exception as e:
-        print(f"Error sending email to {to_email}: {e}")
-        return None
-
+# PostgreSQL or embedded SQLite, as selected by STORAGE_BACKEND (see repository.py).
+storage = get_storage()
+# In-memory scheduler that marks doses MISSED the moment they become overdue.
+# Only created when enabled (see start_background_services); routes keep it in sync.
+dose_scheduler = None
+# Serialized /api/schedule responses, keyed by (user_id, date).
+schedule_cache = ScheduleCache()
 
 # --- Database Connection Handling for Flask App Context ---
 
 def get_conn():
     """
-    Opens a new database connection from the pool if there is none yet for
-    the current application context `g`.
+    Opens a new database connection (from the pool, for PostgreSQL) if there is none yet
+    for the current application context `g`.
     """
     if 'db_conn' not in g:
-        g.db_conn = get_db_connection()
+        g.db_conn = storage.connect()
     return g.db_conn
 
 @app.teardown_appcontext
@@ -89,57 +56,122 @@ def teardown_db(exception):
     """
     db_conn = g.pop('db_conn', None)
     if db_conn is not None:
-        release_db_connection(db_conn)
+        storage.release(db_conn)
+
+def after_commit(callback):
+    """
+    Registers a callback to run once the current request's transaction has committed,
+    e.g. to update in-memory state that must not change if the transaction rolls back.
+    """
+    g.setdefault('after_commit', []).append(callback)
 
-def with_db_cursor(f):
+def run_after_commit():
+    """Runs (and clears) the callbacks registered for the transaction that just committed."""
+    for callback in g.pop('after_commit', []):
+        callback()
+
+def with_repository(f):
     """
-    A decorator to provide a database cursor to a Flask route.
-    It gets a connection from the Flask app context `g` and handles transactions.
+    A decorator to provide a repository (see repository.py) to a Flask route.
+    It gets a connection from the Flask app context `g` and runs the route in one transaction.
     The connection itself is managed by the `teardown_db` function.
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        conn = get_conn()
         try:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                result = f(cur, *args, **kwargs)
-                conn.commit()
-                return result
-        except (psycopg2.Error, ValueError, RuntimeError) as e:
-            conn.rollback()
+            with storage.transaction(get_conn()) as repo:
+                result = f(repo, *args, **kwargs)
+            run_after_commit()
+            return result
+        except (*DatabaseErrors, ValueError, RuntimeError) as e:
+            g.pop('after_commit', None)
             print(f"Database Error in '{f.__name__}': {e}")
             # Return a generic error to the client for security
             return jsonify({"error": "A database error occurred. Please check server logs."}), 500
     return decorated_function
 
+# --- Request Metrics ---
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    """Records latency, query count and database time per route (exported at /metrics)."""
+    stats = metrics.finish_request()
+    if stats is not None:
+        # The route pattern, not the URL, keeps the number of label values bounded.
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(request.method, route, response.status_code, stats)
+    return response
+
 # --- Helper Functions ---
-def generate_daily_doses(cur, user_id):
+def invalidate_schedule(user_id):
+    """Drops the user's cached schedule once the current transaction commits."""
+    after_commit(lambda: schedule_cache.invalidate_user(user_id))
+
+def record_user_change(repo, user_id):
+    """
+    Marks the user's schedule/medication data as changed: bumps the revision behind the
+    ETags, drops the cached schedule and tells the user's open alert streams.
     """
-    Ensures dose_history for the current day is populated for all of a user's medications.
-    This function is idempotent: it only adds entries that are missing for the current day,
-    making it safe to call multiple times (e.g., on login and after adding a new medication).
+    bump_data_revision(repo, [user_id])
+    invalidate_schedule(user_id)
+    repo.publish_event(user_id, 'schedule_changed')
+
+def user_today():
+    """Today's date in the logged-in user's timezone (kept in the session since login)."""
+    return local_today(session.get('timezone', DEFAULT_TIMEZONE))
+
+def hashing_busy():
+    """The fast 429 for a login or registration refused by the hashing pool (see hashing.py)."""
+    response = jsonify({"error": "The server is busy. Please try again in a few seconds."})
+    response.headers["Retry-After"] = "2"
+    return response, 429
+
+def schedule_etag(user_id, day, revision):
+    # Changes with the day and with every write to the user's doses or medications.
+    return f"schedule-{user_id}-{day.isoformat()}-{revision}"
+
+def medications_etag(user_id, revision):
+    return f"meds-{user_id}-{revision}"
+
+def not_modified(etag):
+    """An empty 304 response carrying the current ETag."""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+def json_response(payload, etag=None):
+    """A 200 response for an already serialized JSON payload."""
+    response = app.response_class(payload, mimetype="application/json")
+    if etag:
+        response.set_etag(etag)
+    return response
+
+def _invalidate_missed(missed_doses):
+    for user_id in {dose['user_id'] for dose in missed_doses}:
+        schedule_cache.invalidate_user(user_id)
+
+def generate_daily_doses(repo, user_id, days=1):
     """
-    today = date.today()
-    cur.execute("SELECT id, time_to_take FROM medications WHERE user_id = %s", (user_id,))
-    medications = cur.fetchall()
-
-    for med in medications:
-        # Check if a dose for THIS specific medication already exists for today
-        cur.execute(
-            "SELECT 1 FROM dose_history WHERE medication_id = %s AND scheduled_for = %s",
-            (med['id'], today)
-        )
-        if not cur.fetchone():
-            # Insert if it doesn't exist
-            cur.execute(
-                "INSERT INTO dose_history (user_id, medication_id, scheduled_for, scheduled_time, status) VALUES (%s, %s, %s, %s, 'PENDING')",
-                (user_id, med['id'], today, med['time_to_take'])
-            )
+    Ensures dose_history is populated for all of a user's medications, from today through
+    the next `days - 1` days (the default of 1 covers today only). Medications with a
+    recurrence rule are expanded for just that window (see recurrence.py).
+    Inserts are backed by the unique key on (medication_id, scheduled_for, scheduled_time):
+    doses that already exist are skipped by ON CONFLICT DO NOTHING, so it is idempotent and
+    safe to call concurrently (e.g., on login and after adding a new medication).
+    Days are the user's local days. Returns the newly created doses.
+    """
+    today = user_today()
+    new_doses = repo.generate_doses(user_id, today, today + timedelta(days=max(days, 1) - 1))
+    if dose_scheduler and new_doses:
+        after_commit(lambda: dose_scheduler.add_doses(new_doses))
+    return new_doses
 
 # --- API Routes ---
 @app.route("/api/register", methods=["POST"])
-@with_db_cursor
-def register(cur):
+def register():
     data = request.get_json()
     name = data.get("name")
     email = data.get("email")
@@ -148,6 +180,7 @@ def register(cur):
     user_contact = data.get("user_contact")
     cc_name = data.get("cc_name")
     cc_contact = data.get("cc_contact")
+    timezone_name = data.get("timezone") or DEFAULT_TIMEZONE
 
     if not all([name, email, password, age_str, user_contact, cc_name, cc_contact]):
         return jsonify({"error": "All fields are required"}), 400
@@ -157,184 +190,589 @@ def register(cur):
         age = int(age_str)
     except (ValueError, TypeError):
         return jsonify({"error": "Age must be a valid number."}), 400
+    try:
+        timezone_name = valid_timezone(timezone_name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    cur.execute("SELECT id FROM users WHERE name=%s OR email=%s", (name, email))
-    if cur.fetchone():
+    # Like login, the lookup and the insert are short transactions of their own, so no pooled
+    # connection is held while the password is hashed.
+    try:
+        with storage.transaction() as repo:
+            exists = repo.user_exists(name, email)
+    except (*DatabaseErrors, ValueError, RuntimeError) as e:
+        print(f"Database Error in 'register': {e}")
+        return jsonify({"error": "A database error occurred. Please check server logs."}), 500
+    if exists:
         return jsonify({"error": "Username or email already exists"}), 409
 
-    hashed = generate_password_hash(password)
-    cur.execute(
-        "INSERT INTO users (name, email, age, contact, password_hash) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-        (name, email, age, user_contact, hashed), # Use the converted integer 'age'
-    )
-    user_id = cur.fetchone()["id"]
+    try:
+        hashed = hashing.pool.hash_password(password)
+    except hashing.HashingBusy:
+        return hashing_busy()
 
-    # Insert into close_contacts table
-    cur.execute(
-        "INSERT INTO close_contacts (user_id, name, contact) VALUES (%s, %s, %s)",
-        (user_id, cc_name, cc_contact)
-    )
+    # Creates the user and their close contact. Another registration may have taken the name
+    # or email while the password was hashed; the unique constraints catch that.
+    try:
+        with storage.transaction() as repo:
+            repo.create_user(name, email, age, user_contact, hashed, cc_name, cc_contact, timezone_name)
+    except IntegrityErrors:
+        return jsonify({"error": "Username or email already exists"}), 409
+    except (*DatabaseErrors, ValueError, RuntimeError) as e:
+        print(f"Database Error in 'register': {e}")
+        return jsonify({"error": "A database error occurred. Please check server logs."}), 500
 
     return jsonify({"success": True, "message": "User registered successfully"}), 201
 
 @app.route("/api/login", methods=["POST"])
-@with_db_cursor
-def login(cur):
+def login():
     data = request.get_json()
     name, password = data.get("name"), data.get("password")
 
-    cur.execute("SELECT * FROM users WHERE name=%s", (name,))
-    user = cur.fetchone()
+    # A transaction of its own: the pooled connection is returned before the slow hash check.
+    try:
+        with storage.transaction() as repo:
+            user = repo.find_user(name)
+    except (*DatabaseErrors, ValueError, RuntimeError) as e:
+        print(f"Database Error in 'login': {e}")
+        return jsonify({"error": "A database error occurred. Please check server logs."}), 500
 
-    if user and check_password_hash(user["password_hash"], password):
+    try:
+        valid = user is not None and hashing.pool.check_password(user["password_hash"], password)
+    except hashing.HashingBusy:
+        return hashing_busy()
+    if valid:
+        timezone_name = user["timezone"]
+        # The GUI sends the timezone of the computer it runs on, so the schedule follows the
+        # user when they travel. An unknown name is ignored rather than failing the login.
+        client_timezone = data.get("timezone")
+        if isinstance(client_timezone, str) and client_timezone != timezone_name:
+            try:
+                client_timezone = valid_timezone(client_timezone)
+            except ValueError:
+                client_timezone = None
+            if client_timezone:
+                try:
+                    with storage.transaction() as repo:
+                        move_timezone(repo, user["id"], timezone_name, client_timezone)
+                    run_after_commit()
+                    timezone_name = client_timezone
+                except (*DatabaseErrors, ValueError, RuntimeError) as e:
+                    # The login still succeeds, in the timezone the user had.
+                    g.pop('after_commit', None)
+                    print(f"Database Error in 'login': {e}")
         session["user_id"] = user["id"]
         session["user_name"] = user["name"]
-        generate_daily_doses(cur, user['id'])
-        return jsonify({"success": True, "user_id": user["id"], "name": user["name"]})
+        session["timezone"] = timezone_name
+        # Today's doses are generated by the first /api/bootstrap or /api/schedule call that follows.
+        return jsonify({"success": True, "user_id": user["id"], "name": user["name"], "timezone": timezone_name})
     else:
         return jsonify({"error": "Invalid login"}), 401
 
 @app.route("/api/add_medication", methods=["POST"])
-@with_db_cursor
-def add_medication(cur):
+@with_repository
+def add_medication(repo):
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not logged in. Please log in again."}), 401
 
     data = request.get_json()
-    cur.execute(
-        "INSERT INTO medications (user_id, medicine_name, dosage, time_to_take) VALUES (%s,%s,%s,%s)",
-        (user_id, data['medicine_name'], data['dosage'], data['time']),
-    )
+    rule, time_to_take, error = _read_recurrence(data.get('recurrence'), data.get('time'))
+    if error:
+        return jsonify({"error": error}), 400
+    if not time_to_take:
+        return jsonify({"error": "time (or recurrence.times) is required."}), 400
+    repo.add_medications(user_id, [(data['medicine_name'], data['dosage'], time_to_take, rule)])
     # Ensure today's schedule includes the newly added medication.
-    generate_daily_doses(cur, user_id)
+    generate_daily_doses(repo, user_id)
+    record_user_change(repo, user_id)
     return jsonify({"success": True, "message": "Medication added successfully"})
 
+def _read_recurrence(value, time_str):
+    """
+    Validates an optional recurrence rule, given as an object or as JSON text (a CSV column).
+    Returns (rule, time_to_take, error); without a rule, time_str is returned unchanged.
+    """
+    if value in (None, ''):
+        return None, time_str, None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None, None, "recurrence must be valid JSON."
+    try:
+        # A rule starts on the user's own today, not the server's, unless it says otherwise.
+        rule, time_to_take = parse_rule(value, time_str or None, today=user_today())
+    except ValueError as e:
+        return None, None, str(e)
+    return rule, time_to_take, None
+
+def _parse_medications(req):
+    """
+    Reads a bulk medication import: either a JSON array (or {"medications": [...]}) of
+    {medicine_name, dosage, time, recurrence} objects, or a text/csv body with a header row
+    containing the same columns (recurrence optional, as JSON text). Returns (rows, error)
+    where rows are (medicine_name, dosage, time, recurrence) tuples.
+    """
+    if req.mimetype == 'text/csv':
+        items = list(csv.DictReader(io.StringIO(req.get_data(as_text=True))))
+    else:
+        items = req.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get('medications')
+        if not isinstance(items, list):
+            return None, "Expected a JSON array of medications or a text/csv body."
+    if not items:
+        return None, "No medications given."
+    if len(items) > BULK_MAX_ITEMS:
+        return None, f"At most {BULK_MAX_ITEMS} medications can be imported at once."
+
+    rows = []
+    for i, item in enumerate(items, start=1):
+        if not isinstance(item, dict) or not item.get('medicine_name') or not (item.get('time') or item.get('recurrence')):
+            return None, f"Medication {i}: medicine_name and time (or recurrence) are required."
+        if any(item.get(field) is not None and not isinstance(item[field], str) for field in ('medicine_name', 'dosage', 'time')):
+            return None, f"Medication {i}: medicine_name, dosage and time must be strings."
+        time_str = (item.get('time') or '').strip()
+        if time_str:
+            try:
+                datetime.strptime(time_str, '%H:%M:%S' if time_str.count(':') == 2 else '%H:%M')
+            except ValueError:
+                return None, f"Medication {i}: time must be in HH:MM (24-hour) format."
+        rule, time_str, error = _read_recurrence(item.get('recurrence'), time_str)
+        if error:
+            return None, f"Medication {i}: {error}"
+        rows.append((item['medicine_name'].strip(), (item.get('dosage') or '').strip(), time_str, rule))
+    return rows, None
+
+@app.route("/api/medications/bulk", methods=["POST"])
+@with_repository
+def add_medications_bulk(repo):
+    """Imports many medications in one multi-row INSERT, then generates today's doses once."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    rows, error = _parse_medications(request)
+    if error:
+        return jsonify({"error": error}), 400
+
+    inserted = repo.add_medications(user_id, rows)
+    generate_daily_doses(repo, user_id)
+    record_user_change(repo, user_id)
+    return jsonify({"success": True, "medication_ids": inserted,
+                    "message": f"{len(inserted)} medications added successfully"}), 201
+
 @app.route("/api/medications", methods=["GET"])
-@with_db_cursor
-def get_all_medications(cur):
+@with_repository
+def get_all_medications(repo):
     """Gets a list of all medications for the user."""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not logged in. Please log in again."}), 401
 
-    cur.execute("SELECT id, medicine_name, dosage, time_to_take FROM medications WHERE user_id = %s ORDER BY time_to_take", (user_id,))
-    meds_raw = cur.fetchall()
-    medications = [dict(row) for row in meds_raw]
-    for med in medications:
-        med['time_to_take'] = med['time_to_take'].strftime('%H:%M:%S')
-    return jsonify({"success": True, "medications": medications})
+    # A cheap revision lookup answers conditional requests without running the list query.
+    etag = medications_etag(user_id, repo.get_data_revision(user_id))
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    medications = repo.list_medications(user_id)
+    return json_response(json.dumps({"success": True, "medications": medications}), etag)
 
 @app.route("/api/delete_medication", methods=["POST"])
-@with_db_cursor
-def delete_medication(cur):
+@with_repository
+def delete_medication(repo):
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not logged in. Please log in again."}), 401
 
     data = request.get_json()
     medication_id = data.get('medication_id')
+    try:
+        # The scheduler indexes doses by the integer id: "5" would leave them tracked.
+        medication_id = int(medication_id)
+    except (ValueError, TypeError):
+        return jsonify({"error": "medication_id must be a numeric id."}), 400
 
     # The ON DELETE CASCADE in the database will also delete related dose_history records.
-    cur.execute("DELETE FROM medications WHERE id = %s AND user_id = %s", (medication_id, user_id))
-    if cur.rowcount == 0:
+    if not repo.delete_medication(user_id, medication_id):
         return jsonify({"error": "Medication not found or you do not have permission to delete it."}), 404
+    if dose_scheduler:
+        after_commit(lambda: dose_scheduler.discard_medication(medication_id))
+    record_user_change(repo, user_id)
     return jsonify({"success": True, "message": "Medication deleted successfully."})
 
+@app.route("/api/timezone", methods=["POST"])
+@with_repository
+def set_timezone(repo):
+    """
+    Moves the user to another timezone, e.g. after travelling. Doses keep their local time
+    of day; the due_at of every pending dose is moved to that time in the new timezone.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    try:
+        timezone_name = valid_timezone((request.get_json(silent=True) or {}).get('timezone'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    move_timezone(repo, user_id, session.get('timezone', DEFAULT_TIMEZONE), timezone_name)
+    session["timezone"] = timezone_name
+    return jsonify({"success": True, "timezone": timezone_name})
+
+def move_timezone(repo, user_id, from_timezone, to_timezone):
+    """Sets the user's timezone and moves their pending doses to the same local times in it."""
+    since = min(local_today(from_timezone), local_today(to_timezone)) - timedelta(days=MISSED_LOOKBACK_DAYS)
+    moved = repo.set_timezone(user_id, to_timezone, since)
+    if dose_scheduler and moved:
+        after_commit(lambda: dose_scheduler.add_doses(moved))
+    record_user_change(repo, user_id)
+
 @app.route("/api/schedule", methods=["GET"])
-@with_db_cursor
-def get_schedule(cur):
+def get_schedule():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    # Most refreshes find nothing changed: serve them from the cache without touching the database.
+    today = user_today()
+    cached = schedule_cache.get(user_id, today)
+    if cached is None:
+        return _load_schedule(user_id, today)
+    payload, etag = cached
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    return json_response(payload, etag)
+
+@with_repository
+def _load_schedule(repo, user_id, today):
+    # Taken before anything is read, so a write that commits meanwhile keeps this out of the cache.
+    generation = schedule_cache.generation(user_id)
+    # If the client already has the current version, skip the schedule query entirely.
+    etag = schedule_etag(user_id, today, repo.get_data_revision(user_id))
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    generate_daily_doses(repo, user_id)
+    schedule = repo.get_schedule(user_id, today)
+    payload = json.dumps({"success": True, "schedule": schedule})
+    after_commit(lambda: schedule_cache.put(user_id, today, payload, etag, generation))
+    return json_response(payload, etag)
+
+@app.route("/api/bootstrap", methods=["GET"])
+@with_repository
+def bootstrap(repo):
+    """
+    Everything the GUI needs right after login, in one request and one transaction:
+    the profile, today's schedule and the medication list. Apart from generating today's
+    doses, it is a single query on PostgreSQL. The ETags of /api/schedule and
+    /api/medications are included so later refreshes can be conditional.
+
+    Missed-dose alerts are not repeated here; they reach the GUI once, over
+    /api/alerts/stream.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not logged in. Please log in again."}), 401
 
-    generate_daily_doses(cur, user_id)
-    cur.execute(
-        """
-        SELECT dh.id as dose_id, m.medicine_name, m.dosage, dh.scheduled_time, dh.status
-        FROM dose_history dh
-        JOIN medications m ON dh.medication_id = m.id
-        WHERE dh.user_id = %s AND dh.scheduled_for = %s
-        ORDER BY dh.scheduled_time;
-        """,
-        (user_id, date.today())
-    )
-    schedule_raw = cur.fetchall()
-    schedule = [dict(row) for row in schedule_raw]
-    for item in schedule:
-        item['scheduled_time'] = item['scheduled_time'].strftime('%H:%M:%S')
-    return jsonify({"success": True, "schedule": schedule})
+    today = user_today()
+    generation = schedule_cache.generation(user_id)
+    generate_daily_doses(repo, user_id)
+    row = repo.bootstrap(user_id, today)
+    if row is None:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    schedule = row['schedule']
+    etag = schedule_etag(user_id, today, row['data_revision'])
+    # Warm the schedule cache, so the next refresh is answered from memory.
+    schedule_payload = json.dumps({"success": True, "schedule": schedule})
+    after_commit(lambda: schedule_cache.put(user_id, today, schedule_payload, etag, generation))
+    return jsonify({
+        "success": True,
+        "profile": {
+            "user_id": row['id'], "name": row['name'], "email": row['email'], "age": row['age'],
+            "contact": row['contact'], "close_contact": row['close_contact'], "timezone": row['timezone'],
+        },
+        "schedule": schedule,
+        "medications": row['medications'],
+        # In the quoted form the endpoints send in their ETag header.
+        "etags": {
+            "/schedule": f'"{etag}"',
+            "/medications": f'"{medications_etag(user_id, row["data_revision"])}"',
+        },
+    })
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    """Hit/miss counters of the schedule cache."""
+    return jsonify({"success": True, "schedule_cache": schedule_cache.stats()})
+
+@app.route("/api/pool_stats", methods=["GET"])
+def get_pool_stats():
+    """Wait time, checkout duration, in-use and exhaustion counters of the database pool."""
+    return jsonify({"success": True, "pool": pool_stats()})
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Request, database, pool, notification and cache metrics in Prometheus text format."""
+    pool = pool_stats()
+    cache = schedule_cache.stats()
+    hashes = hashing.pool.stats()
+    extra = [
+        metrics.render_gauges("db_pool_connections_in_use", "Pooled connections currently checked out.", pool.get("in_use", 0)),
+        metrics.render_gauges("db_pool_connections_idle", "Open pooled connections waiting to be reused.", pool.get("idle", 0)),
+        metrics.render_gauges("db_pool_connections_opened_total", "Database connections the pool has opened.", pool.get("opened", 0), "counter"),
+        metrics.render_gauges("db_pool_connections_max", "Size limit of the connection pool.", pool.get("max_size", 0)),
+        metrics.render_gauges("db_pool_exhausted_total", "Checkouts that timed out waiting for a connection.", pool.get("exhausted", 0), "counter"),
+        metrics.render_gauges("schedule_cache_requests_total", "Schedule cache lookups by result.",
+                              {'result="hit"': cache.get("hits", 0), 'result="miss"': cache.get("misses", 0)}, "counter"),
+        metrics.render_gauges("password_hash_pending", "Password hashes running or queued in the hashing pool.", hashes["pending"]),
+        metrics.render_gauges("password_hashes_total", "Password hashes computed by the hashing pool.", hashes["hashes"], "counter"),
+        metrics.render_gauges("password_hash_refused_total", "Logins and registrations answered with 429, by reason.",
+                              {'reason="busy"': hashes["rejected"], 'reason="timeout"': hashes["timeouts"]}, "counter"),
+    ]
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+def confirmable_since():
+    """
+    The oldest (local) date of the doses a user usually confirms: the same window the sweeper
+    looks back over. Looking there first keeps the UPDATE on the newest dose_history partitions;
+    older doses can still be confirmed (see PostgresRepository.confirm).
+    """
+    return user_today() - timedelta(days=MISSED_LOOKBACK_DAYS)
 
 @app.route('/api/confirm_dose', methods=['POST'])
-@with_db_cursor
-def confirm_dose(cur):
+@with_repository
+def confirm_dose(repo):
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not logged in. Please log in again."}), 401
 
     data = request.get_json()
     dose_id = data.get('dose_id')
-    cur.execute(
-        "UPDATE dose_history SET status = 'TAKEN', updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s",
-        (dose_id, user_id)
-    )
+    try:
+        dose_id = int(dose_id)
+    except (ValueError, TypeError):
+        return jsonify({"error": "dose_id must be a numeric id."}), 400
+    confirmed = repo.confirm(user_id, [dose_id], confirmable_since())
+    if not confirmed:
+        return jsonify({"error": "Dose not found."}), 404
+    if dose_scheduler:
+        after_commit(lambda: dose_scheduler.discard(dose_id))
+    record_user_change(repo, user_id)
     return jsonify({"success": True, "message": "Dose confirmed"})
 
-@app.route('/api/check_missed_doses', methods=['GET'])
-@with_db_cursor
-def check_missed_doses(cur):
+@app.route('/api/confirm_doses', methods=['POST'])
+@with_repository
+def confirm_doses(repo):
+    """Confirms many doses with a single UPDATE. Returns the ids that were actually confirmed."""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not logged in. Please log in again."}), 401
 
-    missed_alerts = []
-    ten_minutes_ago = datetime.now() - timedelta(minutes=10)
-    # Fetch the user's contact info.
-    # Use FOR UPDATE SKIP LOCKED to prevent deadlocks. This tells the database to select rows for updating,
-    # but to skip any rows that are already locked by another transaction (e.g., a concurrent delete operation).
-    # This makes the background check more robust.
-    cur.execute(
-        """
-        SELECT dh.id, m.medicine_name, u.name as user_name, u.contact as user_contact, u.email as user_email,
-               cc.name as cc_name, cc.contact as cc_contact
-        FROM dose_history dh
-        JOIN medications m ON dh.medication_id = m.id
-        JOIN users u ON dh.user_id = u.id
-        LEFT JOIN close_contacts cc ON dh.user_id = cc.user_id
-        WHERE dh.user_id = %s AND dh.scheduled_for = %s AND dh.status = 'PENDING' AND dh.scheduled_time < %s
-        FOR UPDATE SKIP LOCKED;
-        """,
-        (user_id, date.today(), ten_minutes_ago.time())
-    )
-    missed_doses = cur.fetchall()
-
-    for dose in missed_doses:
-        cur.execute("UPDATE dose_history SET status = 'MISSED' WHERE id = %s", (dose['id'],))
-        patient_name = dose['user_name']
-
-        # --- Send Notification to User ---
-        user_email_subject = "Medication Reminder: Missed Dose"
-        user_email_body = f"Hi {patient_name},\n\nThis is a reminder that you missed your dose for {dose['medicine_name']}.\n\nPlease take it as soon as possible.\n\n- MedReminder App"
-        user_sms_body = f"MedReminder Alert: Hi {patient_name}, it looks like you missed your {dose['medicine_name']} dose. Please take it as soon as possible."
-        send_sms(dose['user_contact'], user_sms_body)
-        send_email(dose['user_email'], user_email_subject, user_email_body)
-
-        # --- Send Notification to Close Contact ---
-        if dose.get('cc_contact'):
-            cc_sms_body = f"MedReminder Alert: {patient_name} has missed their {dose['medicine_name']} dose. Please check on them."
-            send_sms(dose['cc_contact'], cc_sms_body)
-            # We don't have email for close contact, so only SMS is sent.
-            gui_alert_message = f"ALERT: Missed {dose['medicine_name']} dose. Sending reminders to you and your contact, {dose['cc_name']}."
-        else:
-            gui_alert_message = f"ALERT: Missed {dose['medicine_name']} dose. Sending reminders to you."
+    dose_ids = (request.get_json(silent=True) or {}).get('dose_ids')
+    if not isinstance(dose_ids, list) or not dose_ids:
+        return jsonify({"error": "dose_ids must be a non-empty list."}), 400
+    if len(dose_ids) > BULK_MAX_ITEMS:
+        return jsonify({"error": f"At most {BULK_MAX_ITEMS} doses can be confirmed at once."}), 400
+    try:
+        dose_ids = [int(dose_id) for dose_id in dose_ids]
+    except (ValueError, TypeError):
+        return jsonify({"error": "dose_ids must contain numeric ids."}), 400
+
+    confirmed = repo.confirm(user_id, dose_ids, confirmable_since())
+    if dose_scheduler and confirmed:
+        after_commit(lambda: [dose_scheduler.discard(dose_id) for dose_id in confirmed])
+    record_user_change(repo, user_id)
+    return jsonify({"success": True, "confirmed": confirmed, "message": f"{len(confirmed)} doses confirmed"})
+
+@app.route('/api/check_missed_doses', methods=['GET'])
+@with_repository
+def check_missed_doses(repo):
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
 
-        missed_alerts.append(gui_alert_message)
+    # The same overdue-dose claim the background sweeper uses, restricted to this user.
+    # The alerts are queued in the outbox within this transaction and sent by the dispatcher,
+    # so the response never waits on Twilio or SMTP while holding the row locks.
+    missed_doses, missed_alerts = process_missed_doses(repo, user_id=user_id)
+    if missed_doses:
+        invalidate_schedule(user_id)
 
     return jsonify({"success": True, "missed_alerts": missed_alerts})
 
+@app.route('/api/adherence', methods=['GET'])
+@with_repository
+def get_adherence(repo):
+    """
+    The user's adherence between `from` and `to` (YYYY-MM-DD), per `granularity` (day,
+    week or month) and per medication, read from the adherence_daily rollup.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    first, last, granularity, error = parse_range(request.args, user_today())
+    if error:
+        return jsonify({"error": error}), 400
+    report = build_report(repo.adherence_by_day(user_id, first, last), first, last, granularity)
+    return jsonify(dict(report, success=True))
+
+@app.route('/api/caregivers', methods=['GET'])
+@with_repository
+def get_caregivers(repo):
+    """The users the logged-in patient has let see their adherence reports."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    return jsonify({"success": True, "caregivers": repo.list_caregivers(user_id)})
+
+@app.route('/api/caregivers', methods=['POST'])
+@with_repository
+def grant_caregiver(repo):
+    """
+    Lets another user, by user name, see the logged-in patient's adherence reports. Only the
+    patient can grant this: a contact number that matches their close contact is not enough,
+    since nobody verifies the contact numbers users register with.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    name = (request.get_json(silent=True) or {}).get('name')
+    if not isinstance(name, str) or not name.strip():
+        return jsonify({"error": "name (the caregiver's user name) is required."}), 400
+    if name.strip() == session.get('user_name'):
+        return jsonify({"error": "You can't add yourself as a caregiver."}), 400
+    caregiver_id = repo.grant_caregiver(user_id, name.strip())
+    if caregiver_id is None:
+        return jsonify({"error": "No user with that name."}), 404
+    return jsonify({"success": True, "caregiver": {"id": caregiver_id, "name": name.strip()}}), 201
+
+@app.route('/api/caregivers/revoke', methods=['POST'])
+@with_repository
+def revoke_caregiver(repo):
+    """Withdraws a caregiver's access to the logged-in patient's reports."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    name = (request.get_json(silent=True) or {}).get('name')
+    if not isinstance(name, str) or not repo.revoke_caregiver(user_id, name.strip()):
+        return jsonify({"error": "That user is not one of your caregivers."}), 404
+    return jsonify({"success": True})
+
+@app.route('/api/caregiver/patients', methods=['GET'])
+@with_repository
+def get_caregiver_patients(repo):
+    """The patients who have granted the logged-in user access (see /api/caregivers)."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    return jsonify({"success": True, "patients": repo.caregiver_patients(user_id)})
+
+@app.route('/api/caregiver/patients/<int:patient_id>/adherence', methods=['GET'])
+@with_repository
+def get_patient_adherence(repo, patient_id):
+    """The same report as /api/adherence, for one of the caregiver's patients."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    first, last, granularity, error = parse_range(request.args, user_today())
+    if error:
+        return jsonify({"error": error}), 400
+    if patient_id not in {patient['id'] for patient in repo.caregiver_patients(user_id)}:
+        return jsonify({"error": "Patient not found or they haven't added you as a caregiver."}), 404
+    report = build_report(repo.adherence_by_day(patient_id, first, last), first, last, granularity)
+    return jsonify(dict(report, success=True, patient_id=patient_id))
+
+ALERT_STREAM_KEEPALIVE_SECONDS = 15
+# Open alert streams allowed per process (0 = no limit). On a threaded server every stream
+# holds a request thread for as long as it is open; the cap keeps threads free for the
+# other requests, and clients beyond it are told to retry (or use the stream server).
+ALERT_STREAM_MAX = int(os.getenv("ALERT_STREAM_MAX", 0))
+_alert_stream_slots = threading.BoundedSemaphore(ALERT_STREAM_MAX) if ALERT_STREAM_MAX > 0 else None
+
+@app.route('/api/alerts/stream', methods=['GET'])
+def alert_stream():
+    """
+    Server-Sent Events stream of the user's 'missed' and 'schedule_changed' events,
+    pushed the moment they are committed (see events.py). The stream holds no database
+    connection; idle streams only get a comment line every few seconds as a keep-alive.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not logged in. Please log in again."}), 401
+
+    if _alert_stream_slots and not _alert_stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open alert streams. Please try again later."})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+    events = broker.subscribe(user_id)
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = events.get(timeout=ALERT_STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            broker.unsubscribe(user_id, events)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    if _alert_stream_slots:
+        # On close, not in generate(): a stream that is never iterated must free its slot too.
+        response.call_on_close(_alert_stream_slots.release)
+    return response
+
+def start_background_services():
+    """
+    Starts the optional background workers inside this process, as configured in .env.
+    """
+    global dose_scheduler
+    # First, while this process has no other threads: forks the password hashing workers.
+    hashing.pool.start()
+    # Feeds /api/alerts/stream with the events that any process publishes via pg_notify.
+    # Every event also means the user's schedule changed, so the listener doubles as
+    # cache invalidation for writes made by other processes (e.g., a separate sweeper).
+    broker.add_listener(lambda event: schedule_cache.invalidate_user(event.get('user_id')))
+    if storage.name == 'postgres':
+        # With SQLite, events are handed to the broker directly when their transaction commits.
+        start_event_listener()
+    if os.environ.get('RUN_NOTIFICATION_DISPATCHER', '1').lower() in ('1', 'true', 'yes'):
+        # Sends the alerts queued in notification_outbox. Set this to 0 when running
+        # `python outbox.py` as a separate process instead.
+        start_dispatcher()
+    run_scheduler = os.environ.get('RUN_DOSE_SCHEDULER', '1').lower() in ('1', 'true', 'yes')
+    if run_scheduler:
+        # Marks each dose MISSED the moment it becomes overdue, from an in-memory heap
+        # that the routes keep up to date, instead of rescanning dose_history. When several
+        # processes run it, an advisory lock makes one of them active (see SchedulerLock).
+        dose_scheduler = DoseScheduler(on_overdue=lambda dose_ids: _invalidate_missed(mark_doses_missed(dose_ids))).start()
+    if os.environ.get('RUN_MISSED_DOSE_SWEEPER', '1').lower() in ('1', 'true', 'yes'):
+        # Detect missed doses for every user from inside this process; the GUI no longer
+        # polls for them but is told through its alert stream. Next to the scheduler it only
+        # catches what the scheduler didn't track, so it runs far less often. Set this to 0
+        # when running `python sweeper.py` as a separate process instead.
+        if run_scheduler:
+            start_sweeper_thread(interval=SCHEDULER_SWEEP_INTERVAL_SECONDS, on_missed=_invalidate_missed)
+        else:
+            start_sweeper_thread(on_missed=_invalidate_missed)
+
 if __name__ == "__main__":
     # IMPORTANT: use_reloader=False is crucial for development when using a database
     # connection pool. The Flask auto-reloader can cause connection leaks by not
     # properly closing the pool on restart. Disabling it makes the server stable,
     # but you will need to manually restart it after making code changes.
+    start_background_services()
     app.run(debug=True, port=5001, use_reloader=False)
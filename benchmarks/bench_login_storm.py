@@ -0,0 +1,144 @@
+# /medication-reminder-app/benchmarks/bench_login_storm.py
+"""
+Simulates a login storm (everyone opening the app at the morning dose time) against the real
+backend.app in-process, while a few already logged-in clients keep refreshing their schedule.
+Runs the storm twice: hashing inline on the request threads with no admission limit (the
+old behaviour), then through the hashing pool of hashing.py. A client refused with 429
+retries after a random delay of up to its Retry-After, as a well-behaved client would.
+For each run it reports login latency (to the successful attempt) and throughput, how many
+attempts were refused, and the latency of the schedule refreshes that had to share the
+process with the storm.
+
+    python benchmarks/bench_login_storm.py --storage sqlite --logins 200 --concurrency 32
+    python benchmarks/bench_login_storm.py --create-db --workers 4 --max-pending 16
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from loadtest import PASSWORD, create_database, drop_database, percentile, seed_users
+
+def _login(client, name):
+    return client.post("/api/login", json={"name": name, "password": PASSWORD})
+
+def run_storm(app, names, logins, concurrency, refreshers):
+    """Fires `logins` logins from `concurrency` threads while `refreshers` clients refresh. Returns the samples."""
+    login_samples, refresh_samples = [], []
+    lock = threading.Lock()
+    remaining = [logins]
+    stop = threading.Event()
+
+    def storm_worker(seed):
+        client, rng = app.test_client(), random.Random(seed)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started, name, refused = time.perf_counter(), rng.choice(names), 0
+            while True:
+                response = _login(client, name)
+                if response.status_code != 429:
+                    break
+                refused += 1
+                time.sleep(rng.uniform(0, float(response.headers.get("Retry-After", 1))))
+            with lock:
+                login_samples.append((response.status_code, refused, time.perf_counter() - started))
+
+    def refresher(client):
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get("/api/schedule")
+            with lock:
+                refresh_samples.append(time.perf_counter() - started)
+            stop.wait(0.05)
+
+    clients = [app.test_client() for _ in range(refreshers)]
+    for client, name in zip(clients, names):
+        _login(client, name)
+        client.get("/api/schedule")  # warms the schedule cache, as a running GUI would have
+    refresh_threads = [threading.Thread(target=refresher, args=(c,), daemon=True) for c in clients]
+    for thread in refresh_threads:
+        thread.start()
+    started = time.perf_counter()
+    storm_threads = [threading.Thread(target=storm_worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in storm_threads:
+        thread.start()
+    for thread in storm_threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    for thread in refresh_threads:
+        thread.join()
+    return login_samples, refresh_samples, wall
+
+def report(label, login_samples, refresh_samples, wall):
+    ok = sorted(seconds * 1000 for status, _, seconds in login_samples if status == 200)
+    refused = sum(refused for _, refused, _ in login_samples)
+    errors = sum(1 for status, _, _ in login_samples if status != 200)
+    refresh = sorted(seconds * 1000 for seconds in refresh_samples)
+    print(f"{label:<8}{len(ok):>6}{refused:>6}{errors:>7}{len(ok) / wall:>9.1f}"
+          f"{percentile(ok, 50):>9.0f}{percentile(ok, 95):>9.0f}"
+          f"{len(refresh):>9}{percentile(refresh, 50):>9.1f}{percentile(refresh, 95):>9.1f}"
+          f"{(max(refresh) if refresh else 0):>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="Accounts to log in as.")
+    parser.add_argument("--logins", type=int, default=200, help="Logins fired per run.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Threads firing logins (the request threads).")
+    parser.add_argument("--refreshers", type=int, default=4, help="Logged-in clients refreshing their schedule meanwhile.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Hashing pool processes.")
+    parser.add_argument("--max-pending", type=int, help="Hashing pool admission limit (default: 4 per worker).")
+    parser.add_argument("--storage", choices=("postgres", "sqlite"), default=os.getenv("STORAGE_BACKEND", "postgres"))
+    parser.add_argument("--create-db", action="store_true", help="Run against a throwaway PostgreSQL database.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_POOL_MAX", str(args.concurrency + args.refreshers + 2))
+    os.environ["STORAGE_BACKEND"] = args.storage
+    # Only the requests are measured: no sweeper or dispatcher threads competing for the CPU.
+    os.environ["RUN_MISSED_DOSE_SWEEPER"] = os.environ["RUN_NOTIFICATION_DISPATCHER"] = "0"
+    db_name = sqlite_dir = None
+    if args.storage == "sqlite":
+        sqlite_dir = tempfile.mkdtemp(prefix="med_reminder_login_storm_")
+        os.environ["SQLITE_PATH"] = os.path.join(sqlite_dir, "storm.sqlite3")
+    elif args.create_db:
+        db_name = f"{os.getenv('DB_NAME', 'med_reminder')}_login_storm_{os.getpid()}"
+        create_database(db_name)
+        from init_db import create_tables
+        create_tables()
+
+    try:
+        import hashing
+        from backend import app
+        names = seed_users(args.users, 1, random.Random(1))
+        max_pending = args.max_pending or max(args.workers, 1) * 4
+        print(f"{args.logins} logins from {args.concurrency} threads, {args.refreshers} clients refreshing, "
+              f"{os.cpu_count()} CPU(s).")
+        print(f"{'':<8}{'ok':>6}{'429':>6}{'errors':>7}{'login/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'refresh':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+        runs = (("inline", hashing.HashingPool(workers=0, max_pending=args.logins + args.concurrency)),
+                ("pool", hashing.HashingPool(workers=args.workers, max_pending=max_pending).start()))
+        for label, pool in runs:
+            hashing.pool = pool
+            report(label, *run_storm(app, names, args.logins, args.concurrency, args.refreshers))
+        stats = hashing.pool.stats()
+        print(f"Pool: {stats['workers']} worker(s), limit {stats['limit']}, peak {stats['max_pending']} pending, "
+              f"{stats['seconds_total'] / max(stats['hashes'], 1) * 1000:.0f} ms per hash incl. queueing.")
+    finally:
+        if db_name:
+            from database import get_pool
+            get_pool().closeall()
+            drop_database(db_name)
+        if sqlite_dir:
+            shutil.rmtree(sqlite_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
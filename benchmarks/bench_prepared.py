@@ -0,0 +1,110 @@
+# /medication-reminder-app/benchmarks/bench_prepared.py
+"""
+Compares the hot read queries of a schedule refresh (revision lookup + schedule join) run as
+plain SQL against the same queries run through the prepared-statement registry, on a real
+database. Reports the server's planning time per query (from EXPLAIN ANALYZE) and the
+client-side round-trip time per refresh.
+
+Like a request, every refresh checks a connection out of the pool and returns it, and
+`--clients` threads refresh at once, so the prepared numbers include PREPAREing the
+statements on each connection the pool opens.
+
+    python benchmarks/bench_prepared.py --iterations 2000 --clients 8
+    python benchmarks/bench_prepared.py --user-id 42
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import psycopg2.extras
+import database
+from database import get_db_connection, release_db_connection, execute_prepared
+from repository import DATA_REVISION_SQL, SCHEDULE_SQL
+
+def planning_ms(cur, statement):
+    """Planning time the server reports for one execution of `statement`."""
+    cur.execute(f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {statement}")
+    return cur.fetchone()[0][0]["Planning Time"]
+
+def refresh(queries, execute):
+    """One schedule refresh on a pooled connection; returns its milliseconds."""
+    started = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            for name, params in queries:
+                execute(cur, name, params)
+                cur.fetchall()
+        conn.rollback()
+    finally:
+        release_db_connection(conn)
+    return (time.perf_counter() - started) * 1000
+
+def time_refreshes(iterations, clients, queries, execute):
+    """Runs `iterations` refreshes from `clients` threads; returns the milliseconds per refresh."""
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        return list(executor.map(lambda _: refresh(queries, execute), range(iterations)))
+
+def execute_plain(cur, name, params):
+    cur.execute(database._statements[name][2], params)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=4, help="Refreshes running at once.")
+    parser.add_argument("--user-id", type=int, help="Defaults to the user with the most doses today.")
+    args = parser.parse_args()
+
+    today = date.today()
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            user_id = args.user_id
+            if user_id is None:
+                cur.execute("SELECT user_id FROM dose_history WHERE scheduled_for = %s "
+                            "GROUP BY user_id ORDER BY count(*) DESC LIMIT 1", (today,))
+                row = cur.fetchone()
+                if row is None:
+                    sys.exit("No doses scheduled today; log in with the GUI first or pass --user-id.")
+                user_id = row[0]
+            params = {"user_id": user_id, "day": today}
+            queries = [(DATA_REVISION_SQL, params), (SCHEDULE_SQL, params)]
+
+            print(f"Planning time per query (user {user_id}, median of 20 runs):")
+            for name, p in queries:
+                body, order, sql = database._statements[name]
+                plain_plan = statistics.median(planning_ms(cur, cur.mogrify(sql, p).decode()) for _ in range(20))
+                cur.execute(f"PREPARE bench_{name} AS {body}")
+                execute_sql = cur.mogrify(f"EXECUTE bench_{name} ({', '.join(['%s'] * len(order))})", [p[k] for k in order]).decode()
+                prepared_plan = statistics.median(planning_ms(cur, execute_sql) for _ in range(20))
+                cur.execute(f"DEALLOCATE bench_{name}")
+                print(f"  {name:<18} plain {plain_plan:.3f} ms   prepared {prepared_plan:.3f} ms")
+        conn.rollback()
+    finally:
+        release_db_connection(conn)
+
+    # Opens the clients' connections up front, so neither run pays for opening them.
+    time_refreshes(args.clients * 4, args.clients, queries, execute_plain)
+    database.DB_PREPARE_STATEMENTS = True
+    print(f"Round trip per refresh ({args.iterations} refreshes from {args.clients} clients, "
+          f"a pooled connection each):")
+    results = {}
+    for label, execute in (("plain", execute_plain), ("prepared", execute_prepared)):
+        opened_before = database.pool_stats()["opened"]
+        timings = time_refreshes(args.iterations, args.clients, queries, execute)
+        results[label] = statistics.mean(timings)
+        print(f"{label:>10}: {statistics.mean(timings):.3f} ms/refresh "
+              f"(p95 {statistics.quantiles(timings, n=20)[-1]:.3f} ms, "
+              f"{database.pool_stats()['opened'] - opened_before} connection(s) opened)")
+
+    saved = results["plain"] - results["prepared"]
+    print(f"Saved {saved:.3f} ms per refresh ({saved / results['plain']:.0%}).")
+
+if __name__ == "__main__":
+    main()
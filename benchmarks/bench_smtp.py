@@ -0,0 +1,58 @@
+# /medication-reminder-app/benchmarks/bench_smtp.py
+"""
+Compares one-connection-per-email (the old send_email) against the pooled, pipelined
+SMTPConnectionPool, offline, against a local aiosmtpd stand-in server.
+
+    pip install aiosmtpd
+    python benchmarks/bench_smtp.py --messages 500
+"""
+import argparse
+import os
+import smtplib
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from notifications import SMTPConnectionPool, _build_email
+
+def run_unpooled(host, port, messages):
+    for msg in messages:
+        with smtplib.SMTP(host, port) as server:
+            server.send_message(msg)
+
+def run_pooled(host, port, messages, batch_size):
+    pool = SMTPConnectionPool(host, port, starttls=False)
+    for i in range(0, len(messages), batch_size):
+        pool.send_messages(messages[i:i + batch_size])
+    pool.close_all()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=10, help="Emails per pooled bulk send (the outbox batch size).")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.handlers import Sink
+    except ImportError:
+        sys.exit("aiosmtpd is required for the local stand-in server: pip install aiosmtpd")
+
+    controller = Controller(Sink(), hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        messages = [_build_email(f"patient{i}@example.com", "Medication Reminder: Missed Dose", "Benchmark body")
+                    for i in range(args.messages)]
+        for label, run in (("one connection per email", lambda: run_unpooled("127.0.0.1", args.port, messages)),
+                           ("pooled + pipelined", lambda: run_pooled("127.0.0.1", args.port, messages, args.batch_size))):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            print(f"{label:>26}: {args.messages} emails in {elapsed:.2f}s ({args.messages / elapsed:.0f} emails/s)")
+    finally:
+        controller.stop()
+
+if __name__ == "__main__":
+    main()
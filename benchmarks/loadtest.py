@@ -0,0 +1,415 @@
+# /medication-reminder-app/benchmarks/loadtest.py
+"""
+Load-tests the real backend.app in-process with N simulated GUI clients, each with its own
+session cookie, following the traffic pattern of gui.py:
+
+  gui      (the current client) login, one /api/bootstrap, then a conditional /api/schedule
+           refresh per minute (what the alert stream triggers), with the in-process sweeper
+           marking missed doses.
+  polling  (the original client) login, /api/schedule and /api/medications, then
+           /api/check_missed_doses every minute, followed by a schedule refresh.
+
+On top of that, users randomly confirm pending doses, add medications, open the medication
+list and delete what they added, each followed by the refresh the GUI makes.
+
+Time is compressed by --speedup (60 = one simulated minute per second), so thousands of
+users need only --concurrency worker threads. Users, medications and contacts are seeded
+with plain SQL, so no password hashing is spent on setup (login still checks the hash).
+
+With --storage sqlite it runs anywhere, against a throwaway SQLite file (see repository.py).
+On PostgreSQL, --create-db creates a throwaway database next to DB_NAME, runs init_db on it
+and drops it afterwards. Results (p50/p95/p99 per endpoint over the answered requests,
+errors, logins refused with 429, requests per second, queries per request) are printed and
+saved as JSON, with each endpoint's count per status. The run fails when more than
+--max-failure-share of an endpoint's responses have a status of 400 or more, and --compare
+fails it when p95 or queries per request regress against an earlier result file.
+
+    python benchmarks/loadtest.py --users 200 --storage sqlite
+    python benchmarks/loadtest.py --users 1000 --concurrency 32 --create-db --output results.json
+    python benchmarks/loadtest.py --users 1000 --concurrency 32 --create-db --compare results.json
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PASSWORD = "loadtest-password"
+TICK_SECONDS = 60  # simulated seconds between the periodic refreshes / polls of one client
+
+def create_database(name):
+    """Creates an empty database on the server from .env and points DB_NAME at it."""
+    import psycopg2
+    conn = psycopg2.connect(dbname="postgres", user=os.getenv("DB_USER", "postgres"), password=os.getenv("DB_PASS"),
+                            host=os.getenv("DB_HOST", "localhost"), port=os.getenv("DB_PORT", "5432"))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+    os.environ["DB_NAME"] = name
+
+def drop_database(name):
+    import psycopg2
+    conn = psycopg2.connect(dbname="postgres", user=os.getenv("DB_USER", "postgres"), password=os.getenv("DB_PASS"),
+                            host=os.getenv("DB_HOST", "localhost"), port=os.getenv("DB_PORT", "5432"))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    conn.close()
+
+def seed_users(count, meds_per_user, rng):
+    """Inserts `count` users with contacts and medications spread over the day. Returns their names."""
+    from werkzeug.security import generate_password_hash
+    from repository import get_storage
+
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    names = [f"loadtest-{run_id}-{i}" for i in range(count)]
+    password_hash = generate_password_hash(PASSWORD)
+    with get_storage().transaction() as repo:
+        for name in names:
+            user_id = repo.create_user(name, f"{name}@example.com", 70, "+15550000000", password_hash,
+                                       "Caregiver", "+15550000001")
+            repo.add_medications(user_id, [
+                (f"Medicine {j}", "1 tablet", f"{rng.randrange(24):02d}:{rng.randrange(0, 60, 5):02d}", None)
+                for j in range(meds_per_user)
+            ])
+    return names
+
+class Recorder:
+    """Collects (endpoint, status, seconds, queries) for every request, from all worker threads."""
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, status, seconds, queries):
+        with self._lock:
+            self.samples.append((endpoint, status, seconds, queries))
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+def summarize(samples, wall_seconds):
+    def stats(rows):
+        # Latency of answered requests only: a 429 or an error returns early and would make the
+        # percentiles look better than what the users who got through saw.
+        latencies = sorted(seconds * 1000 for _, status, seconds, _ in rows if status < 400)
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for _, status, _, _ in rows if status >= 400 and status != 429),
+            "refused": sum(1 for _, status, _, _ in rows if status == 429),
+            "statuses": {str(status): count for status, count in sorted(Counter(status for _, status, _, _ in rows).items())},
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "queries_per_request": round(sum(q for _, _, _, q in rows) / len(rows), 2) if rows else 0.0,
+        }
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    overall = stats(samples)
+    overall["requests_per_second"] = round(len(samples) / wall_seconds, 1) if wall_seconds else 0.0
+    return overall, {endpoint: stats(rows) for endpoint, rows in sorted(by_endpoint.items())}
+
+class VirtualUser:
+    """One simulated GUI client. step() performs its next action and returns the simulated delay until the one after."""
+    def __init__(self, app, name, profile, recorder, query_counts, rng):
+        self.client = app.test_client()
+        self.name = name
+        self.profile = profile
+        self.recorder = recorder
+        self.query_counts = query_counts
+        self.rng = rng
+        self.etags = {}
+        self.pending_doses = []
+        self.added_medications = 0
+        self.logged_in = False
+
+    def call(self, endpoint, method, path, conditional=False, **kwargs):
+        headers = {}
+        if conditional and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        started = time.perf_counter()
+        response = self.client.open(f"/api{path}", method=method, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - started
+        self.recorder.add(endpoint, response.status_code, elapsed, self.query_counts.last)
+        if conditional and response.headers.get("ETag"):
+            self.etags[path] = response.headers["ETag"]
+        return response
+
+    def refresh_schedule(self):
+        response = self.call("GET /schedule", "GET", "/schedule", conditional=self.profile == "gui")
+        if response.status_code == 200:
+            self.pending_doses = [item["dose_id"] for item in response.get_json()["schedule"] if item["status"] == "PENDING"]
+
+    def load_medications(self):
+        self.call("GET /medications", "GET", "/medications", conditional=self.profile == "gui")
+
+    def login(self):
+        response = self.call("POST /login", "POST", "/login", json={"name": self.name, "password": PASSWORD})
+        self.logged_in = response.status_code == 200
+        if not self.logged_in:
+            return
+        if self.profile == "gui":
+            response = self.call("GET /bootstrap", "GET", "/bootstrap")
+            if response.status_code == 200:
+                data = response.get_json()
+                self.etags.update(data["etags"])
+                self.pending_doses = [item["dose_id"] for item in data["schedule"] if item["status"] == "PENDING"]
+        else:
+            self.refresh_schedule()
+            self.call("GET /check_missed_doses", "GET", "/check_missed_doses")
+            self.load_medications()
+
+    def tick(self):
+        """The periodic work of an idle client, plus a random user action."""
+        if self.profile == "polling":
+            response = self.call("GET /check_missed_doses", "GET", "/check_missed_doses")
+            if response.status_code == 200 and response.get_json().get("missed_alerts"):
+                self.refresh_schedule()
+        else:
+            self.refresh_schedule()
+
+        roll = self.rng.random()
+        if roll < 0.20 and self.pending_doses:
+            dose_id = self.pending_doses.pop(self.rng.randrange(len(self.pending_doses)))
+            self.call("POST /confirm_dose", "POST", "/confirm_dose", json={"dose_id": dose_id})
+            self.refresh_schedule()
+        elif roll < 0.25:
+            medication = {"medicine_name": "Added medicine", "dosage": "5 ml",
+                          "time": f"{self.rng.randrange(24):02d}:{self.rng.randrange(60):02d}"}
+            if self.call("POST /add_medication", "POST", "/add_medication", json=medication).status_code == 200:
+                self.added_medications += 1
+            self.refresh_schedule()
+        elif roll < 0.35:
+            self.load_medications()
+        elif roll < 0.40 and self.added_medications:
+            # Like the Manage Medications page: list, then delete one the user added.
+            response = self.call("GET /medications", "GET", "/medications")
+            if response.status_code == 200:
+                added = [m["id"] for m in response.get_json()["medications"] if m["medicine_name"] == "Added medicine"]
+                if added:
+                    self.call("POST /delete_medication", "POST", "/delete_medication", json={"medication_id": added[0]})
+                    self.added_medications -= 1
+                    self.load_medications()
+
+    def step(self):
+        if not self.logged_in:
+            self.login()
+        else:
+            self.tick()
+        return TICK_SECONDS
+
+class QueryCounts(threading.local):
+    """Statements executed by the last request made from this thread (test requests run inline)."""
+    last = 0
+
+def run(args):
+    import metrics
+    from backend import app
+
+    query_counts = QueryCounts()
+
+    @app.after_request
+    def capture_query_count(response):
+        # Registered after the backend's own hook, so it runs first and still sees the request's stats.
+        stats = metrics.current_request()
+        query_counts.last = len(stats.queries) if stats is not None else 0
+        return response
+
+    rng = random.Random(args.seed)
+    print(f"Seeding {args.users} users with {args.meds_per_user} medications each...")
+    names = seed_users(args.users, args.meds_per_user, rng)
+
+    sweeper_stop = None
+    if args.profile == "gui":
+        from sweeper import start_sweeper_thread
+        sweeper_stop = start_sweeper_thread(interval=max(1, round(TICK_SECONDS / args.speedup)))
+
+    recorder = Recorder()
+    users = [VirtualUser(app, name, args.profile, recorder, query_counts, random.Random(args.seed + i))
+             for i, name in enumerate(names)]
+    started = time.monotonic()
+    deadline = started + args.duration / args.speedup
+    # Logins are spread over the first simulated minute instead of arriving all at once.
+    heap = [(started + rng.uniform(0, TICK_SECONDS) / args.speedup, i) for i in range(len(users))]
+    heapq.heapify(heap)
+    cond = threading.Condition()
+    in_flight = [0]
+
+    def worker():
+        while True:
+            with cond:
+                while True:
+                    if heap and heap[0][0] >= deadline or not heap and not in_flight[0]:
+                        cond.notify_all()
+                        return
+                    if not heap:
+                        cond.wait()
+                        continue
+                    due, i = heap[0]
+                    now = time.monotonic()
+                    if due <= now:
+                        heapq.heappop(heap)
+                        in_flight[0] += 1
+                        break
+                    cond.wait(due - now)
+            try:
+                delay = users[i].step()
+            except Exception as e:
+                print(f"❌ Simulated user {i} failed: {e}")
+                delay = TICK_SECONDS
+            with cond:
+                in_flight[0] -= 1
+                heapq.heappush(heap, (due + delay / args.speedup, i))
+                cond.notify()
+
+    print(f"Running the '{args.profile}' profile for {args.duration}s simulated "
+          f"({args.duration / args.speedup:.0f}s real) on {args.concurrency} threads...")
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+    if sweeper_stop:
+        sweeper_stop.set()
+
+    behind = max(0.0, time.monotonic() - deadline)
+    overall, endpoints = summarize(recorder.samples, wall)
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "config": vars(args),
+        "wall_seconds": round(wall, 2),
+        "seconds_behind_schedule": round(behind, 2),
+        "overall": overall,
+        "endpoints": endpoints,
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_report(result):
+    overall = result["overall"]
+    print(f"\n{overall['requests']} requests in {result['wall_seconds']}s: {overall['requests_per_second']} req/s, "
+          f"{overall['errors']} errors, {overall['refused']} refused (429), {overall['queries_per_request']} queries/request")
+    print(f"{'endpoint':<26}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}{'refused':>9}")
+    for endpoint, s in list(result["endpoints"].items()) + [("overall", overall)]:
+        print(f"{endpoint:<26}{s['requests']:>9}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}"
+              f"{s['queries_per_request']:>9.2f}{s['errors']:>8}{s['refused']:>9}")
+    print("Latency percentiles cover answered requests only (status below 400).")
+    for endpoint, s in result["endpoints"].items():
+        print(f"  {endpoint:<24}" + ", ".join(f"{status}: {count}" for status, count in s["statuses"].items()))
+    if result["seconds_behind_schedule"] > 1:
+        print(f"⚠️ The workers fell {result['seconds_behind_schedule']}s behind the simulated clock; "
+              f"the backend is saturated at this load (or raise --concurrency).")
+
+def check_failures(result, max_share):
+    """
+    Prints every endpoint whose share of responses with a status of 400 or more exceeds
+    `max_share`. Their numbers describe refusals and errors, not the work being measured.
+    Returns True if there are none.
+    """
+    ok = True
+    for endpoint, s in result["endpoints"].items():
+        failed = s["requests"] - sum(count for status, count in s["statuses"].items() if int(status) < 400)
+        if s["requests"] and failed / s["requests"] > max_share:
+            print(f"❌ {endpoint}: {failed} of {s['requests']} responses had a status of 400 or more "
+                  f"(over {max_share:.0%}); see the status counts above.")
+            ok = False
+    return ok
+
+def compare(result, baseline, tolerance):
+    """Prints regressions of p95 latency or queries per request against `baseline`. Returns True if none."""
+    ok = True
+    for endpoint, s in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        if s["queries_per_request"] > before["queries_per_request"] + 0.01:
+            print(f"❌ {endpoint}: {before['queries_per_request']} -> {s['queries_per_request']} queries/request")
+            ok = False
+        if before["p95_ms"] and s["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            print(f"❌ {endpoint}: p95 {before['p95_ms']} -> {s['p95_ms']} ms")
+            ok = False
+    if ok:
+        print(f"✅ No regressions against {baseline.get('revision') or 'the baseline'}.")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="Worker threads issuing requests.")
+    parser.add_argument("--duration", type=int, default=600, help="Simulated seconds to run.")
+    parser.add_argument("--speedup", type=float, default=60, help="Simulated seconds per real second.")
+    parser.add_argument("--profile", choices=("gui", "polling"), default="gui")
+    parser.add_argument("--meds-per-user", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=("postgres", "sqlite"), default=os.getenv("STORAGE_BACKEND", "postgres"))
+    parser.add_argument("--create-db", action="store_true", help="Run against a throwaway PostgreSQL database.")
+    parser.add_argument("--keep-db", action="store_true", help="Don't drop the throwaway database afterwards.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Fail if p95 or queries/request regressed against this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 increase for --compare.")
+    parser.add_argument("--max-failure-share", type=float, default=0.05,
+                        help="Fail if any endpoint answers more than this share with a status of 400 or more.")
+    args = parser.parse_args()
+
+    # Enough pooled connections for every worker thread, plus the sweeper.
+    os.environ.setdefault("DB_POOL_MAX", str(args.concurrency + 2))
+    os.environ["STORAGE_BACKEND"] = args.storage
+    db_name = sqlite_dir = None
+    if args.storage == "sqlite":
+        sqlite_dir = tempfile.mkdtemp(prefix="med_reminder_loadtest_")
+        os.environ["SQLITE_PATH"] = os.path.join(sqlite_dir, "loadtest.sqlite3")
+    elif args.create_db:
+        db_name = f"{os.getenv('DB_NAME', 'med_reminder')}_loadtest_{os.getpid()}"
+        create_database(db_name)
+        from init_db import create_tables
+        create_tables()
+
+    try:
+        result = run(args)
+    finally:
+        if db_name and not args.keep_db:
+            from database import get_pool
+            get_pool().closeall()
+            drop_database(db_name)
+        if sqlite_dir and not args.keep_db:
+            shutil.rmtree(sqlite_dir, ignore_errors=True)
+
+    print_report(result)
+    passed = check_failures(result, args.max_failure_share)
+    if args.compare:
+        with open(args.compare) as f:
+            passed = compare(result, json.load(f), args.tolerance) and passed
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if not passed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# /medication-reminder-app/cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SCHEDULE_CACHE_TTL_SECONDS = float(os.getenv("SCHEDULE_CACHE_TTL_SECONDS", 60))
+SCHEDULE_CACHE_MAX_BYTES = int(os.getenv("SCHEDULE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+class ScheduleCache:
+    """
+    A thread-safe LRU cache of serialized (JSON) schedules and their ETags, keyed by
+    (user_id, date).
+
+    Entries expire after `ttl` seconds, which bounds how stale a schedule can get when it
+    is changed by another process (e.g., a separate sweeper). The total size of the cached
+    payloads is capped at `max_bytes`; the least recently used entries are evicted first.
+    Writes in this process invalidate the user's entries directly.
+
+    Each invalidation also bumps the user's generation. A reader takes the generation before
+    it queries the database and passes it to put(), which drops the entry if the user was
+    invalidated meanwhile, so a schedule read before a write can't be cached after it.
+
+    Generations are numbers from one counter, so they only grow. A user's generation is
+    forgotten once the last of their entries is evicted or expires (and, in bulk, once too
+    many users without entries are remembered); forgotten users share `_floor`, which is
+    raised to every generation forgotten. A pending put() can then only be dropped needlessly,
+    never kept wrongly.
+    """
+    def __init__(self, ttl=SCHEDULE_CACHE_TTL_SECONDS, max_bytes=SCHEDULE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (user_id, date) -> (payload, etag, expires_at)
+        self._size = 0
+        self._generations = {}  # user_id -> generation, for users invalidated and not forgotten since
+        self._user_entries = {}  # user_id -> number of cached entries
+        self._counter = self._floor = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, user_id, day):
+        """Returns the cached (payload, etag), or None on a miss."""
+        key = (user_id, day)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key, forget=True)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def generation(self, user_id):
+        """The user's current generation, to pass to put() once the schedule is read."""
+        with self._lock:
+            return self._generations.get(user_id, self._floor)
+
+    def put(self, user_id, day, payload, etag=None, generation=None):
+        if len(payload) > self.max_bytes:
+            return
+        key = (user_id, day)
+        with self._lock:
+            if generation is not None and generation != self._generations.get(user_id, self._floor):
+                return  # Invalidated since it was read: the payload may be stale.
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, etag, time.monotonic() + self.ttl)
+            self._user_entries[user_id] = self._user_entries.get(user_id, 0) + 1
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)), forget=True)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drops every cached schedule of one user, e.g. after a dose or medication changed."""
+        with self._lock:
+            self._counter += 1
+            self._generations[user_id] = self._counter
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._remove(key)
+                self.invalidations += 1
+            # Kept while the user has no entries, so a read in flight right now still gets
+            # cached; forgotten in bulk once they outnumber the users with entries.
+            if len(self._generations) > 2 * len(self._user_entries) + 1024:
+                for other in [other for other in self._generations if other not in self._user_entries]:
+                    self._forget(other)
+
+    def _remove(self, key, forget=False):
+        payload = self._entries.pop(key)[0]
+        self._size -= len(payload)
+        user_id = key[0]
+        self._user_entries[user_id] -= 1
+        if not self._user_entries[user_id]:
+            del self._user_entries[user_id]
+            if forget:
+                self._forget(user_id)
+
+    def _forget(self, user_id):
+        generation = self._generations.pop(user_id, None)
+        if generation is not None:
+            self._floor = max(self._floor, generation)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "generations": len(self._generations),
+            }
@@ -1,9 +1,16 @@
 # /medication-reminder-app/database.py
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
 import psycopg2.pool
 import os
+import re
 import atexit
+import threading
+import time
 from dotenv import load_dotenv
+from metrics import record_pool_wait, record_query
 
 
 # Load environment variables from a .env file
@@ -16,44 +23,332 @@ DB_PASS = os.getenv("DB_PASS")  # It's crucial to set this in your .env file
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
-if not DB_PASS:
-    raise ValueError(
-        "❌ Error: DB_PASS environment variable not set. "
-        "Please create a .env file with your database credentials (see README.md)."
-    )
+# --- Pool sizing and connection hygiene, also configurable from .env ---
+# Connections opened when the pool is created. Returned connections stay open for reuse up to
+# DB_POOL_MAX either way, so this only decides how many the first requests find already open.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# How long a request waits for a free connection before giving up (instead of failing at once).
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Server-side limit for any single statement, applied to every pooled connection.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 30000))
+# Connections older than this are closed and replaced when they are next checked out.
+DB_CONN_MAX_AGE = float(os.getenv("DB_CONN_MAX_AGE", 1800))
+# Connections idle for longer than this are checked with a trivial query before reuse.
+DB_CONN_VALIDATE_AFTER = float(os.getenv("DB_CONN_VALIDATE_AFTER", 30))
+# Run the hot queries as server-side prepared statements. Turn this off behind a pooler that
+# doesn't keep sessions (e.g., PgBouncer in transaction mode).
+DB_PREPARE_STATEMENTS = os.getenv("DB_PREPARE_STATEMENTS", "1").lower() in ("1", "true", "yes")
+
+class InstrumentedCursor(psycopg2.extras.DictCursor):
+    """A DictCursor that records each statement and its duration against the current request."""
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection became free within the pool's timeout."""
+
+class BlockingConnectionPool:
+    """
+    A thread-safe connection pool that waits (up to `timeout` seconds) for a free connection
+    instead of failing as soon as all `maxconn` connections are in use.
+
+    Returned connections stay open on an idle list, up to `maxconn` of them, so a burst of
+    requests reuses the sessions the previous burst opened (and the statements prepared on
+    them). `minconn` connections are opened up front. A connection is only closed once it is
+    older than `max_age`, or when it sat idle for longer than `validate_after` and then
+    fails a SELECT 1, so a connection dropped by the server (or a firewall) never reaches
+    a request. The pool also counts wait times, checkout durations and exhaustion for sizing.
+    """
+    def __init__(self, minconn, maxconn, timeout=DB_POOL_TIMEOUT, max_age=DB_CONN_MAX_AGE,
+                 validate_after=DB_CONN_VALIDATE_AFTER, **connect_kwargs):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.validate_after = validate_after
+        self.closed = False
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = []         # open connections not checked out, most recently returned last
+        self._born = {}         # id(conn) -> when it was opened
+        self._idle_since = {}   # id(conn) -> when it was last returned
+        self._checked_out = {}  # id(conn) -> when it was handed out
+        self._prepared = {}     # id(conn) -> names of the statements PREPAREd on it
+        self._stats = {
+            "checkouts": 0, "in_use": 0, "max_in_use": 0, "exhausted": 0, "recycled": 0,
+            "opened": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "checkout_seconds_total": 0.0, "checkout_seconds_max": 0.0,
+        }
+        for _ in range(min(minconn, maxconn)):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append(conn)
+                self._idle_since[id(conn)] = self._born[id(conn)]
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._lock:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["opened"] += 1
+        return conn
+
+    def getconn(self):
+        started = time.monotonic()
+        if self.closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["exhausted"] += 1
+            raise PoolTimeout(f"No database connection became free within {self.timeout:g}s "
+                              f"(all {self.maxconn} in use).")
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+        now = time.monotonic()
+        waited = now - started
+        with self._lock:
+            self._checked_out[id(conn)] = now
+            stats = self._stats
+            stats["checkouts"] += 1
+            stats["in_use"] += 1
+            stats["max_in_use"] = max(stats["max_in_use"], stats["in_use"])
+            stats["wait_seconds_total"] += waited
+            stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+        record_pool_wait(waited)
+        return conn
+
+    def _checkout_healthy(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                # Holding a slot guarantees fewer than maxconn connections are open.
+                return self._connect()
+            key, now = id(conn), time.monotonic()
+            with self._lock:
+                born = self._born.get(key, now)
+                idle_since = self._idle_since.pop(key, now)
+            if not conn.closed and now - born < self.max_age and (
+                    now - idle_since < self.validate_after or self._is_alive(conn)):
+                return conn
+            self._discard(conn)
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def prepared_statements(self, conn):
+        """The set of statement names prepared on `conn`, or None if it isn't one of ours."""
+        key = id(conn)
+        with self._lock:
+            if key not in self._born:
+                return None
+            return self._prepared.setdefault(key, set())
+
+    def _discard(self, conn):
+        # Forget it before closing, so a new connection that reuses its id() doesn't inherit its state.
+        with self._lock:
+            for tracked in (self._born, self._idle_since, self._prepared):
+                tracked.pop(id(conn), None)
+            self._stats["recycled"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _reset(self, conn):
+        """Ends any transaction left open on `conn`. Returns False if it can't be reused."""
+        if conn.closed:
+            return False
+        try:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn):
+        now = time.monotonic()
+        key = id(conn)
+        with self._lock:
+            held = now - self._checked_out.pop(key, now)
+            stats = self._stats
+            stats["in_use"] -= 1
+            stats["checkout_seconds_total"] += held
+            stats["checkout_seconds_max"] = max(stats["checkout_seconds_max"], held)
+        try:
+            if self.closed or not self._reset(conn):
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle_since[key] = now
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Closes the idle connections; connections still checked out are closed when returned."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
 
-try:
-    # Use ThreadedConnectionPool because the Flask dev server is multi-threaded by default.
-    # This prevents race conditions when multiple requests try to access the pool simultaneously.
-    pool = psycopg2.pool.ThreadedConnectionPool(
-        minconn=1,
-        maxconn=10,  # A reasonable number for a small application
-        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        stats["max_size"] = self.maxconn
+        stats["wait_seconds_avg"] = stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+# The pool is created lazily, once per process. A process forked from one that already had
+# a pool (e.g., gunicorn workers with preload_app) must never use the parent's sockets, so the
+# pool is keyed by PID and discarded in the child right after a fork.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Pools inherited from a parent process. They are kept referenced but never used or closed:
+# closing them would end the parent's sessions on the shared sockets.
+_inherited_pools = []
+
+def _create_pool():
+    # Checked here rather than at import, so the SQLite storage engine runs without it.
+    if not DB_PASS:
+        raise ValueError(
+            "❌ Error: DB_PASS environment variable not set. "
+            "Please create a .env file with your database credentials (see README.md)."
+        )
+    # Threads of the Flask server, the sweeper and the notification workers all share this pool.
+    return BlockingConnectionPool(
+        minconn=DB_POOL_MIN,
+        maxconn=DB_POOL_MAX,
+        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT,
+        options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
     )
-except psycopg2.OperationalError as e:
-    print(f"❌ FATAL: Could not initialize database connection pool: {e}")
-    pool = None # Ensure pool is None if initialization fails
 
-def _close_pool():
+def get_pool():
+    """Returns this process's connection pool, creating it on first use."""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+            try:
+                _pool = _create_pool()
+            except psycopg2.OperationalError as e:
+                print(f"❌ FATAL: Could not initialize database connection pool: {e}")
+                raise RuntimeError("Database connection pool is not available.") from e
+            _pool_pid = os.getpid()
+            atexit.register(_close_pool, _pool, _pool_pid)
+        return _pool
+
+def reset_pool_after_fork():
+    """
+    Forgets the parent's pool in a freshly forked child, so the child opens its own
+    connections on first use. Runs automatically after os.fork(); WSGI servers can also
+    call it from their post-fork hook.
+    """
+    global _pool, _pool_pid, _pool_lock
+    if _pool is not None:
+        _inherited_pools.append(_pool)
+    _pool, _pool_pid = None, None
+    _pool_lock = threading.Lock()  # The parent may have held it while forking
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_pool_after_fork)
+
+def _close_pool(pool, pid):
     """Closes all connections in the pool. Registered to run on program exit."""
-    if pool:
+    if os.getpid() == pid:
         pool.closeall()
         print("Database connection pool closed.")
 
-if pool:
-    atexit.register(_close_pool)
-
 def get_db_connection():
     """
-    Gets a connection from the pool.
+    Gets a connection from this process's pool, waiting up to DB_POOL_TIMEOUT seconds for
+    one to become free. Raises PoolTimeout (a RuntimeError) if none does.
     """
-    if pool is None:
-        raise RuntimeError("Database connection pool is not available.")
-    return pool.getconn()
+    return get_pool().getconn()
 
 def release_db_connection(conn):
     """
     Returns a connection to the pool.
     """
-    if pool:
-        pool.putconn(conn)
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.putconn(conn)
+
+def pool_stats():
+    """Wait time, checkout duration, in-use and exhaustion counters of this process's pool."""
+    return _pool.stats() if _pool is not None and _pool_pid == os.getpid() else {}
+
+# --- Prepared statements ---
+# name -> (PREPARE body with $n placeholders, parameter names in $n order, original SQL)
+_statements = {}
+
+def register_statement(name, sql):
+    """
+    Registers a query to run as a server-side prepared statement via execute_prepared().
+    `sql` uses the usual named %(param)s placeholders. Statements are PREPAREd lazily, once
+    per pooled connection, so PostgreSQL parses and plans them once instead of on every call.
+    Returns `name`.
+    """
+    order = []
+    def placeholder(match):
+        if match.group(1) not in order:
+            order.append(match.group(1))
+        return f"${order.index(match.group(1)) + 1}"
+    body = re.sub(r"%\((\w+)\)s", placeholder, sql.strip().rstrip(";"))
+    _statements[name] = (body, order, sql)
+    return name
+
+def execute_prepared(cur, name, params):
+    """
+    Executes a registered statement by name on `cur`, PREPAREing it first if this connection
+    hasn't seen it yet. Falls back to running the plain SQL when prepared statements are
+    disabled or the connection doesn't come from this process's pool.
+    """
+    body, order, sql = _statements[name]
+    conn = cur.connection
+    prepared = None
+    if DB_PREPARE_STATEMENTS and _pool is not None and _pool_pid == os.getpid():
+        prepared = _pool.prepared_statements(conn)
+    if prepared is None:
+        cur.execute(sql, params)
+        return
+    if name not in prepared:
+        if not prepared:
+            # First statement on this session (or the first after losing track of them):
+            # start from a clean slate so PREPARE can't collide with a leftover name.
+            cur.execute("DEALLOCATE ALL")
+        cur.execute(f"PREPARE {name} AS {body}")
+        prepared.add(name)
+    args = [params[key] for key in order]
+    try:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f"EXECUTE {name}", args)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The session lost its statements behind our back (e.g., DISCARD ALL or a reconnect by
+        # a pooler). This transaction is aborted either way; forget what was prepared on the
+        # connection so the next transaction prepares the statements again.
+        prepared.clear()
+        raise
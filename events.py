@@ -0,0 +1,124 @@
+# /medication-reminder-app/events.py
+import json
+import os
+import queue
+import select
+import threading
+import psycopg2
+import psycopg2.extensions
+import metrics
+from database import DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_PORT
+
+# PostgreSQL NOTIFY channel that carries per-user events between processes.
+EVENT_CHANNEL = "dose_events"
+# Events buffered per open stream; a client that falls this far behind loses the oldest ones.
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 100))
+
+def publish_event(cur, user_id, event_type, data=None):
+    """
+    Publishes an event for one user through pg_notify on the caller's cursor. PostgreSQL
+    only delivers it once the transaction commits (and drops it on rollback), and every
+    process that LISTENs on EVENT_CHANNEL receives it, including a separate sweeper's events.
+    """
+    payload = json.dumps({"user_id": user_id, "type": event_type, "data": data or {}})
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENT_CHANNEL, payload))
+
+class EventBroker:
+    """In-process pub/sub: fans events out to the open alert streams of each user."""
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}  # user_id -> {queue.Queue, ...}
+        self._listeners = []    # callbacks that see every event, e.g. cache invalidation
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """Calls `callback(event)` for every event, whether or not the user has a stream open."""
+        self._listeners.append(callback)
+
+    def subscribe(self, user_id):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues:
+                queues.discard(q)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def publish(self, event):
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                # A failing listener must neither end the LISTEN thread nor keep the event
+                # from the other listeners and the user's streams.
+                print(f"❌ Event listener {callback!r} failed: {e!r}")
+                metrics.record_background_error("events")
+        with self._lock:
+            queues = list(self._subscribers.get(event.get("user_id"), ()))
+        for q in queues:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Slow client: drop its oldest event rather than block the listener.
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+broker = EventBroker()
+
+def _dispatch(payload):
+    """Hands one NOTIFY payload to `broker`, skipping anything that isn't a JSON object."""
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        event = None
+    if not isinstance(event, dict):
+        print(f"Ignoring malformed event: {payload!r}")
+        return
+    broker.publish(event)
+
+def _listen_forever(stop_event, reconnect_seconds=5):
+    """LISTENs on EVENT_CHANNEL on a dedicated connection and forwards events to `broker`."""
+    while not stop_event.is_set():
+        conn = None
+        try:
+            # A LISTEN connection stays open for the life of the process, so it is not taken from the pool.
+            conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {EVENT_CHANNEL};")
+            while not stop_event.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _dispatch(conn.notifies.pop(0).payload)
+        except psycopg2.Error as e:
+            print(f"❌ Event listener lost its database connection: {e}")
+            stop_event.wait(reconnect_seconds)
+        except Exception as e:
+            # Anything else would end the thread, and with it every alert stream and cache
+            # invalidation of this process: log it and reconnect.
+            print(f"❌ Event listener failed: {e!r}")
+            metrics.record_background_error("events")
+            stop_event.wait(reconnect_seconds)
+        finally:
+            if conn is not None:
+                conn.close()
+
+def start_event_listener():
+    """Starts the LISTEN thread that feeds `broker`. Returns a stop event."""
+    stop_event = threading.Event()
+    threading.Thread(target=_listen_forever, args=(stop_event,), name="event-listener", daemon=True).start()
+    return stop_event
@@ -2,11 +2,157 @@ import tkinter as tk
 from tkinter import messagebox, simpledialog, font
 import requests
 import time
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timezones import system_timezone
 
 API_URL = "http://127.0.0.1:5001/api"
 # Create a session object to persist cookies (and login status) across requests
 api_session = requests.Session()
 
+# This computer's IANA timezone, sent at registration and login so the schedule follows the
+# user's local time. None where it can't be told; the server then keeps its own default.
+LOCAL_TIMEZONE = system_timezone()
+
+# ETags of the last schedule/medication list we rendered, keyed by endpoint path.
+etags = {}
+
+def conditional_get(path):
+    """
+    GETs an endpoint with If-None-Match set to the last ETag we saw for it.
+    A 304 response means nothing changed since the last render.
+    """
+    headers = {"If-None-Match": etags[path]} if path in etags else {}
+    response = api_session.get(f"{API_URL}{path}", headers=headers)
+    if response.status_code == 200 and response.headers.get("ETag"):
+        etags[path] = response.headers["ETag"]
+    return response
+
+class ApiWorker:
+    """
+    Runs HTTP requests on a small thread pool so a slow backend never freezes the window.
+    Tk widgets must only be touched from the main thread, so finished requests are queued
+    and their callbacks are run from the Tk event loop with `after()`. The queue is only
+    polled while requests are in flight, so an idle window doesn't keep waking up.
+    """
+    def __init__(self, max_workers=4, poll_ms=15):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api")
+        self._done = queue.Queue()
+        self._poll_ms = poll_ms
+        self._root = None
+        self._pending = 0      # submitted requests whose callbacks haven't run yet
+        self._poll_id = None   # the scheduled _deliver, if any
+
+    def attach(self, root):
+        """Delivers results on `root`'s event loop, including those of earlier requests."""
+        self._root = root
+        self._schedule_poll()
+
+    def submit(self, request_fn, on_response, on_connection_error=None):
+        """
+        Calls `request_fn()` on a worker thread, then `on_response(response)` on the Tk main
+        thread. Connection problems and invalid JSON show the usual error dialogs.
+        """
+        # Only ever called on the main thread, like the rest of Tk, so _pending needs no lock.
+        self._pending += 1
+        future = self._executor.submit(request_fn)
+        future.add_done_callback(lambda f: self._done.put((f, on_response, on_connection_error)))
+        self._schedule_poll()
+
+    def _schedule_poll(self):
+        if self._root is not None and self._poll_id is None and self._pending:
+            self._poll_id = self._root.after(self._poll_ms, self._deliver)
+
+    def _deliver(self):
+        self._poll_id = None
+        try:
+            while True:
+                try:
+                    future, on_response, on_connection_error = self._done.get_nowait()
+                except queue.Empty:
+                    break
+                self._pending -= 1
+                self._run_callback(future, on_response, on_connection_error)
+        finally:
+            # Poll again while any request is still in flight: if delivery stopped, its
+            # response would sit in the queue.
+            self._schedule_poll()
+
+    @staticmethod
+    def _run_callback(future, on_response, on_connection_error):
+        try:
+            on_response(future.result())
+        except requests.exceptions.JSONDecodeError:
+            messagebox.showerror("Server Error", "The server sent an invalid response. Check the backend terminal for errors.")
+        except requests.exceptions.RequestException:
+            try:
+                if on_connection_error:
+                    on_connection_error()
+                else:
+                    messagebox.showerror("Connection Error", "Could not connect to the server. Is it running?")
+            except Exception as e:
+                print(f"❌ Error handling a connection failure: {e!r}")
+        except Exception as e:
+            # A bug in one callback (e.g., a missing field) must not stop the others.
+            print(f"❌ Error handling a server response: {e!r}")
+            messagebox.showerror("Error", f"Something went wrong while showing the server's response: {e}")
+
+api_worker = ApiWorker()
+
+class KeyedRowList:
+    """
+    Renders a list of items as one row frame per item inside `parent`, keyed by a stable id.
+    On each render only the rows that appeared, disappeared or whose rendered state
+    (e.g., status and time) changed are created or destroyed; unchanged rows are kept as they
+    are. Rows are only re-packed when the order or set of rows changed.
+    """
+    def __init__(self, parent, key, state, build_row, empty_text, font):
+        self.parent = parent
+        self.key = key                # item -> stable id (e.g., dose_id)
+        self.state = state            # item -> the values the row displays
+        self.build_row = build_row    # (parent, item) -> row frame (not yet packed)
+        self.empty_text = empty_text
+        self.font = font
+        self.rows = {}                # id -> (state, frame)
+        self.order = []
+        self.empty_label = None
+
+    def render(self, items):
+        keys = [self.key(item) for item in items]
+        for key in set(self.rows) - set(keys):
+            self.rows.pop(key)[1].destroy()
+
+        changed = False
+        for key, item in zip(keys, items):
+            state = self.state(item)
+            current = self.rows.get(key)
+            if current and current[0] == state:
+                continue
+            if current:
+                current[1].destroy()
+            self.rows[key] = (state, self.build_row(self.parent, item))
+            changed = True
+
+        if changed or keys != self.order:
+            for key in self.order:
+                if key in self.rows:
+                    self.rows[key][1].pack_forget()
+            for key in keys:
+                self.rows[key][1].pack(fill='x', padx=10)
+            self.order = keys
+
+        if not items and self.empty_label is None:
+            self.empty_label = tk.Label(self.parent, text=self.empty_text, font=self.font)
+            self.empty_label.pack(pady=20)
+        elif items and self.empty_label is not None:
+            self.empty_label.destroy()
+            self.empty_label = None
+
+    def clear(self):
+        self.render([])
+
 class AppState:
     """A simple class to hold the application's state."""
     def __init__(self):
@@ -15,6 +161,86 @@ class AppState:
 
 app_state = AppState()
 
+class AlertStream:
+    """
+    Reads the backend's Server-Sent Events stream (/api/alerts/stream) on a background
+    thread and puts each (event_type, data) into `events`. Tk widgets must only be touched
+    from the main thread, so each event also wakes the attached window with an
+    <<AlertEvents>> virtual event, whose handler drains the queue; nothing polls meanwhile.
+    A 401 ends the stream with an ("auth_error", {"error": ...}) event: reconnecting can't
+    help until the user logs in again.
+    """
+    def __init__(self):
+        self.events = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._response = None
+        self._root = None
+
+    def attach(self, root):
+        self._root = root
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            if not self._stop.is_set():
+                return
+            self._thread.join(timeout=2)  # A previous stream (e.g., before logout) is shutting down
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="alert-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._response is not None:
+            self._response.close()
+
+    def _run(self):
+        retry_seconds = 5
+        while not self._stop.is_set():
+            try:
+                # The server sends a keep-alive comment every 15 seconds, so a 60 second read
+                # timeout only fires when the connection is really gone.
+                with api_session.get(f"{API_URL}/alerts/stream", stream=True, timeout=(5, 60)) as response:
+                    self._response = response
+                    if response.status_code == 401:
+                        self._stop.set()
+                        self._put("auth_error", {"error": "Your session has expired. Please log in again."})
+                        return
+                    if response.status_code != 200:
+                        # e.g., a 503 while the server has no stream free: wait as long as it asks.
+                        retry_seconds = float(response.headers.get("Retry-After", retry_seconds))
+                        raise requests.exceptions.ConnectionError(f"HTTP {response.status_code}")
+                    event_type, data_lines = "message", []
+                    for line in response.iter_lines(decode_unicode=True):
+                        if self._stop.is_set():
+                            return
+                        if line.startswith("event:"):
+                            event_type = line[6:].strip()
+                        elif line.startswith("data:"):
+                            data_lines.append(line[5:].strip())
+                        elif line.startswith("retry:"):
+                            retry_seconds = int(line[6:].strip()) / 1000
+                        elif not line and data_lines:
+                            self._put(event_type, json.loads("\n".join(data_lines)))
+                            event_type, data_lines = "message", []
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if not self._stop.is_set():
+                    print(f"Alert stream disconnected ({e}); reconnecting in {retry_seconds:g}s.")
+            finally:
+                self._response = None
+            self._stop.wait(retry_seconds)
+
+    def _put(self, event_type, data):
+        self.events.put((event_type, data))
+        if self._root is not None:
+            try:
+                # Tkinter hands the call to the main thread; "tail" queues it behind pending events.
+                self._root.event_generate("<<AlertEvents>>", when="tail")
+            except (tk.TclError, RuntimeError):
+                pass  # The window is closing: there is nobody left to alert.
+
+alert_stream = AlertStream()
+
 class MedicationReminderApp(tk.Tk):
     """Main application window."""
     def __init__(self, *args, **kwargs):
@@ -39,15 +265,15 @@ class MedicationReminderApp(tk.Tk):
             frame.grid(row=0, column=0, sticky="nsew")
 
         self.show_frame("LoginPage")
+        api_worker.attach(self)
+        alert_stream.attach(self)
+        self.bind("<<AlertEvents>>", lambda event: self.frames["MainPage"].process_alert_events())
 
     def show_frame(self, page_name):
         frame = self.frames[page_name]
         frame.tkraise()
         if hasattr(frame, 'start_background_tasks'):
             frame.start_background_tasks()
-        else:
-            if "MainPage" in self.frames and self.frames["MainPage"].after_id:
-                self.after_cancel(self.frames["MainPage"].after_id)
 
 class LoginPage(tk.Frame):
     """Login Page UI."""
@@ -66,8 +292,8 @@ class LoginPage(tk.Frame):
         self.password_entry = tk.Entry(self, show="*", font=controller.default_font, width=30)
         self.password_entry.pack(pady=5)
 
-        login_button = tk.Button(self, text="Login", font=controller.button_font, command=self.login, width=20, height=2)
-        login_button.pack(pady=20)
+        self.login_button = tk.Button(self, text="Login", font=controller.button_font, command=self.login, width=20, height=2)
+        self.login_button.pack(pady=20)
 
         register_button = tk.Button(self, text="Go to Register", font=controller.default_font, command=lambda: controller.show_frame("RegisterPage"))
         register_button.pack()
@@ -79,22 +305,29 @@ class LoginPage(tk.Frame):
             messagebox.showerror("Error", "Username and password cannot be empty.")
             return
 
-        try:
-            response = api_session.post(f"{API_URL}/login", json={"name": username, "password": password})
-            if response.status_code == 200:
-                data = response.json()
-                app_state.user_id = data['user_id']
-                app_state.user_name = data['name']
-                messagebox.showinfo("Success", "Login successful!")
-                self.username_entry.delete(0, 'end')
-                self.password_entry.delete(0, 'end')
-                self.controller.show_frame("MainPage")
-            else:
-                messagebox.showerror("Login Failed", response.json().get("error", "An unknown error occurred"))
-        except requests.exceptions.ConnectionError:
-            messagebox.showerror("Connection Error", "Could not connect to the server. Is it running?")
-        except requests.exceptions.JSONDecodeError:
-            messagebox.showerror("Server Error", "The server sent an invalid response. Please check the backend terminal for errors.")
+        self.login_button.config(state=tk.DISABLED)
+        api_worker.submit(
+            lambda: api_session.post(f"{API_URL}/login", json={"name": username, "password": password, "timezone": LOCAL_TIMEZONE}),
+            self.on_login_response, self.on_login_connection_error
+        )
+
+    def on_login_response(self, response):
+        self.login_button.config(state=tk.NORMAL)
+        if response.status_code == 200:
+            data = response.json()
+            app_state.user_id = data['user_id']
+            app_state.user_name = data['name']
+            etags.clear()
+            messagebox.showinfo("Success", "Login successful!")
+            self.username_entry.delete(0, 'end')
+            self.password_entry.delete(0, 'end')
+            self.controller.show_frame("MainPage")
+        else:
+            messagebox.showerror("Login Failed", response.json().get("error", "An unknown error occurred"))
+
+    def on_login_connection_error(self):
+        self.login_button.config(state=tk.NORMAL)
+        messagebox.showerror("Connection Error", "Could not connect to the server. Is it running?")
 
 class RegisterPage(tk.Frame):
     """Registration Page UI."""
@@ -135,24 +368,21 @@ class RegisterPage(tk.Frame):
             messagebox.showerror("Error", "All fields are required.")
             return
 
-        try:
-            response = api_session.post(f"{API_URL}/register", json=data)
-            if response.status_code == 201:
-                messagebox.showinfo("Success", "Registration successful! Please login.")
-                self.controller.show_frame("LoginPage")
-            else:
-                messagebox.showerror("Registration Failed", response.json().get("error", "An unknown error occurred"))
-        except requests.exceptions.ConnectionError:
-            messagebox.showerror("Connection Error", "Could not connect to the server.")
-        except requests.exceptions.JSONDecodeError:
-            messagebox.showerror("Server Error", "The server sent an invalid response. Check the backend terminal for errors.")
+        data["timezone"] = LOCAL_TIMEZONE
+        api_worker.submit(lambda: api_session.post(f"{API_URL}/register", json=data), self.on_register_response)
+
+    def on_register_response(self, response):
+        if response.status_code == 201:
+            messagebox.showinfo("Success", "Registration successful! Please login.")
+            self.controller.show_frame("LoginPage")
+        else:
+            messagebox.showerror("Registration Failed", response.json().get("error", "An unknown error occurred"))
 
 class MainPage(tk.Frame):
     """Main application page after login."""
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
         self.controller = controller
-        self.after_id = None
 
         self.welcome_label = tk.Label(self, text="", font=controller.title_font)
         self.welcome_label.pack(pady=20)
@@ -174,36 +404,75 @@ class MainPage(tk.Frame):
 
         self.schedule_frame = tk.Frame(self, borderwidth=2, relief="sunken")
         self.schedule_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.schedule_rows = KeyedRowList(
+            self.schedule_frame, key=lambda item: item['dose_id'],
+            state=lambda item: (item['scheduled_time'], item['status'], item['medicine_name'], item['dosage']),
+            build_row=self.build_schedule_row, empty_text="No medications scheduled for today.",
+            font=controller.default_font
+        )
+        self.refresh_in_flight = False
+        self.refresh_again = False
+        self.bootstrapped = False
 
     def start_background_tasks(self):
         self.welcome_label.config(text=f"Welcome, {app_state.user_name}!")
-        self.refresh_schedule()
-        self.check_for_missed_doses()
+        if self.bootstrapped:
+            self.refresh_schedule()
+        else:
+            self.bootstrap()
+        # Missed doses are detected by the backend and pushed to us as they happen.
+        alert_stream.start()
+        self.process_alert_events()
+
+    def bootstrap(self):
+        """Loads the schedule and medication list in a single request after login."""
+        self.refresh_in_flight = True
+        api_worker.submit(lambda: api_session.get(f"{API_URL}/bootstrap"), self.on_bootstrap_response,
+                          self.on_schedule_connection_error)
+
+    def on_bootstrap_response(self, response):
+        self.refresh_in_flight = False
+        if not app_state.user_id:
+            return
+        if response.status_code != 200:
+            messagebox.showerror("Error", f"Failed to fetch schedule: {response.json().get('error')}")
+            return
+        data = response.json()
+        self.bootstrapped = True
+        etags.update(data.get("etags", {}))
+        self.schedule_rows.render(data.get("schedule", []))
+        self.controller.frames["ManageMedicationsPage"].med_rows.render(data.get("medications", []))
+        if self.refresh_again:
+            self.refresh_again = False
+            self.refresh_schedule()
 
     def refresh_schedule(self):
         if not app_state.user_id: return
-        for widget in self.schedule_frame.winfo_children(): widget.destroy()
-
-        try:
-            response = api_session.get(f"{API_URL}/schedule")
-            if response.status_code == 200:
-                schedule = response.json().get("schedule", [])
-                if not schedule:
-                    tk.Label(self.schedule_frame, text="No medications scheduled for today.", font=self.controller.default_font).pack(pady=20)
-                    return
-                for item in schedule: self.display_schedule_item(item)
-            else:
-                try:
-                    messagebox.showerror("Error", f"Failed to fetch schedule: {response.json().get('error')}")
-                except requests.exceptions.JSONDecodeError:
-                    messagebox.showerror("Server Error", "The server sent an invalid response. Check the backend terminal for errors.")
-        except requests.exceptions.ConnectionError:
-            messagebox.showerror("Connection Error", "Could not connect to the server.")
+        # Only one refresh runs at a time; requests made meanwhile collapse into one follow-up.
+        if self.refresh_in_flight:
+            self.refresh_again = True
+            return
+        self.refresh_in_flight = True
+        api_worker.submit(lambda: conditional_get("/schedule"), self.on_schedule_response, self.on_schedule_connection_error)
+
+    def on_schedule_response(self, response):
+        self.refresh_in_flight = False
+        if self.refresh_again:
+            self.refresh_again = False
+            self.refresh_schedule()
+        if not app_state.user_id or response.status_code == 304:
+            return  # Logged out meanwhile, or unchanged since the last render
+        if response.status_code == 200:
+            self.schedule_rows.render(response.json().get("schedule", []))
+        else:
+            messagebox.showerror("Error", f"Failed to fetch schedule: {response.json().get('error')}")
 
+    def on_schedule_connection_error(self):
+        self.refresh_in_flight = False
+        messagebox.showerror("Connection Error", "Could not connect to the server.")
 
-    def display_schedule_item(self, item):
-        item_frame = tk.Frame(self.schedule_frame, pady=10)
-        item_frame.pack(fill='x', padx=10)
+    def build_schedule_row(self, parent, item):
+        item_frame = tk.Frame(parent, pady=10)
 
         time_obj = time.strptime(item['scheduled_time'], '%H:%M:%S')
         display_time = time.strftime('%I:%M %p', time_obj)
@@ -220,56 +489,64 @@ class MainPage(tk.Frame):
             confirm_button.pack(side=tk.RIGHT)
         elif item['status'] == 'TAKEN': status_label.config(fg="green")
         elif item['status'] == 'MISSED': status_label.config(fg="red")
+        return item_frame
 
     def confirm_dose(self, dose_id):
-        try:
-            response = api_session.post(f"{API_URL}/confirm_dose", json={"dose_id": dose_id})
-            if response.status_code == 200:
-                self.refresh_schedule()
-            else:
-                try:
-                    messagebox.showerror("Error", f"Failed to confirm dose: {response.json().get('error')}")
-                except requests.exceptions.JSONDecodeError:
-                    messagebox.showerror("Server Error", "The server sent an invalid response. Check the backend terminal for errors.")
-        except requests.exceptions.ConnectionError:
-            messagebox.showerror("Connection Error", "Could not connect to the server.")
+        api_worker.submit(lambda: api_session.post(f"{API_URL}/confirm_dose", json={"dose_id": dose_id}),
+                          self.on_confirm_response)
 
+    def on_confirm_response(self, response):
+        if response.status_code == 200:
+            self.refresh_schedule()
+        else:
+            messagebox.showerror("Error", f"Failed to confirm dose: {response.json().get('error')}")
 
     def add_medication(self):
         dialog = AddMedicationDialog(self)
         if dialog.result:
-            try:
-                response = api_session.post(f"{API_URL}/add_medication", json=dialog.result)
-                if response.status_code == 200:
-                    messagebox.showinfo("Success", "Medication added successfully.")
-                    self.refresh_schedule()
-                else:
-                    try:
-                        messagebox.showerror("Error", f"Failed to add medication: {response.json().get('error')}")
-                    except requests.exceptions.JSONDecodeError:
-                        messagebox.showerror("Server Error", "The server sent an invalid response. Check the backend terminal for errors.")
-            except requests.exceptions.ConnectionError:
-                messagebox.showerror("Connection Error", "Could not connect to the server.")
+            api_worker.submit(lambda: api_session.post(f"{API_URL}/add_medication", json=dialog.result),
+                              self.on_add_medication_response)
 
+    def on_add_medication_response(self, response):
+        if response.status_code == 200:
+            messagebox.showinfo("Success", "Medication added successfully.")
+            self.refresh_schedule()
+        else:
+            messagebox.showerror("Error", f"Failed to add medication: {response.json().get('error')}")
 
-    def check_for_missed_doses(self):
-        if app_state.user_id:
+    def process_alert_events(self):
+        """Handles the events received by the alert stream (runs on the Tk main thread)."""
+        refresh, alerts = False, []
+        while True:
             try:
-                response = api_session.get(f"{API_URL}/check_missed_doses")
-                if response.status_code == 200 and response.json().get("missed_alerts"):
-                    self.refresh_schedule()
-                    messagebox.showwarning("Missed Dose Alert!", "\n".join(response.json()["missed_alerts"]))
-            except requests.exceptions.ConnectionError:
-                print("Connection error while checking for missed doses.")
-        self.after_id = self.after(60000, self.check_for_missed_doses)
-
-
+                event_type, data = alert_stream.events.get_nowait()
+            except queue.Empty:
+                break
+            if not app_state.user_id:
+                continue  # Left over from a session that has ended.
+            try:
+                if event_type == "auth_error":
+                    messagebox.showerror("Session Expired", data["error"])
+                    self.logout()
+                    return
+                refresh = refresh or event_type in ("missed", "schedule_changed")
+                alerts.extend(data.get("alerts", []) if event_type == "missed" else [])
+            except Exception as e:
+                # A malformed event must not stop the ones after it.
+                print(f"❌ Error handling a {event_type!r} alert event: {e!r}")
+        if refresh:
+            self.refresh_schedule()
+        if alerts:
+            messagebox.showwarning("Missed Dose Alert!", "\n".join(alerts))
 
     def logout(self):
         app_state.user_id = None
         app_state.user_name = None
-        if self.after_id: self.after_cancel(self.after_id)
-        self.after_id = None
+        etags.clear()
+        alert_stream.stop()
+        self.schedule_rows.clear()
+        self.controller.frames["ManageMedicationsPage"].med_rows.clear()
+        self.bootstrapped = False
         self.controller.show_frame("LoginPage")
 
 class ManageMedicationsPage(tk.Frame):
@@ -286,37 +563,34 @@ class ManageMedicationsPage(tk.Frame):
 
         self.med_list_frame = tk.Frame(self, borderwidth=2, relief="sunken")
         self.med_list_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.med_rows = KeyedRowList(
+            self.med_list_frame, key=lambda med: med['id'],
+            state=lambda med: (med['time_to_take'], med['medicine_name'], med['dosage']),
+            build_row=self.build_med_row, empty_text="You have not added any medications yet.",
+            font=controller.default_font
+        )
 
     def start_background_tasks(self):
         """This is called when the frame is shown."""
         self.load_medications()
 
     def load_medications(self):
-        for widget in self.med_list_frame.winfo_children():
-            widget.destroy()
+        api_worker.submit(lambda: conditional_get("/medications"), self.on_medications_response)
 
-        try:
-            response = api_session.get(f"{API_URL}/medications")
-            if response.status_code == 200:
-                medications = response.json().get("medications", [])
-                if not medications:
-                    tk.Label(self.med_list_frame, text="You have not added any medications yet.", font=self.controller.default_font).pack(pady=20)
-                    return
-                for med in medications:
-                    self.display_med_item(med)
-            else:
-                messagebox.showerror("Error", f"Failed to load medications: {response.json().get('error')}")
-        except requests.exceptions.ConnectionError:
-            messagebox.showerror("Connection Error", "Could not connect to the server.")
-        except requests.exceptions.JSONDecodeError:
-            messagebox.showerror("Server Error", "The server sent an invalid response. Check the backend terminal for errors.")
+    def on_medications_response(self, response):
+        if response.status_code == 304:
+            return  # Unchanged since the last render
+        if response.status_code == 200:
+            self.med_rows.render(response.json().get("medications", []))
+        else:
+            messagebox.showerror("Error", f"Failed to load medications: {response.json().get('error')}")
 
-    def display_med_item(self, med):
-        item_frame = tk.Frame(self.med_list_frame, pady=10)
-        item_frame.pack(fill='x', padx=10)
+    def build_med_row(self, parent, med):
+        item_frame = tk.Frame(parent, pady=10)
 
-        time_obj = time.strptime(med['time_to_take'], '%H:%M:%S')
-        display_time = time.strftime('%I:%M %p', time_obj)
+        # A medication with a recurrence rule may be taken several times a day.
+        times = (med.get('recurrence') or {}).get('times') or [med['time_to_take']]
+        display_time = ", ".join(time.strftime('%I:%M %p', time.strptime(t, '%H:%M:%S')) for t in times)
 
         info_text = f"{display_time} - {med['medicine_name']} ({med['dosage']})"
         tk.Label(item_frame, text=info_text, font=self.controller.default_font).pack(side=tk.LEFT, expand=True, fill='x')
@@ -324,20 +598,21 @@ class ManageMedicationsPage(tk.Frame):
         delete_button = tk.Button(item_frame, text="Delete", font=self.controller.button_font, fg="red",
                                   command=lambda med_id=med['id']: self.delete_medication(med_id))
         delete_button.pack(side=tk.RIGHT)
+        return item_frame
 
     def delete_medication(self, medication_id):
         if not messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this medication? This cannot be undone."):
             return
 
-        try:
-            response = api_session.post(f"{API_URL}/delete_medication", json={"medication_id": medication_id})
-            if response.status_code == 200:
-                messagebox.showinfo("Success", "Medication deleted.")
-                self.load_medications() # Refresh the list
-            else:
-                messagebox.showerror("Error", f"Failed to delete medication: {response.json().get('error')}")
-        except requests.exceptions.ConnectionError:
-            messagebox.showerror("Connection Error", "Could not connect to the server.")
+        api_worker.submit(lambda: api_session.post(f"{API_URL}/delete_medication", json={"medication_id": medication_id}),
+                          self.on_delete_response)
+
+    def on_delete_response(self, response):
+        if response.status_code == 200:
+            messagebox.showinfo("Success", "Medication deleted.")
+            self.load_medications() # Refresh the list
+        else:
+            messagebox.showerror("Error", f"Failed to delete medication: {response.json().get('error')}")
 
 class AddMedicationDialog(simpledialog.Dialog):
     """Dialog to add a new medication."""
@@ -345,20 +620,25 @@ class AddMedicationDialog(simpledialog.Dialog):
         self.title("Add New Medication")
         tk.Label(master, text="Medicine Name:").grid(row=0, sticky="w")
         tk.Label(master, text="Dosage (e.g., 1 pill):").grid(row=1, sticky="w")
-        tk.Label(master, text="Time (e.g., 08:30 or 14:00):").grid(row=2, sticky="w")
+        tk.Label(master, text="Time(s) (e.g., 08:30 or 08:00, 20:00):").grid(row=2, sticky="w")
         self.e1 = tk.Entry(master); self.e2 = tk.Entry(master); self.e3 = tk.Entry(master)
         self.e1.grid(row=0, column=1); self.e2.grid(row=1, column=1); self.e3.grid(row=2, column=1)
         return self.e1
 
     def apply(self):
-        time_str = self.e3.get()
+        times = [t.strip() for t in self.e3.get().split(",") if t.strip()]
         try:
-            time.strptime(time_str, '%H:%M')
+            for time_str in times:
+                time.strptime(time_str, '%H:%M')
         except ValueError:
+            times = []
+        if not times:
             messagebox.showerror("Invalid Format", "Please enter the time in HH:MM (24-hour) format.")
             self.result = None
             return
-        self.result = {"medicine_name": self.e1.get(), "dosage": self.e2.get(), "time": time_str}
+        self.result = {"medicine_name": self.e1.get(), "dosage": self.e2.get(), "time": times[0]}
+        if len(times) > 1:
+            self.result["recurrence"] = {"times": times}
 
 if __name__ == "__main__":
     app = MedicationReminderApp()
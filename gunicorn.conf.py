@@ -0,0 +1,41 @@
+# /medication-reminder-app/gunicorn.conf.py
+# Configuration for: gunicorn -c gunicorn.conf.py wsgi:app
+# Serves the API. Alert streams (/api/alerts/stream) belong on gunicorn_stream.conf.py.
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "127.0.0.1:5001")
+# Two processes per core, plus one, get the backend past the single-process GIL limit while
+# some of them wait on the database.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Threaded workers: every request, and every open alert stream, holds one thread.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+# Import the app once in the master and fork it; database.py opens its connection pool lazily
+# in each worker, so no connection is ever shared across processes.
+preload_app = True
+
+# The sweeper and the notification dispatcher should run once, not in every worker: start
+# `python sweeper.py --interval 300` (a safety net next to the dose scheduler) and
+# `python outbox.py` next to gunicorn. Every worker starts a dose scheduler, but only the one
+# holding its advisory lock is active; the others take over if it exits. Values set in the
+# environment win.
+os.environ.setdefault("RUN_MISSED_DOSE_SWEEPER", "0")
+os.environ.setdefault("RUN_NOTIFICATION_DISPATCHER", "0")
+# Every worker has its own password hashing pool (hashing.py); one hashing process each
+# already gives the server as many as it has cores to spare.
+os.environ.setdefault("HASH_WORKERS", "1")
+# A stream holds its thread for as long as the GUI is open, so streams that still reach these
+# workers get at most a quarter of the threads; beyond that they are answered with a 503.
+os.environ.setdefault("ALERT_STREAM_MAX", str(max(threads // 4, 1)))
+
+def post_fork(server, worker):
+    import database
+    from backend import start_background_services
+    # Normally done by os.register_at_fork already; harmless to repeat.
+    database.reset_pool_after_fork()
+    # Threads don't survive fork, so each worker starts its own event listener (and any other
+    # services enabled for it).
+    start_background_services()
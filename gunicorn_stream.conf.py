@@ -0,0 +1,37 @@
+# /medication-reminder-app/gunicorn_stream.conf.py
+# Configuration for: gunicorn -c gunicorn_stream.conf.py wsgi:app
+# Serves only the alert streams (/api/alerts/stream), next to the API server of gunicorn.conf.py;
+# the reverse proxy routes that one path here. An open stream is mostly idle, so gevent workers
+# hold thousands of them each as greenlets, where a threaded worker would spend a whole thread
+# on each one. Requires: pip install gevent psycogreen
+import os
+
+bind = os.getenv("STREAM_BIND", "127.0.0.1:5002")
+workers = int(os.getenv("STREAM_WORKERS", 2))
+worker_class = "gevent"
+# Open streams per worker.
+worker_connections = int(os.getenv("STREAM_WORKER_CONNECTIONS", 1000))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+# The app is imported in each worker after gevent has patched the standard library, so the
+# event listener's threads and queues become greenlets.
+preload_app = False
+
+# Streams need only the event listener: no sweeper, dispatcher or scheduler here, and no
+# password hashing processes, since logins go to the API server.
+os.environ.setdefault("RUN_MISSED_DOSE_SWEEPER", "0")
+os.environ.setdefault("RUN_NOTIFICATION_DISPATCHER", "0")
+os.environ.setdefault("RUN_DOSE_SCHEDULER", "0")
+os.environ.setdefault("HASH_WORKERS", "0")
+os.environ.setdefault("ALERT_STREAM_MAX", "0")
+
+def post_fork(server, worker):
+    # gevent can't patch psycopg2, a C extension: without a wait callback each query (and the
+    # listener's connection setup) would block the whole worker, i.e. every stream it holds.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+def post_worker_init(worker):
+    from backend import start_background_services
+    # After the worker has loaded the app, i.e. after gevent's patching.
+    start_background_services()
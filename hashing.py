@@ -0,0 +1,126 @@
+# /medication-reminder-app/hashing.py
+"""
+Password hashing off the request threads. Hashing a password (scrypt, via werkzeug) is
+deliberately slow; done inline, a burst of logins at a popular dose time keeps every request
+thread busy hashing and starves the schedule refreshes behind them. Here the hashes run in
+a small process pool instead, and a request that would have to queue behind more than
+HASH_MAX_PENDING others is refused at once with HashingBusy, which the routes turn into a
+429, rather than waiting until its client gives up.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Worker processes for hashing (0 = hash on the request thread, still with admission control).
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+# Hashes running or queued at once, per backend process; beyond this, requests get a 429.
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", max(HASH_WORKERS, 1) * 4))
+# How long a request waits for its hash before giving up (seconds).
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", 10))
+
+class HashingBusy(RuntimeError):
+    """Raised when the hashing pool is full (or too slow); the client should retry later."""
+
+class HashingPool:
+    """
+    A ProcessPoolExecutor behind a counting semaphore. The semaphore bounds the hashes
+    running or queued; a slot is freed when its hash finishes, even if the request that
+    asked for it has timed out, so the bound holds for the worker processes too.
+    """
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {"hashes": 0, "rejected": 0, "timeouts": 0, "pending": 0, "max_pending": 0,
+                       "seconds_total": 0.0}
+
+    def start(self):
+        """
+        Starts the worker processes now rather than on the first login. Call it before the
+        process starts other threads, so the workers are forked from a single-threaded process.
+        """
+        if self.workers > 0:
+            self._get_executor().submit(os.getpid).result()
+        return self
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise HashingBusy(f"All {self.max_pending} password hashing slots are in use.")
+        with self._lock:
+            self._stats["pending"] += 1
+            self._stats["max_pending"] = max(self._stats["max_pending"], self._stats["pending"])
+
+    def _done(self, started):
+        with self._lock:
+            self._stats["pending"] -= 1
+            self._stats["hashes"] += 1
+            self._stats["seconds_total"] += time.perf_counter() - started
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """Runs fn(*args) in the pool and returns its result. Raises HashingBusy when full or too slow."""
+        self._admit()
+        started = time.perf_counter()
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._done(started)
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self._done(started)
+            self._reset()
+            raise HashingBusy("The password hashing pool is restarting.") from None
+        future.add_done_callback(lambda _: self._done(started))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise HashingBusy(f"Password hashing took longer than {self.timeout:g}s.") from None
+        except BrokenProcessPool:
+            # A worker died (e.g., killed for memory); the next call starts a fresh pool.
+            self._reset()
+            raise HashingBusy("The password hashing pool is restarting.") from None
+
+    def _reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def after_fork(self):
+        """Forgets the parent's worker processes in a forked child; it starts its own on first use."""
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash_password(self, password):
+        return self.run(generate_password_hash, password)
+
+    def check_password(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, workers=self.workers, limit=self.max_pending)
+
+# The process-wide pool used by the routes.
+pool = HashingPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=pool.after_fork)
@@ -1,9 +1,141 @@
 # /medication-reminder-app/init_db.py
+import argparse
 import psycopg2
 from database import get_db_connection, release_db_connection
+from partitions import DOSE_HISTORY_PARTITIONED, create_partitioned_dose_history, ensure_partitions, is_partitioned
+from repository import STORAGE_BACKEND, get_storage
+from timezones import DEFAULT_TIMEZONE, valid_timezone
 
-def create_tables():
-    """Create tables in PostgreSQL."""
+def create_dose_history_indexes(cur):
+    """Indexes of dose_history. On a partitioned table they are created on every partition."""
+    # Add indexes for performance and to prevent table-locking on deletes/updates.
+    # This is crucial for preventing deadlocks during concurrent operations.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dose_history_medication_id ON dose_history (medication_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dose_history_user_date ON dose_history (user_id, scheduled_for);")
+    # One dose per medication per day and time (a recurrence rule can schedule several a day).
+    # generate_daily_doses relies on this key for its ON CONFLICT DO NOTHING, which also
+    # stops two concurrent requests from inserting the same dose twice. Older databases may
+    # already contain such duplicates, so keep one row of each slot before building the index:
+    # the one that records the most (TAKEN, then MISSED, then PENDING), the earliest on a tie.
+    cur.execute("""
+        DELETE FROM dose_history
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY medication_id, scheduled_for, scheduled_time
+                    ORDER BY CASE status WHEN 'TAKEN' THEN 0 WHEN 'MISSED' THEN 1 ELSE 2 END, id
+                ) AS slot_rank
+                FROM dose_history
+            ) ranked
+            WHERE slot_rank > 1
+        );
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_dose_history_medication_slot
+        ON dose_history (medication_id, scheduled_for, scheduled_time);
+    """)
+    # The one-dose-per-day key it replaces.
+    cur.execute("DROP INDEX IF EXISTS uq_dose_history_medication_date;")
+    # Overdue-dose scans (sweeper.mark_missed_doses) only ever look at PENDING rows,
+    # so a partial index keeps that range scan on due_at small as history grows.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_dose_history_pending_due_at
+        ON dose_history (due_at) WHERE status = 'PENDING';
+    """)
+    # The index it replaces, on the local date and time of day.
+    cur.execute("DROP INDEX IF EXISTS idx_dose_history_pending_due;")
+
+# Adds the doses a statement changed to their (user, medication, day) counters in
+# adherence_daily: `sign` is 1 for rows written and -1 for rows replaced or deleted.
+ADHERENCE_DELTA_SQL = """
+    INSERT INTO adherence_daily AS a (user_id, medication_id, day, taken, missed, pending)
+    SELECT user_id, medication_id, scheduled_for,
+           sum(sign * (status = 'TAKEN')::int), sum(sign * (status = 'MISSED')::int),
+           sum(sign * (status = 'PENDING')::int)
+    FROM ({changes}) AS changes
+    WHERE user_id IS NOT NULL AND medication_id IS NOT NULL
+    GROUP BY user_id, medication_id, scheduled_for
+    ORDER BY user_id, medication_id, scheduled_for
+    ON CONFLICT (user_id, medication_id, day) DO UPDATE
+    SET taken = a.taken + EXCLUDED.taken, missed = a.missed + EXCLUDED.missed, pending = a.pending + EXCLUDED.pending
+"""
+_CHANGED_ROWS = """
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE (n.user_id, n.medication_id, n.scheduled_for, n.status)
+          IS DISTINCT FROM (o.user_id, o.medication_id, o.scheduled_for, o.status)
+"""
+# (event, transition tables, changed rows with their sign). Transition tables allow only
+# one event per trigger, hence one trigger (and function) per event.
+ADHERENCE_TRIGGERS = (
+    ("insert", "NEW TABLE AS new_rows",
+     "SELECT user_id, medication_id, scheduled_for, status, 1 AS sign FROM new_rows"),
+    ("update", "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+     f"SELECT n.user_id, n.medication_id, n.scheduled_for, n.status, 1 AS sign {_CHANGED_ROWS} "
+     f"UNION ALL SELECT o.user_id, o.medication_id, o.scheduled_for, o.status, -1 AS sign {_CHANGED_ROWS}"),
+    ("delete", "OLD TABLE AS old_rows",
+     "SELECT user_id, medication_id, scheduled_for, status, -1 AS sign FROM old_rows"),
+)
+
+def create_adherence_rollup(cur):
+    """
+    Creates adherence_daily: taken, missed and pending dose counts per user, medication and
+    day, kept current by statement-level triggers on dose_history. Each INSERT, UPDATE or
+    DELETE applies its net change in one upsert, so generating, confirming and missing doses
+    (from any process) all keep the rollup exact. The first run backfills it from dose_history.
+    Archiving a dose_history partition doesn't fire the triggers, so the rollup outlives it.
+    """
+    # No foreign keys: deleting a medication must not be blocked by, or race with, the
+    # triggers still subtracting the doses its cascade removes.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS adherence_daily (
+            user_id INT NOT NULL,
+            medication_id INT NOT NULL,
+            day DATE NOT NULL,
+            taken INT NOT NULL DEFAULT 0,
+            missed INT NOT NULL DEFAULT 0,
+            pending INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, medication_id, day)
+        );
+    """)
+    # Range reads are per user and day, across medications.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_adherence_daily_user_day ON adherence_daily (user_id, day);")
+    for event, referencing, changes in ADHERENCE_TRIGGERS:
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION adherence_daily_{event}() RETURNS trigger AS $$
+            BEGIN
+                {ADHERENCE_DELTA_SQL.format(changes=changes)};
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_adherence_daily_{event} ON dose_history;")
+        cur.execute(f"""
+            CREATE TRIGGER trg_adherence_daily_{event} AFTER {event.upper()} ON dose_history
+            REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION adherence_daily_{event}();
+        """)
+    # An empty rollup next to existing doses has never been filled. The triggers now exist
+    # and their lock on dose_history is held until commit, so no dose is counted twice.
+    cur.execute("""
+        INSERT INTO adherence_daily (user_id, medication_id, day, taken, missed, pending)
+        SELECT user_id, medication_id, scheduled_for,
+               count(*) FILTER (WHERE status = 'TAKEN'), count(*) FILTER (WHERE status = 'MISSED'),
+               count(*) FILTER (WHERE status = 'PENDING')
+        FROM dose_history
+        WHERE user_id IS NOT NULL AND medication_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM adherence_daily)
+        GROUP BY user_id, medication_id, scheduled_for;
+    """)
+
+def create_tables(partitioned=DOSE_HISTORY_PARTITIONED):
+    """
+    Create tables in PostgreSQL (or in the SQLite file, when STORAGE_BACKEND=sqlite).
+    With `partitioned`, a new dose_history is partitioned by month (see partitions.py).
+    """
+    if STORAGE_BACKEND == "sqlite":
+        storage = get_storage()
+        storage.create_schema()
+        print(f"✅ SQLite database ready at {storage.path} (WAL mode).")
+        return
     conn = None
     try:
         conn = get_db_connection()
@@ -17,9 +149,15 @@ def create_tables():
                     age INT,
                     contact VARCHAR(50),
                     password_hash VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    data_revision BIGINT NOT NULL DEFAULT 0 -- bumped on every schedule/medication change
                 );
             """)
+            # Added after the original schema; backs the ETags of /api/schedule and /api/medications.
+            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS data_revision BIGINT NOT NULL DEFAULT 0;")
+            # IANA timezone the user's schedule is in; existing users get DEFAULT_TIMEZONE.
+            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone VARCHAR(64) NOT NULL DEFAULT %s;",
+                        (valid_timezone(DEFAULT_TIMEZONE),))
 
             # Close contacts
             cur.execute("""
@@ -31,6 +169,20 @@ def create_tables():
                 );
             """)
 
+            # Caregivers see the adherence of the patients who granted them access by name
+            # (see /api/caregivers). A matching contact number alone grants nothing: it isn't verified.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS caregiver_links (
+                    patient_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    caregiver_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (patient_id, caregiver_id)
+                );
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_caregiver_links_caregiver ON caregiver_links (caregiver_id);")
+            # The index behind the old contact-number matching.
+            cur.execute("DROP INDEX IF EXISTS idx_close_contacts_contact;")
+
             # Medications
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS medications (
@@ -42,7 +194,13 @@ def create_tables():
                 );
             """)
 
+            # Recurrence rule (see recurrence.py); NULL means once a day at time_to_take.
+            cur.execute("ALTER TABLE medications ADD COLUMN IF NOT EXISTS recurrence JSONB;")
+
             # Dose history
+            cur.execute("SELECT to_regclass('dose_history') IS NOT NULL")
+            if partitioned and not cur.fetchone()[0]:
+                create_partitioned_dose_history(cur)
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS dose_history (
                     id SERIAL PRIMARY KEY,
@@ -55,10 +213,61 @@ def create_tables():
                 );
             """)
 
-            # Add indexes for performance and to prevent table-locking on deletes/updates.
-            # This is crucial for preventing deadlocks during concurrent operations.
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_dose_history_medication_id ON dose_history (medication_id);")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_dose_history_user_date ON dose_history (user_id, scheduled_for);")
+            # Set when a tapering rule overrides the medication's dosage for this dose.
+            cur.execute("ALTER TABLE dose_history ADD COLUMN IF NOT EXISTS dosage VARCHAR(100);")
+            # The absolute instant a dose is due: scheduled_for + scheduled_time in the user's
+            # timezone. Filled in for doses that predate the column.
+            cur.execute("ALTER TABLE dose_history ADD COLUMN IF NOT EXISTS due_at TIMESTAMPTZ;")
+            cur.execute("""
+                UPDATE dose_history dh SET due_at = (dh.scheduled_for + dh.scheduled_time) AT TIME ZONE u.timezone
+                FROM users u WHERE u.id = dh.user_id AND dh.due_at IS NULL;
+            """)
+
+            # Notification outbox. Alerts are written here in the same transaction that marks
+            # a dose as MISSED, then sent by the dispatcher workers in outbox.py.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS notification_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    channel VARCHAR(10) NOT NULL, -- sms, email
+                    recipient VARCHAR(255) NOT NULL,
+                    subject VARCHAR(255),
+                    body TEXT NOT NULL,
+                    dose_id INT,
+                    audience VARCHAR(10), -- patient, contact
+                    patient_name VARCHAR(100),
+                    medicine_name VARCHAR(100),
+                    status VARCHAR(20) DEFAULT 'PENDING', -- PENDING, SENT, FAILED
+                    attempts INT NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                );
+            """)
+
+            create_dose_history_indexes(cur)
+            # Keeps partitions ready for this month and the next few (a no-op when unpartitioned).
+            ensure_partitions(cur)
+            create_adherence_rollup(cur)
+            if partitioned and not is_partitioned(cur):
+                print("⚠️ dose_history already exists and is not partitioned; "
+                      "run `python partitions.py --migrate` to convert it.")
+            # Columns added after the outbox was first introduced (used to build digest messages).
+            cur.execute("""
+                ALTER TABLE notification_outbox
+                    ADD COLUMN IF NOT EXISTS audience VARCHAR(10),
+                    ADD COLUMN IF NOT EXISTS patient_name VARCHAR(100),
+                    ADD COLUMN IF NOT EXISTS medicine_name VARCHAR(100);
+            """)
+            # One alert per dose, channel and recipient: repeated sweeps can't queue duplicates.
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_notification_outbox_dose
+                ON notification_outbox (dose_id, channel, recipient);
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+                ON notification_outbox (channel, next_attempt_at) WHERE status = 'PENDING';
+            """)
 
             conn.commit()
             print("✅ Tables and indexes created successfully!")
@@ -73,4 +282,8 @@ def create_tables():
             release_db_connection(conn)
 
 if __name__ == "__main__":
-    create_tables()
+    parser = argparse.ArgumentParser(description="Creates the database tables and indexes.")
+    parser.add_argument("--partitioned", action="store_true", default=DOSE_HISTORY_PARTITIONED,
+                        help="Partition a new dose_history by month (PostgreSQL only).")
+    args = parser.parse_args()
+    create_tables(args.partitioned)
@@ -0,0 +1,142 @@
+# /medication-reminder-app/metrics.py
+import bisect
+import os
+import threading
+import time
+
+# Requests slower than this many milliseconds are logged with their query breakdown (0 = off).
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+class Histogram:
+    """
+    A thread-safe Prometheus-style histogram with a fixed set of labels. Each label
+    combination keeps cumulative bucket counts, a sum and a count.
+    """
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labelvalues, values in sorted(series.items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labelvalues)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = '+Inf' if bound == float("inf") else f"{bound:g}"
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return "\n".join(lines)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_gauges(name, help_text, values, metric_type="gauge"):
+    """Renders {labels: number} (or a single number) kept elsewhere as a Prometheus gauge or counter."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    if isinstance(values, dict):
+        lines += [f'{name}{{{key}}} {value}' for key, value in sorted(values.items())]
+    else:
+        lines.append(f"{name} {values}")
+    return "\n".join(lines)
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route.",
+                            ("method", "route", "status"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements executed per request.",
+                            ("route",), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL statements per request.", ("route",))
+POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled database connection.")
+NOTIFICATION_SECONDS = Histogram("notification_send_seconds",
+                                 "Time to hand one notification to its provider, including retries.",
+                                 ("channel", "outcome"))
+
+# Unexpected errors caught by the background loops (outbox workers, sweeper, dose scheduler),
+# by task. Those loops log and carry on instead of letting the thread die.
+_background_errors = {}
+_background_errors_lock = threading.Lock()
+
+def record_background_error(task):
+    with _background_errors_lock:
+        _background_errors[task] = _background_errors.get(task, 0) + 1
+
+# --- Per-request tracking ---
+_local = threading.local()
+
+class RequestStats:
+    """SQL statements and pool waits recorded while the current thread serves one request."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []  # (statement summary, seconds)
+        self.pool_wait = 0.0
+
+    @property
+    def db_seconds(self):
+        return sum(seconds for _, seconds in self.queries)
+
+def start_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+def finish_request():
+    return _local.__dict__.pop("stats", None)
+
+def current_request():
+    return getattr(_local, "stats", None)
+
+def record_pool_wait(seconds):
+    POOL_WAIT_SECONDS.observe(seconds)
+    stats = current_request()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+def record_query(query, seconds):
+    """Adds one SQL statement to the current request's breakdown, if a request is being tracked."""
+    stats = current_request()
+    if stats is not None:
+        if isinstance(query, bytes):
+            query = query.decode(errors="replace")
+        stats.queries.append((" ".join(str(query).split())[:80], seconds))
+
+def observe_request(method, route, status, stats):
+    """Records a finished request, and logs it with its queries if it was slow."""
+    elapsed = time.perf_counter() - stats.started
+    REQUEST_SECONDS.observe(elapsed, method, route, status)
+    REQUEST_QUERIES.observe(len(stats.queries), route)
+    REQUEST_DB_SECONDS.observe(stats.db_seconds, route)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        print(f"⚠️ Slow request: {method} {route} -> {status} in {elapsed * 1000:.0f} ms "
+              f"({len(stats.queries)} queries, {stats.db_seconds * 1000:.0f} ms in the database, "
+              f"{stats.pool_wait * 1000:.0f} ms waiting for a connection)")
+        for query, seconds in stats.queries:
+            print(f"    {seconds * 1000:8.1f} ms  {query}")
+
+def render(extra=()):
+    """All metrics in the Prometheus text exposition format, plus any pre-rendered `extra` blocks."""
+    blocks = [metric.render() for metric in
+              (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, POOL_WAIT_SECONDS, NOTIFICATION_SECONDS)]
+    with _background_errors_lock:
+        errors = {f'task="{_escape(task)}"': count for task, count in _background_errors.items()}
+    blocks.append(render_gauges("background_task_errors_total",
+                                "Errors caught (and survived) by background loops, by task.", errors, "counter"))
+    return "\n".join(blocks + list(extra)) + "\n"
@@ -0,0 +1,434 @@
+# /medication-reminder-app/notifications.py
+from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+import smtplib
+from email.mime.text import MIMEText
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from metrics import NOTIFICATION_SECONDS
+
+# Load environment variables from a .env file
+load_dotenv()
+
+# --- Twilio Configuration ---
+# IMPORTANT: To send real SMS, replace with your actual Twilio credentials.
+# For better security, use environment variables in a real application.
+TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'ACxxxxxxxxxxxxxxxxxxxxxxxxxxxxx')
+TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'your_auth_token')
+TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '+15017122661') # Your Twilio number
+SMS_RATE_PER_SECOND = float(os.environ.get('SMS_RATE_PER_SECOND', 1)) # A Twilio long code sends ~1 message/second
+SMS_BURST = int(os.environ.get('SMS_BURST', 1))
+SMS_WORKERS = int(os.environ.get('SMS_WORKERS', 4))
+SMS_QUEUE_SIZE = int(os.environ.get('SMS_QUEUE_SIZE', 1000))
+SMS_MAX_RETRIES = int(os.environ.get('SMS_MAX_RETRIES', 3))
+# 'twilio' (default), or 'fake' to load-test the dispatcher without network access.
+SMS_TRANSPORT = os.environ.get('SMS_TRANSPORT', 'twilio')
+
+# --- Email (SMTP) Configuration ---
+SMTP_SERVER = os.environ.get('SMTP_SERVER')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587)) # 587 is common for TLS
+SMTP_USER = os.environ.get('SMTP_USER')
+SMTP_PASS = os.environ.get('SMTP_PASS')
+SMTP_FROM = os.environ.get('SMTP_FROM', SMTP_USER or 'medreminder@localhost')
+# Set SMTP_STARTTLS=0 for a local stand-in server such as `python -m aiosmtpd -n -l localhost:1025`.
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1').lower() in ('1', 'true', 'yes')
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 4))
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', 60))
+
+class SMSSendError(Exception):
+    """A failed SMS send. `status` is the provider's HTTP status, if there was a response."""
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self):
+        return self.status == 429 or (self.status is not None and self.status >= 500)
+
+class TwilioTransport:
+    """Sends through one long-lived Twilio client whose HTTP session keeps connections alive."""
+    def __init__(self, account_sid=TWILIO_ACCOUNT_SID, auth_token=TWILIO_AUTH_TOKEN, from_number=TWILIO_PHONE_NUMBER):
+        self.client = Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True))
+        self.from_number = from_number
+
+    def send(self, to_number, body):
+        try:
+            return self.client.messages.create(body=body, from_=self.from_number, to=to_number).sid
+        except TwilioRestException as e:
+            raise SMSSendError(e.msg, status=e.status) from e
+
+class SimulatedTransport:
+    """Prints messages instead of sending them, for when no Twilio credentials are configured."""
+    def send(self, to_number, body):
+        print("\n--- SMS SIMULATION ---")
+        print(f"To: {to_number}\nBody: {body}")
+        print("--- (To send real SMS, update Twilio credentials in your .env file) ---\n")
+        return "simulated"
+
+class FakeSMSTransport:
+    """
+    An offline stand-in for Twilio with configurable latency and error rates, for load-testing
+    the dispatcher. Counts every call it receives in `calls`.
+    """
+    def __init__(self, latency=0.05, throttle_rate=0.0, error_rate=0.0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send(self, to_number, body):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        roll = random.random()
+        if roll < self.throttle_rate:
+            raise SMSSendError("Too Many Requests", status=429)
+        if roll < self.throttle_rate + self.error_rate:
+            raise SMSSendError("Service Unavailable", status=503)
+        return f"SMfake{uuid.uuid4().hex}"
+
+class TokenBucket:
+    """A thread-safe token bucket: `rate` tokens per second, holding at most `capacity`."""
+    def __init__(self, rate, capacity=1):
+        if not rate > 0:
+            raise ValueError(f"A token bucket's rate must be greater than 0 tokens per second, got {rate!r}.")
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class SMSDispatcher:
+    """
+    Sends SMS through a bounded queue drained by a few worker threads. Every send takes a
+    token from a shared rate limiter first, so bursts are smoothed to the provider's rate
+    instead of being throttled. Sends rejected with 429 or a 5xx status are retried with
+    exponential backoff, up to `max_retries` times per message.
+    """
+    def __init__(self, transport, rate=SMS_RATE_PER_SECOND, burst=SMS_BURST, workers=SMS_WORKERS,
+                 queue_size=SMS_QUEUE_SIZE, max_retries=SMS_MAX_RETRIES, base_backoff=1.0):
+        if not rate > 0:
+            # With 0 every send would wait forever (and a negative rate never refills).
+            raise ValueError(f"SMS_RATE_PER_SECOND must be greater than 0 messages per second, got {rate!r}.")
+        self.transport = transport
+        self.limiter = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"sms-dispatcher-{i}", daemon=True).start()
+
+    def submit(self, to_number, body, timeout=None):
+        """
+        Queues one message and returns a Future for its SID. Blocks while the queue is
+        full; if it stays full past `timeout` seconds, the Future fails with queue.Full.
+        """
+        future = Future()
+        try:
+            self._queue.put((to_number, body, future), timeout=timeout)
+        except queue.Full as e:
+            future.set_exception(e)
+        return future
+
+    def send_many(self, messages):
+        """Sends (to_number, body) pairs concurrently. Returns the SID, or None, for each."""
+        futures = [self.submit(to_number, body) for to_number, body in messages]
+        results = []
+        for (to_number, _), future in zip(messages, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error sending SMS to {to_number}: {e}")
+                results.append(None)
+        return results
+
+    def _worker(self):
+        while True:
+            to_number, body, future = self._queue.get()
+            started = time.perf_counter()
+            try:
+                future.set_result(self._send_with_retry(to_number, body))
+                NOTIFICATION_SECONDS.observe(time.perf_counter() - started, "sms", "sent")
+            except Exception as e:
+                NOTIFICATION_SECONDS.observe(time.perf_counter() - started, "sms", "failed")
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _send_with_retry(self, to_number, body):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                return self.transport.send(to_number, body)
+            except SMSSendError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                time.sleep(self.base_backoff * 2 ** attempt)
+                attempt += 1
+
+_sms_dispatcher = None
+_sms_dispatcher_lock = threading.Lock()
+
+def get_sms_dispatcher():
+    """Returns the process-wide SMS dispatcher, creating it (and its transport) on first use."""
+    global _sms_dispatcher
+    with _sms_dispatcher_lock:
+        if _sms_dispatcher is None:
+            if SMS_TRANSPORT == 'fake':
+                transport = FakeSMSTransport()
+            elif 'ACxxxxxxxx' in TWILIO_ACCOUNT_SID or 'your_auth_token' in TWILIO_AUTH_TOKEN:
+                transport = SimulatedTransport()
+            else:
+                transport = TwilioTransport()
+            _sms_dispatcher = SMSDispatcher(transport)
+        return _sms_dispatcher
+
+def send_sms_many(messages):
+    """Sends many (to_number, body) SMS through the rate-limited dispatcher."""
+    results = get_sms_dispatcher().send_many(messages)
+    for (to_number, _), sid in zip(messages, results):
+        if sid and sid != "simulated":
+            print(f"SMS sent to {to_number}. SID: {sid}")
+    return results
+
+def send_sms(to_number, body):
+    """Sends an SMS using Twilio. Includes a simulation mode."""
+    return send_sms_many([(to_number, body)])[0]
+
+class SMTPConnectionPool:
+    """
+    A thread-safe pool of open, authenticated SMTP sessions.
+
+    Opening a session costs a TCP connect, STARTTLS and LOGIN, so sessions are kept and
+    reused. A session idle for longer than `idle_timeout` is closed instead of reused,
+    and a reused session is checked with NOOP first. If the server drops a session
+    mid-send, the pool reconnects once and retries the message.
+    """
+    def __init__(self, host, port, user=None, password=None, starttls=True,
+                 max_size=SMTP_POOL_SIZE, idle_timeout=SMTP_IDLE_TIMEOUT, timeout=30):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.starttls = starttls
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()  # (session, last_used) pairs; the most recently used is reused first
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls() # Secure the connection
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _is_alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.idle_timeout and self._is_alive(server):
+                return server
+            self._close(server)
+        return self._connect()
+
+    @contextmanager
+    def session(self):
+        """Checks out a live session and returns it to the pool afterwards (or drops it if it broke)."""
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._checkout()
+            yield server
+        except (smtplib.SMTPServerDisconnected, OSError):
+            if server is not None:
+                server.close()
+                server = None
+            raise
+        finally:
+            if server is not None:
+                with self._lock:
+                    self._idle.append((server, time.monotonic()))
+            self._slots.release()
+
+    def send_messages(self, messages):
+        """
+        Sends many MIME messages over one session. Returns a list with True/False per message.
+        A dropped connection is re-established once; other errors only fail that message.
+        """
+        results = []
+        pending = list(messages)
+        reconnected = False
+        while pending:
+            try:
+                with self.session() as server:
+                    while pending:
+                        started = time.perf_counter()
+                        try:
+                            server.send_message(pending[0])
+                            results.append(True)
+                            NOTIFICATION_SECONDS.observe(time.perf_counter() - started, "email", "sent")
+                        except smtplib.SMTPServerDisconnected:
+                            raise
+                        except smtplib.SMTPException as e:
+                            print(f"Error sending email to {pending[0]['To']}: {e}")
+                            results.append(False)
+                            NOTIFICATION_SECONDS.observe(time.perf_counter() - started, "email", "failed")
+                        pending.pop(0)
+            except (smtplib.SMTPException, OSError) as e:
+                if reconnected:
+                    print(f"Error sending email batch via {self.host}: {e}")
+                    results.extend(False for _ in pending)
+                    break
+                reconnected = True
+        return results
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for server, _ in idle:
+            self._close(server)
+
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+def get_smtp_pool():
+    """Returns the process-wide SMTP pool, creating it on first use."""
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPConnectionPool(SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS, starttls=SMTP_STARTTLS)
+            atexit.register(_smtp_pool.close_all)
+        return _smtp_pool
+
+def _build_email(to_email, subject, body):
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = SMTP_FROM
+    msg['To'] = to_email
+    return msg
+
+def send_emails(emails):
+    """
+    Sends many (to_email, subject, body) emails, pipelined over one pooled SMTP session.
+    Includes a simulation mode. Returns a list with "sent"/"simulated" or None per email.
+    """
+    if not SMTP_SERVER:
+        for to_email, subject, body in emails:
+            print("\n--- EMAIL SIMULATION ---")
+            print(f"To: {to_email}\nSubject: {subject}\nBody: {body}")
+            print("--- (To send real emails, update SMTP credentials in your .env file) ---\n")
+        return ["simulated"] * len(emails)
+
+    results = get_smtp_pool().send_messages(_build_email(*email) for email in emails)
+    for (to_email, _, _), ok in zip(emails, results):
+        if ok:
+            print(f"Email sent successfully to {to_email}")
+    return ["sent" if ok else None for ok in results]
+
+def send_email(to_email, subject, body):
+    """Sends an email using a pooled SMTP session. Includes a simulation mode."""
+    return send_emails([(to_email, subject, body)])[0]
+
+def missed_dose_messages(dose):
+    """
+    Builds the notifications for one missed dose: an SMS and an email to the patient, plus
+    an SMS to their close contact. `dose` is a row from sweeper.mark_missed_doses.
+    Returns a list of (channel, recipient, subject, body, audience) tuples and the alert
+    message to show in the GUI. `audience` is 'patient' or 'contact'.
+    """
+    patient_name = dose['user_name']
+
+    # --- Notifications to User ---
+    user_email_subject = "Medication Reminder: Missed Dose"
+    user_email_body = f"Hi {patient_name},\n\nThis is a reminder that you missed your dose for {dose['medicine_name']}.\n\nPlease take it as soon as possible.\n\n- MedReminder App"
+    user_sms_body = f"MedReminder Alert: Hi {patient_name}, it looks like you missed your {dose['medicine_name']} dose. Please take it as soon as possible."
+    messages = [
+        ('sms', dose['user_contact'], None, user_sms_body, 'patient'),
+        ('email', dose['user_email'], user_email_subject, user_email_body, 'patient'),
+    ]
+
+    # --- Notification to Close Contact ---
+    if dose.get('cc_contact'):
+        cc_sms_body = f"MedReminder Alert: {patient_name} has missed their {dose['medicine_name']} dose. Please check on them."
+        # We don't have email for close contact, so only SMS is sent.
+        messages.append(('sms', dose['cc_contact'], None, cc_sms_body, 'contact'))
+        gui_alert_message = f"ALERT: Missed {dose['medicine_name']} dose. Sending reminders to you and your contact, {dose['cc_name']}."
+    else:
+        gui_alert_message = f"ALERT: Missed {dose['medicine_name']} dose. Sending reminders to you."
+    return messages, gui_alert_message
+
+def digest_message(channel, items):
+    """
+    Combines several queued notifications for the same recipient into one message.
+    `items` are outbox rows with subject, body, audience, patient_name and medicine_name.
+    A single item is sent unchanged. Returns (subject, body).
+    """
+    if len(items) == 1:
+        return items[0]['subject'], items[0]['body']
+
+    patients = sorted({item['patient_name'] for item in items})
+    if len(patients) == 1 and all(item['audience'] == 'patient' for item in items):
+        patient_name = patients[0]
+        medicines = ", ".join(item['medicine_name'] for item in items)
+        if channel == 'email':
+            subject = f"Medication Reminder: {len(items)} Missed Doses"
+            body = f"Hi {patient_name},\n\nThis is a reminder that you missed your doses for: {medicines}.\n\nPlease take them as soon as possible.\n\n- MedReminder App"
+            return subject, body
+        return None, f"MedReminder Alert: Hi {patient_name}, it looks like you missed {len(items)} doses: {medicines}. Please take them as soon as possible."
+
+    # A close contact (possibly for several patients): list the missed doses per patient.
+    per_patient = "; ".join(
+        f"{patient_name}: " + ", ".join(item['medicine_name'] for item in items if item['patient_name'] == patient_name)
+        for patient_name in patients
+    )
+    subject = f"Medication Reminder: {len(items)} Missed Doses" if channel == 'email' else None
+    return subject, f"MedReminder Alert: missed doses - {per_patient}. Please check on them."
+
+def send_notification(channel, recipient, subject, body):
+    """Sends one message on the given channel. Returns a truthy value on success."""
+    if channel == 'sms':
+        return send_sms(recipient, body)
+    if channel == 'email':
+        return send_email(recipient, subject, body)
+    raise ValueError(f"Unknown notification channel: {channel}")
@@ -0,0 +1,169 @@
+# /medication-reminder-app/outbox.py
+import argparse
+import os
+import threading
+import metrics
+from repository import get_storage
+from notifications import digest_message, missed_dose_messages, send_notification, send_emails, send_sms_many
+
+# Worker threads per channel. This is also the channel's concurrency limit towards the provider.
+OUTBOX_SMS_WORKERS = int(os.getenv("OUTBOX_SMS_WORKERS", 4))
+OUTBOX_EMAIL_WORKERS = int(os.getenv("OUTBOX_EMAIL_WORKERS", 2))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 10))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 2))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+# Retries wait 15s, 30s, 60s, ... capped at OUTBOX_MAX_BACKOFF_SECONDS.
+OUTBOX_BASE_BACKOFF_SECONDS = int(os.getenv("OUTBOX_BASE_BACKOFF_SECONDS", 15))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 900))
+# New alerts wait this long before being sent, so all of a recipient's alerts from one sweep
+# (or a few close together) go out as a single digest message.
+OUTBOX_COALESCE_SECONDS = int(os.getenv("OUTBOX_COALESCE_SECONDS", 60))
+# A claimed message that is neither sent nor failed within this time (e.g., the worker died)
+# becomes claimable again.
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", 120))
+
+def enqueue_missed_dose_alerts(repo, missed_doses):
+    """
+    Writes the notifications for the given missed doses to notification_outbox in the
+    caller's transaction, so they commit (or roll back) together with the MISSED update.
+    A dose is only ever queued once per recipient and channel, so repeated sweeps don't
+    produce duplicate alerts. Returns the GUI alert message for each dose.
+    """
+    rows, gui_alerts = [], []
+    for dose in missed_doses:
+        messages, gui_alert_message = missed_dose_messages(dose)
+        rows.extend((channel, recipient, subject, body, dose['id'], audience, dose['user_name'], dose['medicine_name'])
+                    for channel, recipient, subject, body, audience in messages if recipient)
+        gui_alerts.append(gui_alert_message)
+    if rows:
+        repo.enqueue_notifications(rows, OUTBOX_COALESCE_SECONDS)
+    return gui_alerts
+
+def claim_messages(repo, channel, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Claims every due message for up to `batch_size` recipients on one channel, so that all
+    of a recipient's pending alerts can be sent as one digest. Claiming pushes
+    next_attempt_at out by the lease time instead of holding a row lock while sending,
+    so other workers skip these rows and a crashed worker's messages are retried later.
+    """
+    return repo.claim_notifications(channel, batch_size, OUTBOX_LEASE_SECONDS)
+
+def coalesce_messages(channel, messages):
+    """
+    Groups claimed messages by recipient into digests: a list of (digest, [messages]).
+    Messages queued before digests existed have no audience, patient or medicine to
+    combine, so each of them is sent on its own, as queued.
+    """
+    groups, digests = {}, []
+    for message in messages:
+        if message['audience'] and message['patient_name'] and message['medicine_name']:
+            groups.setdefault(message['recipient'], []).append(message)
+        else:
+            digest = {'channel': channel, 'recipient': message['recipient'],
+                      'subject': message['subject'], 'body': message['body']}
+            digests.append((digest, [message]))
+    for recipient, items in groups.items():
+        subject, body = digest_message(channel, items)
+        digests.append(({'channel': channel, 'recipient': recipient, 'subject': subject, 'body': body}, items))
+    return digests
+
+def record_results(repo, results):
+    """Marks each claimed message as SENT, or schedules a retry with exponential backoff."""
+    for message, ok, error in results:
+        if ok:
+            repo.mark_notification_sent(message['id'])
+        elif message['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+            repo.mark_notification_failed(message['id'], error)
+        else:
+            backoff = min(OUTBOX_BASE_BACKOFF_SECONDS * 2 ** (message['attempts'] - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+            repo.retry_notification(message['id'], backoff, error)
+
+def _send(message):
+    try:
+        if send_notification(message['channel'], message['recipient'], message['subject'], message['body']):
+            return message, True, None
+        return message, False, "send failed"
+    except Exception as e:
+        return message, False, str(e)
+
+def _send_all(channel, messages):
+    """
+    Sends a claimed batch as one digest per recipient. Emails go out together over one
+    pooled SMTP session; SMS are handed to the rate-limited dispatcher all at once.
+    Every message in a digest shares the digest's outcome.
+    """
+    digests = coalesce_messages(channel, messages)
+    outgoing = [digest for digest, _ in digests]
+    try:
+        if channel == 'email':
+            sent = send_emails([(d['recipient'], d['subject'], d['body']) for d in outgoing])
+        elif channel == 'sms':
+            sent = send_sms_many([(d['recipient'], d['body']) for d in outgoing])
+        else:
+            sent = [ok for _, ok, _ in (_send(d) for d in outgoing)]
+        outcomes = [(bool(ok), None if ok else "send failed") for ok in sent]
+    except Exception as e:
+        outcomes = [(False, str(e))] * len(digests)
+    return [(message, ok, error)
+            for (_, items), (ok, error) in zip(digests, outcomes)
+            for message in items]
+
+def dispatch_batch(channel, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Claims one batch for `channel`, sends it and records the outcome. The database
+    connection is returned to the pool while the messages are being sent, so slow
+    providers never hold a pooled connection. Returns the number of messages processed.
+    """
+    storage = get_storage()
+    with storage.transaction() as repo:
+        messages = claim_messages(repo, channel, batch_size)
+
+    if not messages:
+        return 0
+    results = _send_all(channel, messages)
+
+    with storage.transaction() as repo:
+        record_results(repo, results)
+    return len(messages)
+
+def _worker_loop(channel, stop_event, batch_size, poll_seconds):
+    while not stop_event.is_set():
+        try:
+            processed = dispatch_batch(channel, batch_size)
+        except Exception as e:
+            # Whatever went wrong (the database, a provider, a malformed row), the worker
+            # backs off for a poll interval and carries on: a dead thread would stop the channel.
+            print(f"❌ Outbox worker for '{channel}' failed: {e!r}")
+            metrics.record_background_error(f"outbox-{channel}")
+            processed = 0
+        if processed < batch_size:
+            # Drained for now; a full batch means there is more waiting, so loop right away.
+            stop_event.wait(poll_seconds)
+
+def start_dispatcher(sms_workers=OUTBOX_SMS_WORKERS, email_workers=OUTBOX_EMAIL_WORKERS,
+                     batch_size=OUTBOX_BATCH_SIZE, poll_seconds=OUTBOX_POLL_SECONDS):
+    """
+    Starts the dispatcher worker pool on daemon threads and returns a stop event.
+    Each channel gets its own workers, which caps how many sends run against each provider.
+    """
+    stop_event = threading.Event()
+    for channel, count in (('sms', sms_workers), ('email', email_workers)):
+        for i in range(count):
+            threading.Thread(target=_worker_loop, args=(channel, stop_event, batch_size, poll_seconds),
+                             name=f"outbox-{channel}-{i}", daemon=True).start()
+    print(f"Notification dispatcher started ({sms_workers} SMS / {email_workers} email workers).")
+    return stop_event
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sends queued notifications from notification_outbox.")
+    parser.add_argument("--sms-workers", type=int, default=OUTBOX_SMS_WORKERS)
+    parser.add_argument("--email-workers", type=int, default=OUTBOX_EMAIL_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    stop_event = start_dispatcher(args.sms_workers, args.email_workers, args.batch_size)
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        stop_event.set()
+        print("Dispatcher stopped.")
@@ -0,0 +1,244 @@
+# /medication-reminder-app/partitions.py
+"""
+Monthly range partitioning of dose_history by scheduled_for (PostgreSQL only).
+
+Every query on the request path filters on scheduled_for (today's schedule, the missed-dose
+window, recent confirmations), so PostgreSQL prunes the scan to the current month's
+partition and the indexes stay the size of one month, however long the history grows.
+
+    python partitions.py              # create upcoming partitions, archive expired ones
+    python partitions.py --migrate    # convert an existing unpartitioned dose_history
+
+Run it daily (e.g., from cron, next to pregenerate_doses.py). Rows that fall outside every
+monthly partition land in dose_history_default and are moved into their month's partition
+when it is created, so an insert never fails for lack of a partition.
+"""
+import argparse
+import gzip
+import os
+import re
+import time
+from datetime import date
+import psycopg2
+from database import get_db_connection, release_db_connection
+
+# Whether init_db creates dose_history partitioned (a fresh database only; see --migrate).
+DOSE_HISTORY_PARTITIONED = os.getenv("DOSE_HISTORY_PARTITIONED", "").lower() in ("1", "true", "yes")
+# Partitions are kept ready for the current month and this many months after it.
+DOSE_PARTITION_MONTHS_AHEAD = int(os.getenv("DOSE_PARTITION_MONTHS_AHEAD", 3))
+# Months of dose history kept in the database; older partitions are archived and dropped (0 = keep all).
+DOSE_RETENTION_MONTHS = int(os.getenv("DOSE_RETENTION_MONTHS", 24))
+DOSE_ARCHIVE_DIR = os.getenv("DOSE_ARCHIVE_DIR", "archive")
+
+PARTITION_NAME = re.compile(r"^dose_history_y(\d{4})m(\d{2})$")
+
+def month_start(day, months=0):
+    """The first day of the month `months` months after the one containing `day`."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f"dose_history_y{month.year:04d}m{month.month:02d}"
+
+def is_partitioned(cur):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('dose_history'))")
+    return cur.fetchone()[0]
+
+def create_partitioned_dose_history(cur):
+    """
+    Creates dose_history as a table partitioned by month, with its default partition.
+    The primary key has to include the partition key, hence (id, scheduled_for).
+    """
+    cur.execute("""
+        CREATE TABLE dose_history (
+            id SERIAL,
+            user_id INT REFERENCES users(id) ON DELETE CASCADE,
+            medication_id INT REFERENCES medications(id) ON DELETE CASCADE,
+            scheduled_for DATE NOT NULL,
+            scheduled_time TIME NOT NULL,
+            status VARCHAR(20) DEFAULT 'PENDING', -- PENDING, TAKEN, MISSED
+            updated_at TIMESTAMP,
+            dosage VARCHAR(100),
+            due_at TIMESTAMPTZ,
+            PRIMARY KEY (id, scheduled_for)
+        ) PARTITION BY RANGE (scheduled_for);
+    """)
+    cur.execute("CREATE TABLE dose_history_default PARTITION OF dose_history DEFAULT;")
+
+def monthly_partitions(cur):
+    """The months that currently have their own partition, oldest first."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'dose_history'::regclass
+    """)
+    months = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def create_partition(cur, month):
+    """
+    Creates the partition for `month`, moving any of its rows out of the default partition
+    first (PostgreSQL refuses to attach a range that the default partition still holds).
+    """
+    name, upper = partition_name(month), month_start(month, 1)
+    cur.execute(f"CREATE TABLE {name} (LIKE dose_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM dose_history_default WHERE scheduled_for >= %s AND scheduled_for < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        (month, upper)
+    )
+    # Attaching builds the parent's indexes and foreign keys on the new partition.
+    cur.execute(f"ALTER TABLE dose_history ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                (month.isoformat(), upper.isoformat()))
+
+def ensure_partitions(cur, months_ahead=DOSE_PARTITION_MONTHS_AHEAD, first_month=None, today=None):
+    """
+    Creates the missing monthly partitions from `first_month` (default: the current month)
+    through `months_ahead` months from now. Does nothing if dose_history isn't partitioned.
+    Returns the names of the partitions created.
+    """
+    if not is_partitioned(cur):
+        return []
+    this_month = month_start(today or date.today())
+    month = first_month or this_month
+    existing = set(monthly_partitions(cur))
+    created = []
+    while month <= month_start(this_month, months_ahead):
+        if month not in existing:
+            create_partition(cur, month)
+            created.append(partition_name(month))
+        month = month_start(month, 1)
+    return created
+
+def archive_partition(conn, month, archive_dir=DOSE_ARCHIVE_DIR):
+    """
+    Writes one month of dose history to `archive_dir` as gzip-compressed CSV, then detaches
+    and drops its partition. The file is complete (and synced) before anything is dropped,
+    so an interrupted run loses nothing and simply archives the month again next time.
+    Returns the path of the archive.
+    """
+    name = partition_name(month)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    with open(path + ".tmp", "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f, conn.cursor() as cur:
+            cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(path + ".tmp", path)
+    conn.commit()
+    with conn.cursor() as cur:
+        # DETACH briefly locks the parent; give up rather than queue behind long queries.
+        cur.execute("SET LOCAL lock_timeout = '5s'")
+        cur.execute(f"ALTER TABLE dose_history DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+    conn.commit()
+    return path
+
+def archive_expired(conn, retention_months=DOSE_RETENTION_MONTHS, archive_dir=DOSE_ARCHIVE_DIR, today=None):
+    """Archives every monthly partition older than `retention_months`. Returns the archive paths."""
+    if retention_months <= 0:
+        return []
+    with conn.cursor() as cur:
+        if not is_partitioned(cur):
+            return []
+        months = monthly_partitions(cur)
+    oldest_kept = month_start(today or date.today(), -retention_months)
+    return [archive_partition(conn, month, archive_dir) for month in months if month < oldest_kept]
+
+def migrate_to_partitioned(conn, months_ahead=DOSE_PARTITION_MONTHS_AHEAD):
+    """
+    Converts an existing, unpartitioned dose_history into a partitioned one in a single
+    transaction: the old table is renamed, every month it covers gets a partition, the rows
+    are copied across and the old table is dropped. The table is locked for the duration,
+    so run it during a maintenance window on large databases. Returns the rows copied.
+    """
+    from init_db import create_adherence_rollup, create_dose_history_indexes
+    with conn.cursor() as cur:
+        if is_partitioned(cur):
+            print("dose_history is already partitioned.")
+            return 0
+        cur.execute("LOCK TABLE dose_history IN ACCESS EXCLUSIVE MODE")
+        cur.execute("ALTER TABLE dose_history RENAME TO dose_history_unpartitioned")
+        # Frees the names of the primary key and the serial sequence for the new table.
+        cur.execute("ALTER INDEX IF EXISTS dose_history_pkey RENAME TO dose_history_unpartitioned_pkey")
+        cur.execute("ALTER SEQUENCE IF EXISTS dose_history_id_seq RENAME TO dose_history_unpartitioned_id_seq")
+        # LIKE keeps every column, including ones added to dose_history after its creation.
+        cur.execute("CREATE TABLE dose_history (LIKE dose_history_unpartitioned INCLUDING DEFAULTS) "
+                    "PARTITION BY RANGE (scheduled_for)")
+        cur.execute("CREATE SEQUENCE dose_history_id_seq OWNED BY dose_history.id")
+        cur.execute("ALTER TABLE dose_history ALTER COLUMN id SET DEFAULT nextval('dose_history_id_seq')")
+        cur.execute("ALTER TABLE dose_history ADD PRIMARY KEY (id, scheduled_for)")
+        cur.execute("ALTER TABLE dose_history ADD CONSTRAINT dose_history_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE")
+        cur.execute("ALTER TABLE dose_history ADD CONSTRAINT dose_history_medication_id_fkey FOREIGN KEY (medication_id) REFERENCES medications(id) ON DELETE CASCADE")
+        cur.execute("CREATE TABLE dose_history_default PARTITION OF dose_history DEFAULT")
+
+        cur.execute("SELECT min(scheduled_for) FROM dose_history_unpartitioned")
+        oldest = cur.fetchone()[0]
+        ensure_partitions(cur, months_ahead, first_month=month_start(oldest) if oldest else None)
+
+        cur.execute("INSERT INTO dose_history SELECT * FROM dose_history_unpartitioned")
+        copied = cur.rowcount
+        # The new sequence continues where the old one stopped.
+        cur.execute("SELECT setval('dose_history_id_seq', GREATEST((SELECT max(id) FROM dose_history), 1))")
+        cur.execute("DROP TABLE dose_history_unpartitioned")
+        # Built once over the copied rows rather than maintained row by row during the copy.
+        create_dose_history_indexes(cur)
+        # Triggers don't carry over to the new table; the rollup already counts every copied row.
+        create_adherence_rollup(cur)
+    conn.commit()
+    return copied
+
+def run_maintenance(months_ahead=DOSE_PARTITION_MONTHS_AHEAD, retention_months=DOSE_RETENTION_MONTHS,
+                    archive_dir=DOSE_ARCHIVE_DIR):
+    """Creates upcoming partitions and archives expired ones. Returns (created, archived)."""
+    created, archived = [], []
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            created = ensure_partitions(cur, months_ahead)
+        conn.commit()
+        archived = archive_expired(conn, retention_months, archive_dir)
+    except (psycopg2.Error, OSError, ValueError, RuntimeError) as e:
+        if conn:
+            conn.rollback()
+        print(f"❌ Partition maintenance failed: {e}")
+    finally:
+        if conn:
+            release_db_connection(conn)
+    return created, archived
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates upcoming dose_history partitions and archives expired ones.")
+    parser.add_argument("--migrate", action="store_true", help="Convert an existing unpartitioned dose_history first.")
+    parser.add_argument("--months-ahead", type=int, default=DOSE_PARTITION_MONTHS_AHEAD, help="Future months to keep partitions ready for.")
+    parser.add_argument("--retention-months", type=int, default=DOSE_RETENTION_MONTHS, help="Months of history to keep (0 = keep all).")
+    parser.add_argument("--archive-dir", default=DOSE_ARCHIVE_DIR, help="Where archived months are written as .csv.gz.")
+    args = parser.parse_args()
+
+    if args.migrate:
+        conn = get_db_connection()
+        try:
+            started = time.perf_counter()
+            copied = migrate_to_partitioned(conn, args.months_ahead)
+            print(f"✅ Moved {copied} dose(s) into the partitioned dose_history in {time.perf_counter() - started:.1f}s.")
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"❌ Migration failed, dose_history is unchanged: {e}")
+        finally:
+            release_db_connection(conn)
+
+    created, archived = run_maintenance(args.months_ahead, args.retention_months, args.archive_dir)
+    for name in created:
+        print(f"Created partition {name}.")
+    for path in archived:
+        print(f"Archived and dropped {os.path.basename(path)[:-len('.csv.gz')]} -> {path}")
+    print(f"✅ Partition maintenance done ({len(created)} created, {len(archived)} archived).")
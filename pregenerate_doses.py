@@ -0,0 +1,86 @@
+# /medication-reminder-app/pregenerate_doses.py
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import psycopg2
+import psycopg2.extras
+from database import get_db_connection, release_db_connection
+from partitions import ensure_partitions, month_start
+from recurrence import expand_medications
+from repository import INSERT_DOSES_SQL, INSERT_DOSES_TEMPLATE, _earliest_local_day
+from timezones import local_today
+
+PREGENERATE_DAYS = int(os.getenv("PREGENERATE_DAYS", 7))
+PREGENERATE_CHUNK_SIZE = int(os.getenv("PREGENERATE_CHUNK_SIZE", 5000))
+
+def pregenerate_doses(days=PREGENERATE_DAYS, chunk_size=PREGENERATE_CHUNK_SIZE, start=None):
+    """
+    Materializes dose_history for every medication of every user, from `start` through the
+    following `days - 1` days. By default each user starts from today in their own timezone,
+    as their own requests do (see repository.GENERATE_DOSES_SQL).
+
+    Medications are streamed from a server-side cursor, so memory use stays flat no matter
+    how many patients there are. Each chunk of medications is expanded (recurrence rules
+    included) into one multi-row INSERT via execute_values and is committed on its own;
+    ON CONFLICT DO NOTHING skips doses that already exist, so the job can be re-run or
+    overlap with users' own requests.
+    Returns (medications scanned, doses generated, doses inserted).
+    """
+    days = max(days, 1)
+    scanned = generated = inserted = 0
+    started = time.perf_counter()
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            # Rolls partitioned dose_history forward, so the doses below land in monthly partitions.
+            ensure_partitions(cur, first_month=month_start(start or _earliest_local_day(datetime.now(timezone.utc))))
+        conn.commit()
+        # WITH HOLD keeps the server-side cursor open across the per-chunk commits.
+        with conn.cursor(name="pregenerate_medications", withhold=True,
+                         cursor_factory=psycopg2.extras.DictCursor) as meds, conn.cursor() as cur:
+            meds.itersize = chunk_size
+            meds.execute("SELECT m.id, m.user_id, m.time_to_take, m.recurrence, u.timezone "
+                         "FROM medications m JOIN users u ON u.id = m.user_id ORDER BY m.id")
+            while True:
+                chunk = meds.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                by_timezone = {}
+                for med in chunk:
+                    by_timezone.setdefault(med['timezone'], []).append(med)
+                rows = []
+                for timezone_name, medications in by_timezone.items():
+                    first = start or local_today(timezone_name)
+                    rows.extend(expand_medications(medications, first, first + timedelta(days=days - 1)))
+                if rows:
+                    # Each dose's due_at comes from its user's timezone (see repository.INSERT_DOSES_SQL).
+                    psycopg2.extras.execute_values(cur, INSERT_DOSES_SQL, rows, template=INSERT_DOSES_TEMPLATE,
+                                                   page_size=len(rows))
+                    inserted += cur.rowcount
+                conn.commit()
+                scanned += len(chunk)
+                generated += len(rows)
+                elapsed = time.perf_counter() - started
+                print(f"  {scanned} medications, {inserted} doses inserted ({generated / elapsed:.0f} rows/s)")
+    except (psycopg2.Error, RuntimeError) as e:
+        if conn:
+            conn.rollback()
+        print(f"❌ Error while pre-generating doses: {e}")
+    finally:
+        if conn:
+            release_db_connection(conn)
+    return scanned, generated, inserted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generates upcoming dose_history rows for all users (e.g., nightly from cron).")
+    parser.add_argument("--days", type=int, default=PREGENERATE_DAYS, help="Number of days to materialize, starting from each user's local today.")
+    parser.add_argument("--chunk-size", type=int, default=PREGENERATE_CHUNK_SIZE, help="Medications per INSERT/commit.")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    scanned, rows, inserted = pregenerate_doses(args.days, args.chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Processed {rows} dose rows for {scanned} medications in {elapsed:.1f}s "
+          f"({rows / elapsed if elapsed else 0:.0f} rows/s); {inserted} new doses inserted.")
@@ -0,0 +1,180 @@
+# /medication-reminder-app/recurrence.py
+"""
+Recurrence rules for medications. A rule is a small JSON object stored on the medication,
+and doses are expanded from it for whatever date window is asked for (today's schedule,
+the nightly pre-generation), so no future occurrence is stored ahead of time.
+
+    {"times": ["08:00", "14:00", "20:00"]}                       three times a day
+    {"every_hours": 8, "times": ["06:00"], "weekdays": ["mon", "tue", "wed", "thu", "fri"]}
+    {"every_days": 2, "times": ["09:00"], "end": "2026-12-31"}   every other day until a date
+    {"times": ["08:00"], "taper": [{"days": 7, "dosage": "40 mg"}, {"days": 7, "dosage": "20 mg"}]}
+
+`start` (default: the day the rule is saved) anchors every_days, every_hours and taper.
+A taper runs its steps back to back from `start`; the medication ends after the last one.
+A medication without a rule is taken once a day at its time_to_take.
+"""
+import bisect
+import json
+from datetime import date, datetime, timedelta
+from datetime import time as time_of_day
+
+RULE_KEYS = {"times", "every_hours", "every_days", "weekdays", "start", "end", "taper"}
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MAX_EVERY_HOURS = 24 * 7
+
+def _time(value, what):
+    try:
+        return time_of_day.fromisoformat(str(value).strip()).strftime('%H:%M:%S')
+    except ValueError:
+        raise ValueError(f"{what} must be a time in HH:MM (24-hour) format.") from None
+
+def _positive_int(value, what, maximum=None):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1 or (maximum and value > maximum):
+        raise ValueError(f"{what} must be a whole number from 1{f' to {maximum}' if maximum else ''}.")
+    return value
+
+def parse_rule(rule, time_to_take=None, today=None):
+    """
+    Validates a rule from an API request and returns (normalized rule, time_to_take), where
+    time_to_take is the first time of day the rule uses. Raises ValueError with a message
+    fit for the client when the rule is invalid.
+    """
+    if not isinstance(rule, dict):
+        raise ValueError("recurrence must be an object.")
+    unknown = set(rule) - RULE_KEYS
+    if unknown:
+        raise ValueError(f"Unknown recurrence field(s): {', '.join(sorted(unknown))}.")
+
+    times = rule.get("times") or ([time_to_take] if time_to_take else [])
+    if not isinstance(times, list) or not times:
+        raise ValueError("recurrence.times (or time) is required.")
+    normalized = {"times": sorted({_time(t, "Each of recurrence.times") for t in times})}
+
+    if rule.get("every_hours") is not None:
+        if rule.get("every_days") is not None:
+            raise ValueError("Use either every_hours or every_days, not both.")
+        if len(normalized["times"]) != 1:
+            raise ValueError("With every_hours, times holds exactly one time: the first dose.")
+        normalized["every_hours"] = _positive_int(rule["every_hours"], "every_hours", MAX_EVERY_HOURS)
+    if rule.get("every_days") is not None:
+        normalized["every_days"] = _positive_int(rule["every_days"], "every_days")
+    if rule.get("weekdays") is not None:
+        weekdays = rule["weekdays"]
+        if not isinstance(weekdays, list) or not weekdays or any(str(d).lower()[:3] not in WEEKDAYS for d in weekdays):
+            raise ValueError(f"weekdays must be a list of: {', '.join(WEEKDAYS)}.")
+        normalized["weekdays"] = sorted({WEEKDAYS.index(str(d).lower()[:3]) for d in weekdays})
+
+    try:
+        start = date.fromisoformat(rule["start"]) if rule.get("start") else (today or date.today())
+        end = date.fromisoformat(rule["end"]) if rule.get("end") else None
+    except (TypeError, ValueError):
+        raise ValueError("start and end must be dates in YYYY-MM-DD format.") from None
+    if end and end < start:
+        raise ValueError("end must not be before start.")
+    normalized["start"] = start.isoformat()
+    if end:
+        normalized["end"] = end.isoformat()
+
+    if rule.get("taper") is not None:
+        taper = rule["taper"]
+        if not isinstance(taper, list) or not taper or not all(isinstance(step, dict) for step in taper):
+            raise ValueError("taper must be a list of {days, dosage} steps.")
+        normalized["taper"] = [{"days": _positive_int(step.get("days"), "Each taper step's days"),
+                                "dosage": str(step.get("dosage") or "").strip()} for step in taper]
+    return normalized, normalized["times"][0]
+
+class Schedule:
+    """A rule prepared for repeated expansion: parsed dates and times, taper boundaries."""
+    def __init__(self, rule):
+        self.times = [time_of_day.fromisoformat(t) for t in rule["times"]]
+        self.every_hours = rule.get("every_hours")
+        self.every_days = rule.get("every_days", 1)
+        self.weekdays = set(rule["weekdays"]) if rule.get("weekdays") else None
+        self.start = date.fromisoformat(rule["start"])
+        self.end = date.fromisoformat(rule["end"]) if rule.get("end") else date.max
+        self.taper_ends, self.taper_dosages = [], []
+        for step in rule.get("taper") or ():
+            self.taper_ends.append((self.taper_ends[-1] if self.taper_ends else 0) + step["days"])
+            self.taper_dosages.append(step["dosage"])
+        if self.taper_ends:
+            self.end = min(self.end, self.start + timedelta(days=self.taper_ends[-1] - 1))
+
+    def dosage(self, day, default):
+        """The taper step's dosage on `day`, or `default` without a taper."""
+        if not self.taper_ends:
+            return default
+        return self.taper_dosages[bisect.bisect_right(self.taper_ends, (day - self.start).days)] or default
+
+    def instants(self, first_day, last_day):
+        """Every dose time in [first_day, last_day] before weekday filtering, in order."""
+        first_day, last_day = max(first_day, self.start), min(last_day, self.end)
+        if first_day > last_day:
+            return []
+        if self.every_hours:
+            # Index arithmetic instead of walking from `start`: k-th dose = anchor + k * step.
+            anchor = datetime.combine(self.start, self.times[0])
+            step = timedelta(hours=self.every_hours)
+            first_k = max(0, -(-(datetime.combine(first_day, time_of_day.min) - anchor) // step))
+            last_k = (datetime.combine(last_day, time_of_day.max) - anchor) // step
+            return [anchor + k * step for k in range(first_k, last_k + 1)]
+        # The first matching day on or after first_day, then every `every_days` days.
+        offset = -(first_day - self.start).days % self.every_days
+        days = range(0, (last_day - first_day).days - offset + 1, self.every_days)
+        day0 = first_day + timedelta(days=offset)
+        return [datetime.combine(day0 + timedelta(days=d), t) for d in days for t in self.times]
+
+    def expand(self, first_day, last_day, dosage=None):
+        """(day, time, dosage) of every dose in [first_day, last_day], in order."""
+        return [(instant.date(), instant.time(), self.dosage(instant.date(), dosage))
+                for instant in self.instants(first_day, last_day)
+                if self.weekdays is None or instant.weekday() in self.weekdays]
+
+def expand(rule, first_day, last_day, time_to_take, dosage=None):
+    """
+    The doses of one medication in [first_day, last_day] as (day, time, dosage) tuples.
+    `rule` may be None (once a day at `time_to_take`). The cost depends on the window,
+    not on how long ago the rule started.
+    """
+    if not rule:
+        rule = {"times": [str(time_to_take)], "start": first_day.isoformat()}
+    return Schedule(rule).expand(first_day, last_day, dosage)
+
+def expand_medications(medications, first_day, last_day):
+    """
+    Dose rows (user_id, medication_id, day, time, dosage) for many medications at once, for a
+    single multi-row INSERT. `medications` are rows with id, user_id, time_to_take, dosage and
+    recurrence. The dosage is only set where a taper overrides the medication's own.
+
+    A window's doses depend only on the rule, not on the medication, so each distinct rule
+    is expanded once per call and its doses are fanned out to every medication that uses it
+    (many patients share "08:00 and 20:00"; once-a-day medications share the window's days).
+    """
+    days = [first_day + timedelta(days=d) for d in range((last_day - first_day).days + 1)]
+    expanded = {}  # canonical rule JSON -> [(day, time, dosage), ...]
+    rows = []
+    for med in medications:
+        if not med['recurrence']:
+            rows.extend((med['user_id'], med['id'], day, med['time_to_take'], None) for day in days)
+            continue
+        key = json.dumps(med['recurrence'], sort_keys=True)
+        if key not in expanded:
+            expanded[key] = expand(med['recurrence'], first_day, last_day, med['time_to_take'])
+        rows.extend((med['user_id'], med['id'], day, time_to_take, dosage)
+                    for day, time_to_take, dosage in expanded[key])
+    return rows
+
+def describe(rule):
+    """A short human-readable summary of a rule, e.g. '08:00, 20:00 on Mon, Wed, Fri'."""
+    if not rule:
+        return None
+    times = ", ".join(t[:5] for t in rule["times"])
+    text = f"every {rule['every_hours']}h from {times}" if rule.get("every_hours") else times
+    if rule.get("every_days", 1) > 1:
+        text += f" every {rule['every_days']} days"
+    if rule.get("weekdays"):
+        text += " on " + ", ".join(WEEKDAYS[d].capitalize() for d in rule["weekdays"])
+    if rule.get("taper"):
+        text += " (tapering: " + " → ".join(f"{s['dosage']} × {s['days']}d" for s in rule["taper"]) + ")"
+    if rule.get("end"):
+        text += f" until {rule['end']}"
+    return text
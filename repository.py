@@ -0,0 +1,1048 @@
+# /medication-reminder-app/repository.py
+"""
+Storage layer. Every query the backend, the sweeper, the scheduler and the outbox run lives
+here, behind the same methods for two engines:
+
+  postgres  (default) the shared PostgreSQL database, through the pool in database.py
+  sqlite    an embedded SQLite file in WAL mode, for tests, benchmarks and small
+            single-node installations that run the whole stack in one process
+
+Pick one with STORAGE_BACKEND in .env. Code asks `storage.transaction()` for a repository
+bound to one transaction and calls its methods; it never sees a cursor.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from datetime import time as time_of_day
+import psycopg2
+import psycopg2.extras
+from database import (get_db_connection, release_db_connection, register_statement, execute_prepared,
+                      InstrumentedCursor)
+from events import broker, publish_event
+from metrics import record_query
+from recurrence import expand_medications
+from timezones import DEFAULT_TIMEZONE, due_at
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "med_reminder.sqlite3")
+# How long a writer waits for SQLite's single write lock before failing.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Errors either engine raises for a failed statement or lost connection.
+DatabaseErrors = (psycopg2.Error, sqlite3.Error)
+# Errors either engine raises for a violated constraint, e.g. a duplicate unique key.
+IntegrityErrors = (psycopg2.IntegrityError, sqlite3.IntegrityError)
+
+def _earliest_local_day(instant):
+    """
+    The earliest local date, in any timezone, of a UTC instant. Bounding scheduled_for by it
+    never drops a row a due_at range matches, and lets a partitioned dose_history be pruned.
+    """
+    return instant.date() - timedelta(days=1)
+
+def _hms(value):
+    """A TIME value (datetime.time from PostgreSQL, text from SQLite) as 'HH:MM:SS'."""
+    return value.strftime('%H:%M:%S') if isinstance(value, time_of_day) else str(value)
+
+class Storage:
+    """Connection handling shared by both engines. Subclasses provide connect/release/repository."""
+    name = None
+
+    @contextmanager
+    def transaction(self, conn=None):
+        """
+        Yields a repository bound to one transaction: commits when the block succeeds,
+        rolls back and re-raises when it fails. Uses `conn` if given (e.g., the request's
+        connection), otherwise takes a connection for the duration of the block.
+        """
+        own = conn is None
+        if own:
+            conn = self.connect()
+        try:
+            repo = self.repository(conn)
+            try:
+                yield repo
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                repo.close()
+            repo.committed()
+        finally:
+            if own:
+                self.release(conn)
+
+# --- PostgreSQL ---
+
+# The queries behind every schedule refresh, dose confirmation and sweep run as prepared
+# statements, parsed and planned once per pooled connection (see database.register_statement).
+DATA_REVISION_SQL = register_statement("data_revision", "SELECT data_revision FROM users WHERE id = %(user_id)s")
+# Just what a login needs, not the whole users row.
+LOGIN_USER_SQL = register_statement("login_user", "SELECT id, name, password_hash, timezone FROM users WHERE name = %(name)s")
+# Generates the doses of once-a-day medications in the database and, in the same round trip,
+# returns the user's medications with a recurrence rule (rows with a `recurrence`), which
+# the caller expands (see recurrence.py). due_at is the local date and time in the user's timezone.
+GENERATE_DOSES_SQL = register_statement("generate_doses", """
+    WITH inserted AS (
+        INSERT INTO dose_history (user_id, medication_id, scheduled_for, scheduled_time, status, due_at)
+        SELECT m.user_id, m.id, d.day::date, m.time_to_take, 'PENDING',
+               (d.day::date + m.time_to_take) AT TIME ZONE u.timezone
+        FROM medications m
+        JOIN users u ON u.id = m.user_id
+        CROSS JOIN generate_series(%(first_day)s::date, %(last_day)s::date, interval '1 day') AS d(day)
+        WHERE m.user_id = %(user_id)s AND m.recurrence IS NULL
+        ON CONFLICT (medication_id, scheduled_for, scheduled_time) DO NOTHING
+        RETURNING id, medication_id, scheduled_for, scheduled_time, due_at
+    )
+    SELECT id, medication_id, scheduled_for, scheduled_time, due_at, NULL::int AS user_id, NULL::jsonb AS recurrence
+    FROM inserted
+    UNION ALL
+    SELECT NULL, m.id, NULL, m.time_to_take, NULL, m.user_id, m.recurrence
+    FROM medications m
+    WHERE m.user_id = %(user_id)s AND m.recurrence IS NOT NULL;
+""")
+# Inserts expanded (user_id, medication_id, day, time, dosage) rows with execute_values,
+# taking each dose's due_at from its user's timezone.
+INSERT_DOSES_SQL = """
+    INSERT INTO dose_history (user_id, medication_id, scheduled_for, scheduled_time, dosage, status, due_at)
+    SELECT v.user_id, v.medication_id, v.day, v.time_to_take, v.dosage, 'PENDING',
+           (v.day + v.time_to_take) AT TIME ZONE u.timezone
+    FROM (VALUES %s) AS v(user_id, medication_id, day, time_to_take, dosage)
+    JOIN users u ON u.id = v.user_id
+    WHERE true -- lets the parser tell ON CONFLICT from the join's ON
+    ON CONFLICT (medication_id, scheduled_for, scheduled_time) DO NOTHING
+"""
+INSERT_DOSES_TEMPLATE = "(%s::int, %s::int, %s::date, %s::time, %s::varchar)"
+SCHEDULE_SQL = register_statement("schedule_for_day", """
+    SELECT dh.id as dose_id, m.medicine_name, COALESCE(dh.dosage, m.dosage) AS dosage, dh.scheduled_time, dh.status
+    FROM dose_history dh
+    JOIN medications m ON dh.medication_id = m.id
+    WHERE dh.user_id = %(user_id)s AND dh.scheduled_for = %(day)s::date
+    ORDER BY dh.scheduled_time;
+""")
+CONFIRM_DOSE_SQL = register_statement("confirm_dose", """
+    UPDATE dose_history SET status = 'TAKEN', updated_at = CURRENT_TIMESTAMP
+    WHERE id = %(dose_id)s AND user_id = %(user_id)s AND scheduled_for >= %(since)s::date
+    RETURNING id
+""")
+
+_MARK_MISSED_SQL = """
+    WITH due AS (
+        SELECT id FROM dose_history
+        WHERE status = 'PENDING'
+          AND due_at >= %(since)s AND due_at < %(cutoff)s
+          -- Implied by the due_at range; lets a partitioned dose_history skip older months.
+          AND scheduled_for >= %(since_day)s::date
+          {filters}
+        ORDER BY due_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ), missed AS (
+        UPDATE dose_history dh SET status = 'MISSED', updated_at = CURRENT_TIMESTAMP
+        FROM due WHERE dh.id = due.id
+        RETURNING dh.id, dh.user_id, dh.medication_id
+    )
+    SELECT missed.id, missed.user_id, m.medicine_name, u.name as user_name, u.contact as user_contact,
+           u.email as user_email, cc.name as cc_name, cc.contact as cc_contact
+    FROM missed
+    JOIN medications m ON missed.medication_id = m.id
+    JOIN users u ON missed.user_id = u.id
+    LEFT JOIN close_contacts cc ON missed.user_id = cc.user_id;
+"""
+# One prepared statement per filter combination, keyed by (by user, by dose ids), so each
+# variant keeps its own plan.
+MARK_MISSED_SQL = {
+    (False, False): register_statement("mark_missed", _MARK_MISSED_SQL.format(filters="")),
+    (True, False): register_statement("mark_missed_user", _MARK_MISSED_SQL.format(
+        filters="AND user_id = %(user_id)s")),
+    (False, True): register_statement("mark_missed_doses", _MARK_MISSED_SQL.format(
+        filters="AND id = ANY(%(dose_ids)s::int[])")),
+    (True, True): register_statement("mark_missed_user_doses", _MARK_MISSED_SQL.format(
+        filters="AND user_id = %(user_id)s AND id = ANY(%(dose_ids)s::int[])")),
+}
+
+class PostgresRepository:
+    """The storage queries on one PostgreSQL transaction."""
+    def __init__(self, cur):
+        self.cur = cur
+
+    def close(self):
+        self.cur.close()
+
+    def committed(self):
+        pass  # pg_notify events are delivered by PostgreSQL itself on commit
+
+    # Users
+    def find_user(self, name):
+        """The id, name, password hash and timezone of the user with this name, or None."""
+        execute_prepared(self.cur, LOGIN_USER_SQL, {"name": name})
+        return self.cur.fetchone()
+
+    def user_exists(self, name, email):
+        self.cur.execute("SELECT id FROM users WHERE name=%s OR email=%s", (name, email))
+        return self.cur.fetchone() is not None
+
+    def create_user(self, name, email, age, contact, password_hash, cc_name, cc_contact, timezone_name=DEFAULT_TIMEZONE):
+        self.cur.execute(
+            "INSERT INTO users (name, email, age, contact, password_hash, timezone) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
+            (name, email, age, contact, password_hash, timezone_name),
+        )
+        user_id = self.cur.fetchone()["id"]
+        self.cur.execute(
+            "INSERT INTO close_contacts (user_id, name, contact) VALUES (%s, %s, %s)",
+            (user_id, cc_name, cc_contact)
+        )
+        return user_id
+
+    def set_timezone(self, user_id, timezone_name, since):
+        """
+        Changes a user's timezone and moves the due_at of their PENDING doses scheduled on or
+        after `since` to the same local time in it. Returns the moved doses.
+        """
+        self.cur.execute("UPDATE users SET timezone = %s WHERE id = %s", (timezone_name, user_id))
+        self.cur.execute(
+            """
+            UPDATE dose_history SET due_at = (scheduled_for + scheduled_time) AT TIME ZONE %(tz)s
+            WHERE user_id = %(user_id)s AND status = 'PENDING' AND scheduled_for >= %(since)s
+            RETURNING id, medication_id, scheduled_for, scheduled_time, due_at
+            """,
+            {"tz": timezone_name, "user_id": user_id, "since": since}
+        )
+        return self.cur.fetchall()
+
+    def get_data_revision(self, user_id):
+        execute_prepared(self.cur, DATA_REVISION_SQL, {"user_id": user_id})
+        row = self.cur.fetchone()
+        return row['data_revision'] if row else 0
+
+    def bump_data_revision(self, user_ids):
+        self.cur.execute("UPDATE users SET data_revision = data_revision + 1 WHERE id = ANY(%s)", (sorted(user_ids),))
+
+    def publish_event(self, user_id, event_type, data=None):
+        publish_event(self.cur, user_id, event_type, data)
+
+    # Medications
+    def list_medications(self, user_id):
+        self.cur.execute(
+            "SELECT id, medicine_name, dosage, time_to_take, recurrence FROM medications WHERE user_id = %s ORDER BY time_to_take",
+            (user_id,)
+        )
+        return [dict(row, time_to_take=_hms(row['time_to_take'])) for row in self.cur.fetchall()]
+
+    def add_medications(self, user_id, rows):
+        """
+        Inserts (medicine_name, dosage, time, recurrence) rows in one statement, where
+        recurrence is a rule from recurrence.parse_rule or None. Returns their ids.
+        """
+        inserted = psycopg2.extras.execute_values(
+            self.cur,
+            "INSERT INTO medications (user_id, medicine_name, dosage, time_to_take, recurrence) VALUES %s RETURNING id",
+            [(user_id, name, dosage, time_to_take, json.dumps(rule) if rule else None)
+             for name, dosage, time_to_take, rule in rows],
+            template="(%s, %s, %s, %s, %s::jsonb)",
+            page_size=len(rows),
+            fetch=True
+        )
+        return [row[0] for row in inserted]
+
+    def delete_medication(self, user_id, medication_id):
+        # The ON DELETE CASCADE in the database will also delete related dose_history records.
+        self.cur.execute("DELETE FROM medications WHERE id = %s AND user_id = %s", (medication_id, user_id))
+        return self.cur.rowcount > 0
+
+    # Doses
+    def generate_doses(self, user_id, first_day, last_day):
+        """Creates the user's missing doses between two dates. Returns the new doses."""
+        execute_prepared(self.cur, GENERATE_DOSES_SQL, {"first_day": first_day, "last_day": last_day, "user_id": user_id})
+        rows = self.cur.fetchall()
+        new_doses = [row for row in rows if row['recurrence'] is None]
+        # The medications with a rule come back after the inserted doses, to be expanded here.
+        ruled = [{"id": row['medication_id'], "user_id": row['user_id'], "time_to_take": row['scheduled_time'],
+                  "recurrence": row['recurrence']} for row in rows if row['recurrence'] is not None]
+        rows = expand_medications(ruled, first_day, last_day)
+        if rows:
+            new_doses += psycopg2.extras.execute_values(
+                self.cur,
+                INSERT_DOSES_SQL + " RETURNING id, medication_id, scheduled_for, scheduled_time, due_at",
+                rows,
+                template=INSERT_DOSES_TEMPLATE,
+                page_size=len(rows),
+                fetch=True
+            )
+        return new_doses
+
+    def get_schedule(self, user_id, day):
+        execute_prepared(self.cur, SCHEDULE_SQL, {"user_id": user_id, "day": day})
+        return [dict(row, scheduled_time=_hms(row['scheduled_time'])) for row in self.cur.fetchall()]
+
+    def confirm(self, user_id, dose_ids, since):
+        """
+        Marks the given doses of the user TAKEN and returns the ids that were confirmed.
+        `since` is only a hint for where they are: doses scheduled on or after it are
+        confirmed with a date bound that lets a partitioned dose_history skip older months,
+        and only ids not found there are looked up in the whole table.
+        """
+        if len(dose_ids) == 1:
+            execute_prepared(self.cur, CONFIRM_DOSE_SQL, {"dose_id": dose_ids[0], "user_id": user_id, "since": since})
+        else:
+            self.cur.execute(
+                """
+                UPDATE dose_history SET status = 'TAKEN', updated_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s) AND user_id = %s AND scheduled_for >= %s
+                RETURNING id
+                """,
+                (list(dose_ids), user_id, since)
+            )
+        confirmed = [row['id'] for row in self.cur.fetchall()]
+        older = list(set(dose_ids) - set(confirmed))
+        if older:
+            self.cur.execute(
+                """
+                UPDATE dose_history SET status = 'TAKEN', updated_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s) AND user_id = %s AND scheduled_for < %s
+                RETURNING id
+                """,
+                (older, user_id, since)
+            )
+            confirmed += [row['id'] for row in self.cur.fetchall()]
+        return confirmed
+
+    def mark_missed(self, cutoff, since, batch_size, user_id=None, dose_ids=None):
+        """
+        Marks up to `batch_size` PENDING doses due in [since, cutoff) (UTC datetimes) as MISSED,
+        and returns them with the patient and close-contact details. FOR UPDATE SKIP LOCKED
+        gives concurrent sweepers disjoint sets of rows.
+        """
+        params = {
+            "since": since,
+            "cutoff": cutoff,
+            "since_day": _earliest_local_day(since),
+            "batch_size": batch_size,
+            "user_id": user_id,
+            "dose_ids": list(dose_ids or []),
+        }
+        execute_prepared(self.cur, MARK_MISSED_SQL[(user_id is not None, dose_ids is not None)], params)
+        return self.cur.fetchall()
+
+    def pending_doses(self, since, until):
+        """PENDING doses due in [since, until) (UTC datetimes)."""
+        self.cur.execute(
+            """
+            SELECT id, medication_id, scheduled_for, scheduled_time, due_at FROM dose_history
+            WHERE status = 'PENDING' AND due_at >= %s AND due_at < %s AND scheduled_for >= %s
+            """,
+            (since, until, _earliest_local_day(since))
+        )
+        return self.cur.fetchall()
+
+    def bootstrap(self, user_id, day):
+        """The profile, close contact, schedule for `day` and medication list of a user, in one query."""
+        self.cur.execute(
+            """
+            SELECT u.id, u.name, u.email, u.age, u.contact, u.timezone, u.data_revision,
+                (SELECT json_build_object('name', cc.name, 'contact', cc.contact)
+                 FROM close_contacts cc WHERE cc.user_id = u.id ORDER BY cc.id LIMIT 1) AS close_contact,
+                COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'dose_id', dh.id, 'medicine_name', m.medicine_name, 'dosage', COALESCE(dh.dosage, m.dosage),
+                        'scheduled_time', to_char(dh.scheduled_time, 'HH24:MI:SS'), 'status', dh.status
+                    ) ORDER BY dh.scheduled_time)
+                    FROM dose_history dh JOIN medications m ON dh.medication_id = m.id
+                    WHERE dh.user_id = u.id AND dh.scheduled_for = %(today)s
+                ), '[]') AS schedule,
+                COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'id', m.id, 'medicine_name', m.medicine_name, 'dosage', m.dosage,
+                        'time_to_take', to_char(m.time_to_take, 'HH24:MI:SS'), 'recurrence', m.recurrence
+                    ) ORDER BY m.time_to_take)
+                    FROM medications m WHERE m.user_id = u.id
+                ), '[]') AS medications
+            FROM users u WHERE u.id = %(user_id)s;
+            """,
+            {"user_id": user_id, "today": day}
+        )
+        return self.cur.fetchone()
+
+    # Adherence
+    def adherence_by_day(self, user_id, first_day, last_day):
+        """The user's adherence_daily counters between two dates, per day and medication."""
+        self.cur.execute(
+            """
+            SELECT a.day, a.medication_id, m.medicine_name, a.taken, a.missed, a.pending
+            FROM adherence_daily a
+            JOIN medications m ON a.medication_id = m.id
+            WHERE a.user_id = %s AND a.day BETWEEN %s AND %s
+              AND a.taken + a.missed + a.pending > 0
+            ORDER BY a.day
+            """,
+            (user_id, first_day, last_day)
+        )
+        return self.cur.fetchall()
+
+    # Caregivers
+    def grant_caregiver(self, patient_id, caregiver_name):
+        """
+        Lets the user named `caregiver_name` see this patient's adherence reports. Returns the
+        caregiver's id, or None if there is no such user.
+        """
+        self.cur.execute("SELECT id FROM users WHERE name = %s", (caregiver_name,))
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        self.cur.execute(
+            "INSERT INTO caregiver_links (patient_id, caregiver_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            (patient_id, row['id'])
+        )
+        return row['id']
+
+    def revoke_caregiver(self, patient_id, caregiver_name):
+        """Withdraws a caregiver's access. Returns False if they had none."""
+        self.cur.execute(
+            "DELETE FROM caregiver_links WHERE patient_id = %s AND caregiver_id = (SELECT id FROM users WHERE name = %s)",
+            (patient_id, caregiver_name)
+        )
+        return self.cur.rowcount > 0
+
+    def list_caregivers(self, patient_id):
+        """The users this patient has granted access to."""
+        self.cur.execute(
+            "SELECT u.id, u.name FROM caregiver_links l JOIN users u ON u.id = l.caregiver_id WHERE l.patient_id = %s ORDER BY u.name",
+            (patient_id,)
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    def caregiver_patients(self, caregiver_id):
+        """The patients who have granted this user access (see grant_caregiver)."""
+        self.cur.execute(
+            "SELECT u.id, u.name FROM caregiver_links l JOIN users u ON u.id = l.patient_id WHERE l.caregiver_id = %s ORDER BY u.name",
+            (caregiver_id,)
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    # Notification outbox
+    def enqueue_notifications(self, rows, delay_seconds):
+        """
+        Queues (channel, recipient, subject, body, dose_id, audience, patient_name, medicine_name)
+        rows, due in `delay_seconds`. Rows already queued for the same dose, channel and
+        recipient are skipped.
+        """
+        psycopg2.extras.execute_values(
+            self.cur,
+            """
+            INSERT INTO notification_outbox
+                (channel, recipient, subject, body, dose_id, audience, patient_name, medicine_name, next_attempt_at)
+            VALUES %s
+            ON CONFLICT (dose_id, channel, recipient) DO NOTHING
+            """,
+            rows,
+            template=f"(%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + interval '{int(delay_seconds)} seconds')"
+        )
+
+    def claim_notifications(self, channel, batch_size, lease_seconds):
+        """
+        Claims every due message for up to `batch_size` recipients on one channel. Claiming
+        pushes next_attempt_at out by the lease instead of holding row locks while sending.
+        """
+        self.cur.execute(
+            """
+            WITH recipients AS (
+                SELECT DISTINCT recipient FROM notification_outbox
+                WHERE status = 'PENDING' AND channel = %(channel)s AND next_attempt_at <= CURRENT_TIMESTAMP
+                LIMIT %(batch_size)s
+            ), due AS (
+                SELECT id FROM notification_outbox
+                WHERE status = 'PENDING' AND channel = %(channel)s AND next_attempt_at <= CURRENT_TIMESTAMP
+                  AND recipient IN (SELECT recipient FROM recipients)
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE notification_outbox o
+            SET attempts = o.attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s)
+            FROM due WHERE o.id = due.id
+            RETURNING o.id, o.channel, o.recipient, o.subject, o.body, o.attempts,
+                      o.audience, o.patient_name, o.medicine_name;
+            """,
+            {"channel": channel, "batch_size": batch_size, "lease": lease_seconds}
+        )
+        return self.cur.fetchall()
+
+    def mark_notification_sent(self, message_id):
+        self.cur.execute(
+            "UPDATE notification_outbox SET status = 'SENT', sent_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = %s",
+            (message_id,)
+        )
+
+    def mark_notification_failed(self, message_id, error):
+        self.cur.execute("UPDATE notification_outbox SET status = 'FAILED', last_error = %s WHERE id = %s", (error, message_id))
+
+    def retry_notification(self, message_id, delay_seconds, error):
+        self.cur.execute(
+            "UPDATE notification_outbox SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s), last_error = %s WHERE id = %s",
+            (delay_seconds, error, message_id)
+        )
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    def connect(self):
+        return get_db_connection()
+
+    def release(self, conn):
+        release_db_connection(conn)
+
+    def repository(self, conn):
+        # Counts and times every statement against the current request (see metrics.py).
+        return PostgresRepository(conn.cursor(cursor_factory=InstrumentedCursor))
+
+# --- SQLite ---
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    age INTEGER,
+    contact TEXT,
+    password_hash TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    data_revision INTEGER NOT NULL DEFAULT 0,
+    timezone TEXT NOT NULL DEFAULT 'UTC' -- IANA name; create_user always sets it
+);
+CREATE TABLE IF NOT EXISTS close_contacts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    contact TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS medications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    medicine_name TEXT NOT NULL,
+    dosage TEXT,
+    time_to_take TEXT NOT NULL, -- 'HH:MM:SS'
+    recurrence TEXT -- JSON rule (see recurrence.py); NULL = once a day at time_to_take
+);
+CREATE TABLE IF NOT EXISTS dose_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    medication_id INTEGER REFERENCES medications(id) ON DELETE CASCADE,
+    scheduled_for TEXT NOT NULL, -- 'YYYY-MM-DD'
+    scheduled_time TEXT NOT NULL, -- 'HH:MM:SS'
+    status TEXT DEFAULT 'PENDING',
+    updated_at TEXT,
+    dosage TEXT, -- set when a tapering rule overrides the medication's dosage
+    due_at TEXT -- UTC 'YYYY-MM-DD HH:MM:SS' of scheduled_for + scheduled_time in the user's timezone
+);
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT,
+    body TEXT NOT NULL,
+    dose_id INTEGER,
+    audience TEXT,
+    patient_name TEXT,
+    medicine_name TEXT,
+    status TEXT DEFAULT 'PENDING',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, -- UTC 'YYYY-MM-DD HH:MM:SS'
+    last_error TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_dose_history_medication_id ON dose_history (medication_id);
+CREATE INDEX IF NOT EXISTS idx_dose_history_user_date ON dose_history (user_id, scheduled_for);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_dose_history_medication_slot
+    ON dose_history (medication_id, scheduled_for, scheduled_time);
+DROP INDEX IF EXISTS uq_dose_history_medication_date; -- the one-dose-per-day key it replaces
+DROP INDEX IF EXISTS idx_dose_history_pending_due; -- by local date and time; see SQLITE_INDEXES
+CREATE UNIQUE INDEX IF NOT EXISTS uq_notification_outbox_dose ON notification_outbox (dose_id, channel, recipient);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+    ON notification_outbox (channel, next_attempt_at) WHERE status = 'PENDING';
+CREATE TABLE IF NOT EXISTS adherence_daily (
+    user_id INTEGER NOT NULL,
+    medication_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    taken INTEGER NOT NULL DEFAULT 0,
+    missed INTEGER NOT NULL DEFAULT 0,
+    pending INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, medication_id, day)
+);
+CREATE INDEX IF NOT EXISTS idx_adherence_daily_user_day ON adherence_daily (user_id, day);
+CREATE TABLE IF NOT EXISTS caregiver_links (
+    patient_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    caregiver_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (patient_id, caregiver_id)
+);
+CREATE INDEX IF NOT EXISTS idx_caregiver_links_caregiver ON caregiver_links (caregiver_id);
+DROP INDEX IF EXISTS idx_close_contacts_contact; -- contact numbers no longer grant access
+-- The same rollup as init_db.create_adherence_rollup, with row-level triggers.
+CREATE TRIGGER IF NOT EXISTS trg_adherence_daily_insert AFTER INSERT ON dose_history
+WHEN NEW.user_id IS NOT NULL AND NEW.medication_id IS NOT NULL BEGIN
+    INSERT INTO adherence_daily (user_id, medication_id, day, taken, missed, pending)
+    VALUES (NEW.user_id, NEW.medication_id, NEW.scheduled_for,
+            NEW.status = 'TAKEN', NEW.status = 'MISSED', NEW.status = 'PENDING')
+    ON CONFLICT (user_id, medication_id, day) DO UPDATE
+    SET taken = taken + excluded.taken, missed = missed + excluded.missed, pending = pending + excluded.pending;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_adherence_daily_delete AFTER DELETE ON dose_history
+WHEN OLD.user_id IS NOT NULL AND OLD.medication_id IS NOT NULL BEGIN
+    UPDATE adherence_daily
+    SET taken = taken - (OLD.status = 'TAKEN'), missed = missed - (OLD.status = 'MISSED'),
+        pending = pending - (OLD.status = 'PENDING')
+    WHERE user_id = OLD.user_id AND medication_id = OLD.medication_id AND day = OLD.scheduled_for;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_adherence_daily_update
+AFTER UPDATE OF user_id, medication_id, scheduled_for, status ON dose_history
+WHEN (NEW.user_id, NEW.medication_id, NEW.scheduled_for, NEW.status)
+     IS NOT (OLD.user_id, OLD.medication_id, OLD.scheduled_for, OLD.status) BEGIN
+    UPDATE adherence_daily
+    SET taken = taken - (OLD.status = 'TAKEN'), missed = missed - (OLD.status = 'MISSED'),
+        pending = pending - (OLD.status = 'PENDING')
+    WHERE user_id = OLD.user_id AND medication_id = OLD.medication_id AND day = OLD.scheduled_for;
+    INSERT INTO adherence_daily (user_id, medication_id, day, taken, missed, pending)
+    VALUES (NEW.user_id, NEW.medication_id, NEW.scheduled_for,
+            NEW.status = 'TAKEN', NEW.status = 'MISSED', NEW.status = 'PENDING')
+    ON CONFLICT (user_id, medication_id, day) DO UPDATE
+    SET taken = taken + excluded.taken, missed = missed + excluded.missed, pending = pending + excluded.pending;
+END;
+-- Backfills a rollup that has never been filled (see init_db.create_adherence_rollup).
+INSERT INTO adherence_daily (user_id, medication_id, day, taken, missed, pending)
+SELECT user_id, medication_id, scheduled_for,
+       sum(status = 'TAKEN'), sum(status = 'MISSED'), sum(status = 'PENDING')
+FROM dose_history
+WHERE user_id IS NOT NULL AND medication_id IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM adherence_daily)
+GROUP BY user_id, medication_id, scheduled_for;
+"""
+
+# Columns added after the SQLite schema first shipped; CREATE TABLE IF NOT EXISTS won't add them.
+SQLITE_ADDED_COLUMNS = (
+    ("medications", "recurrence", "TEXT"),
+    ("dose_history", "dosage", "TEXT"),
+    ("users", "timezone", f"TEXT NOT NULL DEFAULT '{DEFAULT_TIMEZONE}'"),
+    ("dose_history", "due_at", "TEXT"),
+)
+# Indexes on added columns, created once the columns exist.
+SQLITE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_dose_history_pending_due_at ON dose_history (due_at) WHERE status = 'PENDING';
+"""
+
+class InstrumentedSQLiteCursor(sqlite3.Cursor):
+    """Records each statement and its duration against the current request, like database.InstrumentedCursor."""
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+def _utc_text(instant):
+    """An aware datetime as the UTC 'YYYY-MM-DD HH:MM:SS' text SQLite stores and compares."""
+    return instant.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def _dose(row):
+    """A generated/pending dose row with its date, time and due_at parsed, as PostgreSQL returns them."""
+    return {
+        "id": row["id"], "medication_id": row["medication_id"],
+        "scheduled_for": date.fromisoformat(row["scheduled_for"]),
+        "scheduled_time": time_of_day.fromisoformat(row["scheduled_time"]),
+        "due_at": datetime.fromisoformat(row["due_at"]).replace(tzinfo=timezone.utc),
+    }
+
+def _medication(row):
+    """A medications row with its recurrence rule decoded from JSON text."""
+    return dict(row, recurrence=json.loads(row["recurrence"]) if row["recurrence"] else None)
+
+def _in_list(values):
+    return ", ".join("?" * len(values))
+
+class SQLiteRepository:
+    """
+    The storage queries on one SQLite transaction. SQLite has a single writer, so there is
+    no SKIP LOCKED: a write transaction (BEGIN IMMEDIATE) simply owns every row it updates.
+    Events are handed to the in-process broker once the transaction commits.
+    """
+    def __init__(self, cur):
+        self.cur = cur
+        self._events = []
+
+    def close(self):
+        self.cur.close()
+
+    def committed(self):
+        for event in self._events:
+            broker.publish(event)
+
+    # Users
+    def find_user(self, name):
+        self.cur.execute("SELECT id, name, password_hash, timezone FROM users WHERE name = ?", (name,))
+        row = self.cur.fetchone()
+        return dict(row) if row else None
+
+    def user_exists(self, name, email):
+        self.cur.execute("SELECT id FROM users WHERE name = ? OR email = ?", (name, email))
+        return self.cur.fetchone() is not None
+
+    def create_user(self, name, email, age, contact, password_hash, cc_name, cc_contact, timezone_name=DEFAULT_TIMEZONE):
+        self.cur.execute(
+            "INSERT INTO users (name, email, age, contact, password_hash, timezone) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, email, age, contact, password_hash, timezone_name)
+        )
+        user_id = self.cur.lastrowid
+        self.cur.execute("INSERT INTO close_contacts (user_id, name, contact) VALUES (?, ?, ?)", (user_id, cc_name, cc_contact))
+        return user_id
+
+    def set_timezone(self, user_id, timezone_name, since):
+        self.cur.execute("UPDATE users SET timezone = ? WHERE id = ?", (timezone_name, user_id))
+        self.cur.execute(
+            "SELECT id, scheduled_for, scheduled_time FROM dose_history WHERE user_id = ? AND status = 'PENDING' AND scheduled_for >= ?",
+            (user_id, since.isoformat())
+        )
+        moved = [(_utc_text(due_at(row['scheduled_for'], row['scheduled_time'], timezone_name)), row['id'])
+                 for row in self.cur.fetchall()]
+        self.cur.executemany("UPDATE dose_history SET due_at = ? WHERE id = ?", moved)
+        return self._doses_by_id([dose_id for _, dose_id in moved])
+
+    def get_data_revision(self, user_id):
+        self.cur.execute("SELECT data_revision FROM users WHERE id = ?", (user_id,))
+        row = self.cur.fetchone()
+        return row['data_revision'] if row else 0
+
+    def bump_data_revision(self, user_ids):
+        user_ids = sorted(user_ids)
+        self.cur.execute(f"UPDATE users SET data_revision = data_revision + 1 WHERE id IN ({_in_list(user_ids)})", user_ids)
+
+    def publish_event(self, user_id, event_type, data=None):
+        self._events.append({"user_id": user_id, "type": event_type, "data": data or {}})
+
+    # Medications
+    def list_medications(self, user_id):
+        self.cur.execute(
+            "SELECT id, medicine_name, dosage, time_to_take, recurrence FROM medications WHERE user_id = ? ORDER BY time_to_take",
+            (user_id,)
+        )
+        return [_medication(row) for row in self.cur.fetchall()]
+
+    def add_medications(self, user_id, rows):
+        """Inserts (medicine_name, dosage, time, recurrence) rows. Returns their ids."""
+        ids = []
+        for medicine_name, dosage, time_to_take, rule in rows:
+            # Stored as 'HH:MM:SS' text, so times compare and sort correctly as strings.
+            time_to_take = time_of_day.fromisoformat(str(time_to_take).strip()).strftime('%H:%M:%S')
+            self.cur.execute(
+                "INSERT INTO medications (user_id, medicine_name, dosage, time_to_take, recurrence) VALUES (?, ?, ?, ?, ?)",
+                (user_id, medicine_name, dosage, time_to_take, json.dumps(rule) if rule else None)
+            )
+            ids.append(self.cur.lastrowid)
+        return ids
+
+    def delete_medication(self, user_id, medication_id):
+        self.cur.execute("DELETE FROM medications WHERE id = ? AND user_id = ?", (medication_id, user_id))
+        return self.cur.rowcount > 0
+
+    # Doses
+    def generate_doses(self, user_id, first_day, last_day):
+        # SQLite has no timezone database, so every dose is expanded here to compute its due_at.
+        self.cur.execute(
+            """
+            SELECT m.id, m.user_id, m.time_to_take, m.recurrence, u.timezone
+            FROM medications m JOIN users u ON u.id = m.user_id
+            WHERE m.user_id = ?
+            """,
+            (user_id,)
+        )
+        medications = [_medication(row) for row in self.cur.fetchall()]
+        timezone_name = medications[0]['timezone'] if medications else None
+        new_doses = []
+        for user_id, medication_id, day, time_to_take, dosage in expand_medications(medications, first_day, last_day):
+            self.cur.execute(
+                """
+                INSERT INTO dose_history (user_id, medication_id, scheduled_for, scheduled_time, dosage, status, due_at)
+                VALUES (?, ?, ?, ?, ?, 'PENDING', ?)
+                ON CONFLICT (medication_id, scheduled_for, scheduled_time) DO NOTHING
+                RETURNING id, medication_id, scheduled_for, scheduled_time, due_at
+                """,
+                (user_id, medication_id, day.isoformat(), _hms(time_to_take), dosage,
+                 _utc_text(due_at(day, time_to_take, timezone_name)))
+            )
+            new_doses.extend(_dose(row) for row in self.cur.fetchall())
+        return new_doses
+
+    def get_schedule(self, user_id, day):
+        self.cur.execute(
+            """
+            SELECT dh.id as dose_id, m.medicine_name, COALESCE(dh.dosage, m.dosage) AS dosage, dh.scheduled_time, dh.status
+            FROM dose_history dh
+            JOIN medications m ON dh.medication_id = m.id
+            WHERE dh.user_id = ? AND dh.scheduled_for = ?
+            ORDER BY dh.scheduled_time
+            """,
+            (user_id, day.isoformat())
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    def confirm(self, user_id, dose_ids, since):
+        # Not partitioned: `since` doesn't narrow anything here, so look the ids up directly.
+        dose_ids = list(dose_ids)
+        self.cur.execute(
+            f"""
+            UPDATE dose_history SET status = 'TAKEN', updated_at = CURRENT_TIMESTAMP
+            WHERE id IN ({_in_list(dose_ids)}) AND user_id = ?
+            RETURNING id
+            """,
+            dose_ids + [user_id]
+        )
+        return [row['id'] for row in self.cur.fetchall()]
+
+    def mark_missed(self, cutoff, since, batch_size, user_id=None, dose_ids=None):
+        filters, params = "", [_utc_text(since), _utc_text(cutoff)]
+        if user_id is not None:
+            filters += " AND user_id = ?"
+            params.append(user_id)
+        if dose_ids is not None:
+            dose_ids = list(dose_ids)
+            filters += f" AND id IN ({_in_list(dose_ids)})"
+            params.extend(dose_ids)
+        params.append(batch_size)
+        # The same range scan on idx_dose_history_pending_due_at as on PostgreSQL.
+        self.cur.execute(
+            f"""
+            UPDATE dose_history SET status = 'MISSED', updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM dose_history
+                WHERE status = 'PENDING' AND due_at >= ? AND due_at < ?
+                  {filters}
+                ORDER BY due_at
+                LIMIT ?
+            )
+            RETURNING id
+            """,
+            params
+        )
+        missed_ids = [row['id'] for row in self.cur.fetchall()]
+        if not missed_ids:
+            return []
+        self.cur.execute(
+            f"""
+            SELECT dh.id, dh.user_id, m.medicine_name, u.name as user_name, u.contact as user_contact,
+                   u.email as user_email, cc.name as cc_name, cc.contact as cc_contact
+            FROM dose_history dh
+            JOIN medications m ON dh.medication_id = m.id
+            JOIN users u ON dh.user_id = u.id
+            LEFT JOIN close_contacts cc ON dh.user_id = cc.user_id
+            WHERE dh.id IN ({_in_list(missed_ids)})
+            """,
+            missed_ids
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    def pending_doses(self, since, until):
+        self.cur.execute(
+            """
+            SELECT id, medication_id, scheduled_for, scheduled_time, due_at FROM dose_history
+            WHERE status = 'PENDING' AND due_at >= ? AND due_at < ?
+            """,
+            (_utc_text(since), _utc_text(until))
+        )
+        return [_dose(row) for row in self.cur.fetchall()]
+
+    def _doses_by_id(self, dose_ids):
+        dose_ids = list(dose_ids)
+        if not dose_ids:
+            return []
+        self.cur.execute(
+            f"SELECT id, medication_id, scheduled_for, scheduled_time, due_at FROM dose_history WHERE id IN ({_in_list(dose_ids)})",
+            dose_ids
+        )
+        return [_dose(row) for row in self.cur.fetchall()]
+
+    def bootstrap(self, user_id, day):
+        # Separate queries cost nothing extra here: there is no network round trip.
+        self.cur.execute("SELECT id, name, email, age, contact, timezone, data_revision FROM users WHERE id = ?", (user_id,))
+        user = self.cur.fetchone()
+        if user is None:
+            return None
+        self.cur.execute("SELECT name, contact FROM close_contacts WHERE user_id = ? ORDER BY id LIMIT 1", (user_id,))
+        contact = self.cur.fetchone()
+        return dict(user, close_contact=dict(contact) if contact else None,
+                    schedule=self.get_schedule(user_id, day), medications=self.list_medications(user_id))
+
+    # Adherence
+    def adherence_by_day(self, user_id, first_day, last_day):
+        self.cur.execute(
+            """
+            SELECT a.day, a.medication_id, m.medicine_name, a.taken, a.missed, a.pending
+            FROM adherence_daily a
+            JOIN medications m ON a.medication_id = m.id
+            WHERE a.user_id = ? AND a.day BETWEEN ? AND ?
+              AND a.taken + a.missed + a.pending > 0
+            ORDER BY a.day
+            """,
+            (user_id, first_day.isoformat(), last_day.isoformat())
+        )
+        return [dict(row, day=date.fromisoformat(row["day"])) for row in self.cur.fetchall()]
+
+    # Caregivers
+    def grant_caregiver(self, patient_id, caregiver_name):
+        self.cur.execute("SELECT id FROM users WHERE name = ?", (caregiver_name,))
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        self.cur.execute(
+            "INSERT INTO caregiver_links (patient_id, caregiver_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            (patient_id, row['id'])
+        )
+        return row['id']
+
+    def revoke_caregiver(self, patient_id, caregiver_name):
+        self.cur.execute(
+            "DELETE FROM caregiver_links WHERE patient_id = ? AND caregiver_id = (SELECT id FROM users WHERE name = ?)",
+            (patient_id, caregiver_name)
+        )
+        return self.cur.rowcount > 0
+
+    def list_caregivers(self, patient_id):
+        self.cur.execute(
+            "SELECT u.id, u.name FROM caregiver_links l JOIN users u ON u.id = l.caregiver_id WHERE l.patient_id = ? ORDER BY u.name",
+            (patient_id,)
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    def caregiver_patients(self, caregiver_id):
+        self.cur.execute(
+            "SELECT u.id, u.name FROM caregiver_links l JOIN users u ON u.id = l.patient_id WHERE l.caregiver_id = ? ORDER BY u.name",
+            (caregiver_id,)
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    # Notification outbox
+    def enqueue_notifications(self, rows, delay_seconds):
+        self.cur.executemany(
+            f"""
+            INSERT INTO notification_outbox
+                (channel, recipient, subject, body, dose_id, audience, patient_name, medicine_name, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now', '+{int(delay_seconds)} seconds'))
+            ON CONFLICT (dose_id, channel, recipient) DO NOTHING
+            """,
+            rows
+        )
+
+    def claim_notifications(self, channel, batch_size, lease_seconds):
+        self.cur.execute(
+            f"""
+            UPDATE notification_outbox
+            SET attempts = attempts + 1, next_attempt_at = datetime('now', '+{int(lease_seconds)} seconds')
+            WHERE id IN (
+                SELECT id FROM notification_outbox
+                WHERE status = 'PENDING' AND channel = :channel AND next_attempt_at <= datetime('now')
+                  AND recipient IN (
+                      SELECT DISTINCT recipient FROM notification_outbox
+                      WHERE status = 'PENDING' AND channel = :channel AND next_attempt_at <= datetime('now')
+                      LIMIT :batch_size
+                  )
+            )
+            RETURNING id, channel, recipient, subject, body, attempts, audience, patient_name, medicine_name
+            """,
+            {"channel": channel, "batch_size": batch_size}
+        )
+        return [dict(row) for row in self.cur.fetchall()]
+
+    def mark_notification_sent(self, message_id):
+        self.cur.execute(
+            "UPDATE notification_outbox SET status = 'SENT', sent_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = ?",
+            (message_id,)
+        )
+
+    def mark_notification_failed(self, message_id, error):
+        self.cur.execute("UPDATE notification_outbox SET status = 'FAILED', last_error = ? WHERE id = ?", (error, message_id))
+
+    def retry_notification(self, message_id, delay_seconds, error):
+        self.cur.execute(
+            f"UPDATE notification_outbox SET next_attempt_at = datetime('now', '+{int(delay_seconds)} seconds'), last_error = ? WHERE id = ?",
+            (error, message_id)
+        )
+
+class SQLiteStorage(Storage):
+    """
+    One SQLite database file in WAL mode: readers never block the writer or each other, and
+    writers take turns (waiting up to SQLITE_BUSY_TIMEOUT_MS). Each transaction gets its own
+    short-lived connection; opening one is a local file operation. Events only reach alert
+    streams in the same process, so run the backend as a single process on this engine.
+    """
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        # isolation_level="IMMEDIATE": a transaction takes the write lock at its first write,
+        # so two writers never deadlock upgrading from a read lock.
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level="IMMEDIATE",
+                               uri=self.path.startswith("file:"))
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if not self._schema_ready:
+            self.create_schema(conn)
+        return conn
+
+    def create_schema(self, conn=None):
+        """Creates the tables and indexes (if missing) and switches the file to WAL mode."""
+        with self._lock:
+            own = conn is None
+            conn = conn or sqlite3.connect(self.path, uri=self.path.startswith("file:"))
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SQLITE_SCHEMA)
+                for table, column, definition in SQLITE_ADDED_COLUMNS:
+                    if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                self._backfill_due_at(conn)
+                conn.executescript(SQLITE_INDEXES)
+                conn.commit()
+                self._schema_ready = True
+            finally:
+                if own:
+                    conn.close()
+
+    @staticmethod
+    def _backfill_due_at(conn):
+        """Sets due_at on doses created before the column existed, from their users' timezones."""
+        rows = conn.execute(
+            """
+            SELECT dh.id, dh.scheduled_for, dh.scheduled_time, u.timezone
+            FROM dose_history dh JOIN users u ON u.id = dh.user_id
+            WHERE dh.due_at IS NULL
+            """
+        ).fetchall()
+        conn.executemany("UPDATE dose_history SET due_at = ? WHERE id = ?",
+                         [(_utc_text(due_at(day, time_to_take, tz)), dose_id) for dose_id, day, time_to_take, tz in rows])
+
+    def release(self, conn):
+        conn.close()
+
+    def repository(self, conn):
+        return SQLiteRepository(conn.cursor(InstrumentedSQLiteCursor))
+
+_storage = None
+
+def get_storage():
+    """Returns the process-wide storage engine selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "sqlite":
+            _storage = SQLiteStorage()
+        elif STORAGE_BACKEND == "postgres":
+            _storage = PostgresStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'postgres' or 'sqlite').")
+    return _storage
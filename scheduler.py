@@ -0,0 +1,260 @@
+# /medication-reminder-app/scheduler.py
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import psycopg2
+import metrics
+from database import DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_PORT
+from repository import get_storage
+from sweeper import MISSED_GRACE_MINUTES, MISSED_LOOKBACK_DAYS, process_missed_doses
+
+# Doses due up to this many days ahead are kept in memory.
+SCHEDULER_HORIZON_DAYS = int(os.getenv("SCHEDULER_HORIZON_DAYS", 1))
+# Full reload from the database, to pick up doses created by other processes (e.g., the
+# nightly pre-generation job or other backend workers) and roll the horizon forward.
+SCHEDULER_RELOAD_SECONDS = int(os.getenv("SCHEDULER_RELOAD_SECONDS", 300))
+# How often a standby process tries to become the active scheduler (see SchedulerLock).
+SCHEDULER_STANDBY_SECONDS = int(os.getenv("SCHEDULER_STANDBY_SECONDS", 30))
+# With the scheduler running, the sweeper is only a safety net for doses it didn't track
+# (created by another process since the last reload, or while no process held the lock).
+SCHEDULER_SWEEP_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_SWEEP_INTERVAL_SECONDS", 300))
+# Key of the PostgreSQL advisory lock held by the active scheduler.
+SCHEDULER_LOCK_KEY = 0x646f7365  # "dose"
+
+class SchedulerLock:
+    """
+    Makes exactly one process per database the active scheduler, so that several backend
+    processes (e.g., gunicorn workers) don't each load and fire the same doses.
+
+    On PostgreSQL it is a session-level pg_try_advisory_lock held on a dedicated connection:
+    the server releases it when that connection ends, so a standby takes over when the
+    active process dies. With SQLite there is only one backend process, which always holds it.
+    """
+    def __init__(self):
+        self._conn = None
+
+    def acquire(self):
+        """Takes the lock, or confirms it is still held. Returns whether this process holds it."""
+        if get_storage().name != "postgres":
+            return True
+        try:
+            if self._conn is not None:
+                with self._conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                return True
+            # Held for the life of the process, so it is not taken from the pool.
+            conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEDULER_LOCK_KEY,))
+                held = cur.fetchone()[0]
+            if held:
+                self._conn = conn
+            else:
+                conn.close()
+            return held
+        except psycopg2.Error as e:
+            print(f"❌ Dose scheduler lost its lock connection: {e}")
+            self.release()
+            return False
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+class DoseScheduler:
+    """
+    Keeps upcoming PENDING doses in a min-heap keyed by the instant they become overdue,
+    and marks each one MISSED as soon as that instant passes, instead of polling
+    dose_history for "what is due now".
+
+    Adding a dose is O(log n). Removing one (confirmed or deleted) only drops it from the
+    index; its stale heap entry is skipped when it reaches the top. Firing is idempotent:
+    doses are re-checked against the database, so a dose that was confirmed in the meantime
+    (e.g., through another backend process) is never marked MISSED.
+
+    A rebuild replays the add() and discard calls made while it was reading the database,
+    so a dose created (or confirmed) during a reload isn't lost (or kept).
+
+    Only the process holding `lock` is active. In the others the scheduler is a standby: it
+    tracks nothing, and retries the lock every SCHEDULER_STANDBY_SECONDS.
+    """
+    def __init__(self, on_overdue=None, lock=None):
+        self.on_overdue = on_overdue or mark_doses_missed
+        self.lock = lock or SchedulerLock()
+        self.active = False
+        self._heap = []            # (overdue_at, dose_id)
+        self._entries = {}         # dose_id -> (overdue_at, medication_id) for live entries
+        self._by_medication = {}   # medication_id -> {dose_id, ...}
+        self._changes = None       # (method, args) calls made during a rebuild's read, to replay
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._last_reload = None
+
+    @staticmethod
+    def overdue_at(due_at):
+        return due_at + timedelta(minutes=MISSED_GRACE_MINUTES)
+
+    def add(self, dose_id, medication_id, due_at):
+        """Tracks a PENDING dose (or moves it, if it is already tracked, e.g. to a new timezone)."""
+        overdue_at = self.overdue_at(due_at)
+        with self._cond:
+            if not self.active:
+                return
+            self._record(self._track, dose_id, medication_id, overdue_at)
+            self._track(dose_id, medication_id, overdue_at)
+            if self._heap[0][1] == dose_id:
+                self._cond.notify()
+
+    def _track(self, dose_id, medication_id, overdue_at):
+        self._discard(dose_id)
+        self._entries[dose_id] = (overdue_at, medication_id)
+        self._by_medication.setdefault(medication_id, set()).add(dose_id)
+        heapq.heappush(self._heap, (overdue_at, dose_id))
+
+    def _record(self, method, *args):
+        if self._changes is not None:
+            self._changes.append((method, args))
+
+    def add_doses(self, doses):
+        """Tracks rows with id, medication_id and due_at."""
+        for dose in doses:
+            self.add(dose['id'], dose['medication_id'], dose['due_at'])
+
+    def discard(self, dose_id):
+        """Stops tracking a dose, e.g. because it was confirmed."""
+        with self._cond:
+            self._record(self._discard, dose_id)
+            self._discard(dose_id)
+
+    def discard_medication(self, medication_id):
+        """Stops tracking every dose of a deleted medication."""
+        with self._cond:
+            self._record(self._discard_medication, medication_id)
+            self._discard_medication(medication_id)
+
+    def _discard_medication(self, medication_id):
+        for dose_id in list(self._by_medication.get(medication_id, ())):
+            self._discard(dose_id)
+
+    def _discard(self, dose_id):
+        entry = self._entries.pop(dose_id, None)
+        if entry:
+            doses = self._by_medication.get(entry[1])
+            if doses:
+                doses.discard(dose_id)
+                if not doses:
+                    del self._by_medication[entry[1]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def rebuild(self):
+        """
+        Replaces the in-memory state with the PENDING doses in the database, then replays the
+        changes made since the read began: their transactions may have committed after it.
+        """
+        now = datetime.now(timezone.utc)
+        with self._cond:
+            self._changes = []
+        try:
+            with get_storage().transaction() as repo:
+                doses = repo.pending_doses(now - timedelta(days=MISSED_LOOKBACK_DAYS),
+                                           now + timedelta(days=SCHEDULER_HORIZON_DAYS))
+        except Exception:
+            with self._cond:
+                self._changes = None
+            raise
+
+        with self._cond:
+            changes, self._changes = self._changes, None
+            self._heap, self._entries, self._by_medication = [], {}, {}
+            for d in doses:
+                overdue_at = self.overdue_at(d['due_at'])
+                self._heap.append((overdue_at, d['id']))
+                self._entries[d['id']] = (overdue_at, d['medication_id'])
+                self._by_medication.setdefault(d['medication_id'], set()).add(d['id'])
+            heapq.heapify(self._heap)
+            for method, args in changes:
+                method(*args)
+            self._last_reload = datetime.now(timezone.utc)
+            self._cond.notify()
+        print(f"Dose scheduler loaded {len(doses)} pending dose(s).")
+
+    def _pop_overdue(self, now):
+        """Pops every live entry whose overdue instant has passed."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            overdue_at, dose_id = heapq.heappop(self._heap)
+            entry = self._entries.get(dose_id)
+            if entry and entry[0] == overdue_at:
+                self._discard(dose_id)
+                due.append(dose_id)
+        return due
+
+    def _deactivate(self):
+        with self._cond:
+            if self.active:
+                print("Dose scheduler is now on standby; another process holds the lock.")
+            self.active = False
+            self._heap, self._entries, self._by_medication = [], {}, {}
+            self._last_reload = None
+
+    def run(self):
+        """Fires overdue doses until stop() is called. Reloads from the database periodically."""
+        while not self._stop.is_set():
+            if self._last_reload is None or datetime.now(timezone.utc) - self._last_reload >= timedelta(seconds=SCHEDULER_RELOAD_SECONDS):
+                # Checked on every reload: if the lock's connection was lost, another process
+                # may have become active. Until then both may fire a dose, which is harmless.
+                if not self.lock.acquire():
+                    self._deactivate()
+                    self._stop.wait(SCHEDULER_STANDBY_SECONDS)
+                    continue
+                with self._cond:
+                    self.active = True
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    print(f"❌ Dose scheduler could not load doses: {e!r}")
+                    metrics.record_background_error("scheduler")
+                    self._stop.wait(30)
+                    continue
+
+            with self._cond:
+                now = datetime.now(timezone.utc)
+                due = self._pop_overdue(now)
+                if not due:
+                    timeout = SCHEDULER_RELOAD_SECONDS
+                    if self._heap:
+                        timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                    self._cond.wait(max(timeout, 0.01))
+                    continue
+
+            try:
+                self.on_overdue(due)
+            except Exception as e:
+                # Any error, not just the database's: the thread must not die. The sweeper (or
+                # the next reload) will pick these doses up again.
+                print(f"❌ Dose scheduler failed to mark {len(due)} dose(s) as MISSED: {e!r}")
+                metrics.record_background_error("scheduler")
+
+    def start(self):
+        threading.Thread(target=self.run, name="dose-scheduler", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        self.lock.release()
+
+def mark_doses_missed(dose_ids):
+    """Marks the given doses MISSED (if they are still PENDING and overdue) and queues their alerts."""
+    with get_storage().transaction() as repo:
+        missed_doses, _ = process_missed_doses(repo, batch_size=len(dose_ids), dose_ids=dose_ids)
+    return missed_doses
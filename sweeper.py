@@ -0,0 +1,122 @@
+# /medication-reminder-app/sweeper.py
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import metrics
+from repository import get_storage
+from outbox import enqueue_missed_dose_alerts
+
+# A PENDING dose becomes MISSED once it is this many minutes past its due_at.
+MISSED_GRACE_MINUTES = int(os.getenv("MISSED_GRACE_MINUTES", 10))
+# Doses older than this many days are left alone, so a fresh sweeper doesn't alert on stale history.
+MISSED_LOOKBACK_DAYS = int(os.getenv("MISSED_LOOKBACK_DAYS", 1))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("SWEEP_INTERVAL_SECONDS", 60))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", 500))
+
+def mark_missed_doses(repo, batch_size=SWEEP_BATCH_SIZE, user_id=None, dose_ids=None, now=None):
+    """
+    Marks up to `batch_size` overdue PENDING doses as MISSED in one statement and returns
+    them joined with the patient and close-contact details needed for notifications.
+
+    The overdue rows are found with a single range scan on due_at, the absolute instant a
+    dose is due in its user's timezone, over the partial index idx_dose_history_pending_due_at.
+    On PostgreSQL, FOR UPDATE SKIP LOCKED lets several
+    sweepers (and the per-user check endpoint) work side by side: each one claims a disjoint
+    set of rows and skips any row that is already locked by another transaction.
+    `user_id` and `dose_ids` optionally narrow the claim to one user or to specific doses.
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(minutes=MISSED_GRACE_MINUTES)
+    since = cutoff - timedelta(days=MISSED_LOOKBACK_DAYS)
+    missed_doses = repo.mark_missed(cutoff, since, batch_size, user_id=user_id, dose_ids=dose_ids)
+    bump_data_revision(repo, [dose['user_id'] for dose in missed_doses])
+    return missed_doses
+
+def process_missed_doses(repo, **claim_args):
+    """
+    The full missed-dose transition, in the caller's transaction: claims overdue doses
+    (see mark_missed_doses for `claim_args`), queues their notifications in the outbox and
+    publishes one 'missed' event per user for their open alert streams.
+    Returns the missed doses and the GUI alert message for each.
+    """
+    missed_doses = mark_missed_doses(repo, **claim_args)
+    gui_alerts = enqueue_missed_dose_alerts(repo, missed_doses)
+    alerts_by_user = {}
+    for dose, alert in zip(missed_doses, gui_alerts):
+        alerts_by_user.setdefault(dose['user_id'], []).append(alert)
+    for user_id, alerts in alerts_by_user.items():
+        repo.publish_event(user_id, 'missed', {"alerts": alerts})
+    return missed_doses, gui_alerts
+
+def bump_data_revision(repo, user_ids):
+    """
+    Increments users.data_revision for the given users. Every write that changes a user's
+    schedule or medication list must call this; the revision backs the ETags of
+    /api/schedule and /api/medications.
+    """
+    user_ids = sorted(set(user_ids))
+    if user_ids:
+        repo.bump_data_revision(user_ids)
+
+def sweep_once(batch_size=SWEEP_BATCH_SIZE, on_missed=None):
+    """
+    Runs one sweep over all users. Each batch is committed on its own so row locks are
+    held only briefly. Notifications are written to the outbox in the same transaction
+    and sent by the dispatcher (see outbox.py). `on_missed`, if given, is called with each
+    committed batch of missed doses. Returns the number of doses marked MISSED.
+    """
+    total = 0
+    storage = get_storage()
+    try:
+        conn = storage.connect()
+        try:
+            while True:
+                with storage.transaction(conn) as repo:
+                    missed_doses, _ = process_missed_doses(repo, batch_size=batch_size)
+                if on_missed and missed_doses:
+                    on_missed(missed_doses)
+                total += len(missed_doses)
+                if len(missed_doses) < batch_size:
+                    break
+        finally:
+            storage.release(conn)
+    except Exception as e:
+        # Not just database errors: anything that escaped here would end the sweeper thread.
+        print(f"❌ Missed-dose sweep failed: {e!r}")
+        metrics.record_background_error("sweeper")
+    return total
+
+def run_sweeper(interval=SWEEP_INTERVAL_SECONDS, batch_size=SWEEP_BATCH_SIZE, stop_event=None, on_missed=None):
+    """Sweeps on a fixed tick until `stop_event` is set."""
+    stop_event = stop_event or threading.Event()
+    print(f"Missed-dose sweeper started (every {interval}s, batches of {batch_size}).")
+    while not stop_event.is_set():
+        started = time.monotonic()
+        count = sweep_once(batch_size, on_missed)
+        if count:
+            print(f"Sweeper marked {count} dose(s) as MISSED.")
+        stop_event.wait(max(0, interval - (time.monotonic() - started)))
+
+def start_sweeper_thread(interval=SWEEP_INTERVAL_SECONDS, batch_size=SWEEP_BATCH_SIZE, on_missed=None):
+    """Starts the sweeper on a daemon thread inside the current process (e.g., the backend)."""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_sweeper, args=(interval, batch_size, stop_event, on_missed),
+                              name="missed-dose-sweeper", daemon=True)
+    thread.start()
+    return stop_event
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Marks overdue doses as MISSED for all users and queues their alerts.")
+    parser.add_argument("--once", action="store_true", help="Run a single sweep and exit.")
+    parser.add_argument("--interval", type=int, default=SWEEP_INTERVAL_SECONDS, help="Seconds between sweeps.")
+    parser.add_argument("--batch-size", type=int, default=SWEEP_BATCH_SIZE, help="Doses claimed per transaction.")
+    args = parser.parse_args()
+
+    if args.once:
+        print(f"Marked {sweep_once(args.batch_size)} dose(s) as MISSED.")
+    else:
+        try:
+            run_sweeper(args.interval, args.batch_size)
+        except KeyboardInterrupt:
+            print("Sweeper stopped.")
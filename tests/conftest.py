@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository, next to this directory.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """A throwaway SQLite database, used as the process-wide storage engine."""
+    import repository
+    sqlite_storage = repository.SQLiteStorage(str(tmp_path / "test.sqlite3"))
+    monkeypatch.setattr(repository, "_storage", sqlite_storage)
+    return sqlite_storage
+
+@pytest.fixture
+def user_id(storage):
+    """A user in Europe/Berlin with a close contact and no medications."""
+    with storage.transaction() as repo:
+        return repo.create_user("alice", "alice@example.com", 70, "+15550000000", "hash",
+                                "Bob", "+15550000001", "Europe/Berlin")
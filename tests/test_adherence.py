@@ -0,0 +1,73 @@
+from datetime import date, datetime, timezone
+from adherence import build_report, parse_range
+
+TODAY = date(2026, 3, 31)
+
+def test_range_defaults_to_the_last_days_by_day(monkeypatch):
+    monkeypatch.setattr("adherence.ADHERENCE_DEFAULT_DAYS", 30)
+
+    assert parse_range({}, today=TODAY) == (date(2026, 3, 2), TODAY, "day", None)
+    assert parse_range({"to": "2026-01-31", "granularity": "week"}, today=TODAY) == (
+        date(2026, 1, 2), date(2026, 1, 31), "week", None)
+
+def test_bad_ranges_are_rejected():
+    for args in ({"from": "2026-13-01"}, {"to": "yesterday"}):
+        assert parse_range(args, today=TODAY) == (None, None, None, "from and to must be dates in YYYY-MM-DD format.")
+    assert parse_range({"from": "2026-03-02", "to": "2026-03-01"}, today=TODAY)[3] == "from must not be after to."
+    assert parse_range({"granularity": "year"}, today=TODAY)[3] == "granularity must be one of: day, week, month."
+
+def row(day, medication_id, name, taken=0, missed=0, pending=0):
+    return {"day": day, "medication_id": medication_id, "medicine_name": name,
+            "taken": taken, "missed": missed, "pending": pending}
+
+ROWS = [
+    row(date(2026, 3, 1), 2, "Statin", taken=1),               # Sunday
+    row(date(2026, 3, 2), 1, "Aspirin", taken=1, missed=1),    # Monday
+    row(date(2026, 3, 2), 2, "Statin", missed=1),
+    row(date(2026, 4, 1), 1, "Aspirin", pending=1),
+]
+
+def test_report_groups_periods_by_week_and_month():
+    weekly = build_report(ROWS, date(2026, 3, 1), date(2026, 4, 1), "week")
+    monthly = build_report(ROWS, date(2026, 3, 1), date(2026, 4, 1), "month")
+
+    assert [(p["start"], p["taken"], p["missed"], p["pending"]) for p in weekly["periods"]] == [
+        ("2026-02-23", 1, 0, 0), ("2026-03-02", 1, 2, 0), ("2026-03-30", 0, 0, 1)]
+    assert [(p["start"], p["adherence"]) for p in monthly["periods"]] == [("2026-03-01", 0.5), ("2026-04-01", None)]
+    assert (monthly["from"], monthly["to"], monthly["granularity"]) == ("2026-03-01", "2026-04-01", "month")
+
+def test_adherence_counts_only_doses_that_were_due():
+    report = build_report(ROWS, date(2026, 3, 1), date(2026, 4, 1), "day")
+
+    assert report["summary"] == {"taken": 2, "missed": 2, "pending": 1, "adherence": 0.5}
+    assert [(m["medicine_name"], m["adherence"]) for m in report["medications"]] == [
+        ("Aspirin", 0.5), ("Statin", 0.5)]
+
+def test_an_empty_range_has_no_adherence_rate():
+    report = build_report([], date(2026, 3, 1), date(2026, 3, 31), "day")
+
+    assert report["summary"] == {"taken": 0, "missed": 0, "pending": 0, "adherence": None}
+    assert report["periods"] == [] and report["medications"] == []
+
+def counters(storage, user_id):
+    with storage.transaction() as repo:
+        rows = repo.adherence_by_day(user_id, date(2026, 1, 1), date(2026, 1, 31))
+    return [(r["day"].day, r["medicine_name"], r["taken"], r["missed"], r["pending"]) for r in rows]
+
+def test_triggers_keep_the_daily_rollup_in_step_with_dose_history(storage, user_id):
+    with storage.transaction() as repo:
+        repo.add_medications(user_id, [("Aspirin", "1 tablet", "08:00", None)])
+        doses = repo.generate_doses(user_id, date(2026, 1, 1), date(2026, 1, 3))
+    first, second, third = sorted(doses, key=lambda d: d["scheduled_for"])
+    assert counters(storage, user_id) == [(1, "Aspirin", 0, 0, 1), (2, "Aspirin", 0, 0, 1), (3, "Aspirin", 0, 0, 1)]
+
+    with storage.transaction() as repo:
+        repo.confirm(user_id, [first["id"]], since=date(2026, 1, 1))
+        # 08:00 in Berlin is 07:00 UTC: only the second day's dose is due before the cutoff.
+        repo.mark_missed(datetime(2026, 1, 2, 12, tzinfo=timezone.utc), datetime(2026, 1, 2, tzinfo=timezone.utc),
+                         batch_size=10, user_id=user_id)
+    assert counters(storage, user_id) == [(1, "Aspirin", 1, 0, 0), (2, "Aspirin", 0, 1, 0), (3, "Aspirin", 0, 0, 1)]
+
+    with storage.transaction() as repo:
+        repo.cur.execute("DELETE FROM dose_history WHERE id IN (?, ?)", (second["id"], third["id"]))
+    assert counters(storage, user_id) == [(1, "Aspirin", 1, 0, 0)]
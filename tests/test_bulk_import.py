@@ -0,0 +1,65 @@
+import pytest
+import backend
+
+def parse(**request):
+    with backend.app.test_request_context("/api/medications/bulk", method="POST", **request):
+        return backend._parse_medications(backend.request)
+
+def test_parses_a_json_array():
+    rows, error = parse(json=[
+        {"medicine_name": " Aspirin ", "dosage": "1 tablet", "time": "08:00"},
+        {"medicine_name": "Statin", "time": "21:30:00"},
+    ])
+
+    assert error is None
+    assert rows == [("Aspirin", "1 tablet", "08:00", None), ("Statin", "", "21:30:00", None)]
+
+def test_parses_an_object_with_a_medications_list_and_recurrence():
+    rows, error = parse(json={"medications": [
+        {"medicine_name": "Insulin", "dosage": "10 IU", "recurrence": {"times": ["20:00", "08:00"]}},
+    ]})
+
+    assert error is None
+    [(name, dosage, time_to_take, rule)] = rows
+    assert (name, dosage, time_to_take) == ("Insulin", "10 IU", "08:00:00")
+    assert rule["times"] == ["08:00:00", "20:00:00"]
+
+def test_parses_csv_with_a_header_row():
+    body = 'medicine_name,dosage,time,recurrence\nAspirin,1 tablet,08:00,\nInsulin,10 IU,,"{""times"": [""07:00""]}"\n'
+
+    rows, error = parse(data=body, content_type="text/csv")
+
+    assert error is None
+    assert [row[:3] for row in rows] == [("Aspirin", "1 tablet", "08:00"), ("Insulin", "10 IU", "07:00:00")]
+    assert rows[1][3]["times"] == ["07:00:00"]
+
+@pytest.mark.parametrize("items, message", [
+    ([], "No medications given."),
+    ({"medications": "Aspirin"}, "Expected a JSON array"),
+    ([{"medicine_name": "Aspirin"}], "Medication 1: medicine_name and time (or recurrence) are required."),
+    ([{"medicine_name": "Aspirin", "time": "08:00"}, "Statin"], "Medication 2: medicine_name and time"),
+    ([{"medicine_name": "Aspirin", "time": 800}], "Medication 1: medicine_name, dosage and time must be strings."),
+    ([{"medicine_name": ["Aspirin"], "time": "08:00"}], "must be strings"),
+    ([{"medicine_name": "Aspirin", "time": "25:00"}], "Medication 1: time must be in HH:MM"),
+    ([{"medicine_name": "Aspirin", "time": "08:00", "recurrence": {"times": ["08:00"], "every_days": 0}}],
+     "Medication 1: every_days"),
+])
+def test_rejects_bad_rows_with_their_position(items, message):
+    rows, error = parse(json=items)
+
+    assert rows is None
+    assert message in error
+
+def test_rejects_a_bad_csv_row():
+    rows, error = parse(data="medicine_name,dosage,time\nAspirin,1 tablet,08:00\n,5 ml,09:00\n", content_type="text/csv")
+
+    assert rows is None
+    assert error.startswith("Medication 2:")
+
+def test_rejects_too_many_items(monkeypatch):
+    monkeypatch.setattr(backend, "BULK_MAX_ITEMS", 2)
+
+    rows, error = parse(json=[{"medicine_name": "Aspirin", "time": "08:00"}] * 3)
+
+    assert rows is None
+    assert "At most 2" in error
@@ -0,0 +1,42 @@
+from cache import ScheduleCache
+
+def test_a_fill_read_before_an_invalidation_is_not_stored():
+    cache = ScheduleCache(ttl=60, max_bytes=1000)
+    generation = cache.generation(1)  # The reader starts its query...
+    cache.invalidate_user(1)          # ...a write commits meanwhile...
+
+    cache.put(1, "2026-01-01", "stale", "etag", generation)
+
+    assert cache.get(1, "2026-01-01") is None
+    cache.put(1, "2026-01-01", "fresh", "etag", cache.generation(1))
+    assert cache.get(1, "2026-01-01") == ("fresh", "etag")
+
+def test_generations_of_evicted_users_are_forgotten():
+    cache = ScheduleCache(ttl=60, max_bytes=10)
+    for user_id in range(1, 6):
+        cache.invalidate_user(user_id)
+        cache.put(user_id, "2026-01-01", "x" * 5, None, cache.generation(user_id))
+
+    # Only the last two users still have an entry, and a generation.
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["generations"] == 2
+
+def test_forgetting_a_generation_never_lets_a_stale_fill_in():
+    cache = ScheduleCache(ttl=60, max_bytes=10)
+    cache.put(1, "2026-01-01", "x" * 5, None, cache.generation(1))
+    generation = cache.generation(1)
+    cache.invalidate_user(1)
+    cache.put(1, "2026-01-02", "x" * 5, None, cache.generation(1))
+    cache.put(2, "2026-01-01", "y" * 10, None, cache.generation(2))  # Evicts user 1 entirely.
+    assert cache.stats()["generations"] == 0
+
+    cache.put(1, "2026-01-01", "stale", None, generation)
+
+    assert cache.get(1, "2026-01-01") is None
+
+def test_users_without_entries_are_forgotten_in_bulk():
+    cache = ScheduleCache(ttl=60, max_bytes=1000)
+    for user_id in range(2000):
+        cache.invalidate_user(user_id)
+
+    assert cache.stats()["generations"] <= 1025
@@ -0,0 +1,90 @@
+import threading
+import psycopg2
+import psycopg2.extensions
+import pytest
+import database
+
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+class FakeConnection:
+    """Stands in for a psycopg2 connection; records whether it was closed."""
+    def __init__(self):
+        self.closed = 0
+        self.info = FakeInfo()
+
+    def rollback(self):
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+@pytest.fixture
+def opened(monkeypatch):
+    connections = []
+    def connect(**kwargs):
+        connections.append(FakeConnection())
+        return connections[-1]
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    return connections
+
+def burst(pool, size):
+    """Checks out `size` connections at once, then returns them all."""
+    conns = [pool.getconn() for _ in range(size)]
+    for conn in conns:
+        pool.putconn(conn)
+    return conns
+
+def test_second_burst_reuses_the_same_connections(opened):
+    pool = database.BlockingConnectionPool(minconn=1, maxconn=8)
+    first = burst(pool, 8)
+    second = burst(pool, 8)
+
+    assert len(opened) == 8
+    assert {id(conn) for conn in second} == {id(conn) for conn in first}
+    assert not any(conn.closed for conn in opened)
+    assert pool.stats()["idle"] == 8
+
+def test_returned_connection_is_rolled_back_and_kept(opened):
+    pool = database.BlockingConnectionPool(minconn=0, maxconn=2)
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+
+    assert conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    assert pool.getconn() is conn
+
+def test_connections_past_max_age_are_replaced(opened):
+    pool = database.BlockingConnectionPool(minconn=0, maxconn=2, max_age=0)
+    first = pool.getconn()
+    pool.putconn(first)
+    second = pool.getconn()
+
+    assert second is not first
+    assert first.closed
+    assert pool.stats()["recycled"] == 1
+
+def test_waits_for_a_connection_instead_of_opening_more_than_maxconn(opened):
+    pool = database.BlockingConnectionPool(minconn=0, maxconn=1, timeout=5)
+    conn = pool.getconn()
+    threading.Timer(0.05, pool.putconn, args=(conn,)).start()
+
+    assert pool.getconn() is conn
+    assert len(opened) == 1
+
+def test_times_out_when_exhausted(opened):
+    pool = database.BlockingConnectionPool(minconn=0, maxconn=1, timeout=0.01)
+    pool.getconn()
+    with pytest.raises(database.PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["exhausted"] == 1
+
+def test_closeall_closes_idle_and_later_returned_connections(opened):
+    pool = database.BlockingConnectionPool(minconn=0, maxconn=2)
+    idle, held = pool.getconn(), pool.getconn()
+    pool.putconn(idle)
+    pool.closeall()
+    pool.closeall()
+    pool.putconn(held)
+
+    assert idle.closed and held.closed
@@ -0,0 +1,48 @@
+from datetime import date
+
+def add_medications(storage, user_id, *rows):
+    with storage.transaction() as repo:
+        return repo.add_medications(user_id, list(rows))
+
+def generate(storage, user_id, first_day, last_day):
+    with storage.transaction() as repo:
+        return repo.generate_doses(user_id, first_day, last_day)
+
+def test_generates_one_dose_per_medication_and_day(storage, user_id):
+    add_medications(storage, user_id, ("Aspirin", "1 tablet", "08:00", None), ("Statin", "20 mg", "21:30", None))
+
+    doses = generate(storage, user_id, date(2026, 1, 1), date(2026, 1, 3))
+
+    assert len(doses) == 6
+    with storage.transaction() as repo:
+        schedule = repo.get_schedule(user_id, date(2026, 1, 2))
+    assert [(d["medicine_name"], d["scheduled_time"], d["status"]) for d in schedule] == [
+        ("Aspirin", "08:00:00", "PENDING"), ("Statin", "21:30:00", "PENDING")]
+
+def test_generating_again_skips_existing_doses(storage, user_id):
+    add_medications(storage, user_id, ("Aspirin", "1 tablet", "08:00", None))
+    generate(storage, user_id, date(2026, 1, 1), date(2026, 1, 2))
+
+    # Overlapping window: only the new day's dose is inserted and returned.
+    doses = generate(storage, user_id, date(2026, 1, 2), date(2026, 1, 3))
+
+    assert [d["scheduled_for"] for d in doses] == [date(2026, 1, 3)]
+    with storage.transaction() as repo:
+        assert len(repo.get_schedule(user_id, date(2026, 1, 2))) == 1
+
+def test_new_medication_only_adds_its_own_doses(storage, user_id):
+    add_medications(storage, user_id, ("Aspirin", "1 tablet", "08:00", None))
+    generate(storage, user_id, date(2026, 1, 1), date(2026, 1, 1))
+    [statin] = add_medications(storage, user_id, ("Statin", "20 mg", "21:30", None))
+
+    doses = generate(storage, user_id, date(2026, 1, 1), date(2026, 1, 1))
+
+    assert [d["medication_id"] for d in doses] == [statin]
+
+def test_due_at_is_the_local_time_in_the_users_timezone(storage, user_id):
+    add_medications(storage, user_id, ("Aspirin", "1 tablet", "08:00", None))
+
+    [dose] = generate(storage, user_id, date(2026, 1, 15), date(2026, 1, 15))
+
+    # 08:00 in Berlin is 07:00 UTC in winter.
+    assert dose["due_at"].isoformat() == "2026-01-15T07:00:00+00:00"
@@ -0,0 +1,82 @@
+import threading
+from types import SimpleNamespace
+import psycopg2
+import events
+import metrics
+
+class FakeListenConnection:
+    """Delivers the given NOTIFY payloads on its first poll()."""
+    def __init__(self, payloads):
+        self.payloads = list(payloads)
+        self.notifies = []
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        pass
+
+    def poll(self):
+        self.notifies.extend(SimpleNamespace(payload=p) for p in self.payloads)
+        self.payloads = []
+
+    def close(self):
+        pass
+
+def listen(monkeypatch, payloads, listener):
+    """Runs the LISTEN loop over `payloads` until `listener` sets the returned event."""
+    broker = events.EventBroker()
+    monkeypatch.setattr(events, "broker", broker)
+    conn = FakeListenConnection(payloads)
+    monkeypatch.setattr(psycopg2, "connect", lambda **kwargs: conn)
+    monkeypatch.setattr(events.select, "select", lambda r, w, x, timeout: (r, [], []))
+    stop_event = threading.Event()
+    broker.add_listener(lambda event: listener(event, stop_event))
+    thread = threading.Thread(target=events._listen_forever, args=(stop_event, 0), daemon=True)
+    thread.start()
+    thread.join(5)
+    return broker, thread
+
+def test_bad_payloads_dont_stop_valid_events(monkeypatch):
+    received = []
+    def listener(event, stop_event):
+        received.append(event)
+        stop_event.set()
+
+    _, thread = listen(monkeypatch, ["not json", "1", '["a list"]', '{"user_id": 7, "type": "missed"}'], listener)
+
+    assert not thread.is_alive()
+    assert received == [{"user_id": 7, "type": "missed"}]
+
+def test_failing_listener_doesnt_stop_delivery(monkeypatch):
+    received = []
+    def listener(event, stop_event):
+        if event["type"] == "boom":
+            raise KeyError("boom")
+        received.append(event)
+        stop_event.set()
+
+    errors_before = metrics._background_errors.get("events", 0)
+    broker, thread = listen(monkeypatch, ['{"user_id": 7, "type": "boom"}', '{"user_id": 7, "type": "missed"}'], listener)
+
+    assert not thread.is_alive()
+    assert received == [{"user_id": 7, "type": "missed"}]
+    assert metrics._background_errors["events"] == errors_before + 1
+
+def test_failing_listener_still_reaches_the_users_stream():
+    broker = events.EventBroker()
+    broker.add_listener(lambda event: event["missing"])
+    stream = broker.subscribe(7)
+
+    broker.publish({"user_id": 7, "type": "missed"})
+
+    assert stream.get_nowait() == {"user_id": 7, "type": "missed"}
@@ -0,0 +1,110 @@
+import threading
+from types import SimpleNamespace
+import gui
+
+class FakeRoot:
+    """Records after() callbacks instead of running a Tk event loop."""
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append(callback)
+        return len(self.scheduled)
+
+    def run_scheduled(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for callback in scheduled:
+            callback()
+
+def test_idle_worker_does_not_poll():
+    root = FakeRoot()
+    gui.ApiWorker().attach(root)
+
+    assert root.scheduled == []
+
+def test_polls_only_until_the_response_is_delivered():
+    root = FakeRoot()
+    worker = gui.ApiWorker()
+    worker.attach(root)
+    release, responses = threading.Event(), []
+    worker.submit(lambda: release.wait(5) and "ok", responses.append)
+
+    root.run_scheduled()  # still in flight: polls again
+    assert len(root.scheduled) == 1
+    release.set()
+    while not responses:
+        root.run_scheduled()
+
+    assert responses == ["ok"]
+    assert root.scheduled == []
+
+def test_callback_that_submits_keeps_a_single_poll():
+    root = FakeRoot()
+    worker = gui.ApiWorker()
+    worker.attach(root)
+    responses = []
+    worker.submit(lambda: 1, lambda response: worker.submit(lambda: 2, responses.append))
+
+    while not responses:
+        root.run_scheduled()
+        assert len(root.scheduled) <= 1
+
+    assert responses == [2]
+    assert root.scheduled == []
+
+class FakeStreamResponse:
+    def __init__(self, status_code, lines=()):
+        self.status_code, self.headers, self.lines = status_code, {}, list(lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+class FakeWindow:
+    def __init__(self):
+        self.generated = []
+
+    def event_generate(self, sequence, when=None):
+        self.generated.append((sequence, when))
+
+def test_alert_events_wake_the_window(monkeypatch):
+    stream, window = gui.AlertStream(), FakeWindow()
+    stream.attach(window)
+    lines = ["retry: 10", "event: missed", 'data: {"alerts": ["Aspirin"]}', ""]
+    responses = iter([FakeStreamResponse(200, lines), FakeStreamResponse(401)])
+    monkeypatch.setattr(gui.api_session, "get", lambda *args, **kwargs: next(responses))
+
+    stream._run()
+
+    assert stream.events.get_nowait() == ("missed", {"alerts": ["Aspirin"]})
+    assert window.generated == [("<<AlertEvents>>", "tail")] * 2
+
+def test_stream_stops_on_401_instead_of_reconnecting(monkeypatch):
+    stream, calls = gui.AlertStream(), []
+    monkeypatch.setattr(gui.api_session, "get", lambda *args, **kwargs: calls.append(1) or FakeStreamResponse(401))
+
+    stream._run()  # Returns instead of retrying forever.
+
+    assert calls == [1]
+    assert stream.events.get_nowait() == ("auth_error", {"error": "Your session has expired. Please log in again."})
+
+def test_a_bad_event_does_not_stop_the_others(monkeypatch):
+    monkeypatch.setattr(gui.app_state, "user_id", 1)
+    monkeypatch.setattr(gui, "alert_stream", gui.AlertStream())
+    warnings = []
+    monkeypatch.setattr(gui.messagebox, "showwarning", lambda title, message: warnings.append(message))
+    page = SimpleNamespace(refresh_schedule=lambda: warnings.append("refreshed"))
+    for event in [("missed", None), ("missed", {"alerts": ["Aspirin at 08:00"]})]:
+        gui.alert_stream.events.put(event)
+
+    gui.MainPage.process_alert_events(page)
+
+    assert warnings == ["refreshed", "Aspirin at 08:00"]
@@ -0,0 +1,16 @@
+import pytest
+import notifications
+
+@pytest.mark.parametrize("rate", [0, -1.5])
+def test_a_rate_that_is_not_positive_is_rejected(rate):
+    with pytest.raises(ValueError, match="SMS_RATE_PER_SECOND must be greater than 0"):
+        notifications.SMSDispatcher(notifications.FakeSMSTransport(), rate=rate, workers=0)
+    with pytest.raises(ValueError, match="greater than 0 tokens per second"):
+        notifications.TokenBucket(rate)
+
+def test_bucket_allows_a_burst_up_to_its_capacity():
+    bucket = notifications.TokenBucket(rate=1000, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+
+    assert bucket._tokens < 1
@@ -0,0 +1,86 @@
+import outbox
+
+class RecordingRepo:
+    """Records what record_results does with each message."""
+    def __init__(self):
+        self.calls = []
+
+    def mark_notification_sent(self, message_id):
+        self.calls.append(("sent", message_id))
+
+    def mark_notification_failed(self, message_id, error):
+        self.calls.append(("failed", message_id, error))
+
+    def retry_notification(self, message_id, delay_seconds, error):
+        self.calls.append(("retry", message_id, delay_seconds, error))
+
+def message(message_id, attempts=1, recipient="+15550000001", **fields):
+    return dict({"id": message_id, "attempts": attempts, "recipient": recipient, "subject": None,
+                 "body": f"body {message_id}", "audience": None, "patient_name": None, "medicine_name": None}, **fields)
+
+def test_failed_sends_back_off_exponentially_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_BASE_BACKOFF_SECONDS", 15)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_BACKOFF_SECONDS", 100)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 5)
+    repo = RecordingRepo()
+
+    outbox.record_results(repo, [(message(attempts, attempts=attempts), False, "timeout") for attempts in (1, 2, 3, 4)])
+
+    assert repo.calls == [("retry", 1, 15, "timeout"), ("retry", 2, 30, "timeout"),
+                          ("retry", 3, 60, "timeout"), ("retry", 4, 100, "timeout")]
+
+def test_sent_and_exhausted_messages_are_final(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 5)
+    repo = RecordingRepo()
+
+    outbox.record_results(repo, [(message(1), True, None), (message(2, attempts=5), False, "rejected")])
+
+    assert repo.calls == [("sent", 1), ("failed", 2, "rejected")]
+
+def missed(message_id, recipient, patient_name, medicine_name, audience="patient"):
+    return message(message_id, recipient=recipient, audience=audience, patient_name=patient_name,
+                   medicine_name=medicine_name, subject="Missed dose", body=f"You missed {medicine_name}.")
+
+def test_coalesces_a_recipients_alerts_into_one_digest():
+    digests = outbox.coalesce_messages("sms", [
+        missed(1, "+1555001", "Alice", "Aspirin"),
+        missed(2, "+1555002", "Bob", "Statin"),
+        missed(3, "+1555001", "Alice", "Insulin"),
+    ])
+
+    by_recipient = {digest["recipient"]: (digest, [m["id"] for m in items]) for digest, items in digests}
+    assert len(digests) == 2
+    assert by_recipient["+1555001"][1] == [1, 3]
+    assert "2 doses: Aspirin, Insulin" in by_recipient["+1555001"][0]["body"]
+    # A single alert goes out unchanged.
+    assert by_recipient["+1555002"][0]["body"] == "You missed Statin."
+
+def test_a_close_contacts_digest_lists_doses_per_patient():
+    [(digest, items)] = outbox.coalesce_messages("email", [
+        missed(1, "carer@example.com", "Bob", "Statin", audience="contact"),
+        missed(2, "carer@example.com", "Alice", "Aspirin", audience="contact"),
+        missed(3, "carer@example.com", "Alice", "Insulin", audience="contact"),
+    ])
+
+    assert len(items) == 3
+    assert digest["subject"] == "Medication Reminder: 3 Missed Doses"
+    assert "Alice: Aspirin, Insulin; Bob: Statin" in digest["body"]
+
+def test_messages_without_digest_fields_are_sent_as_queued():
+    legacy = [message(1), message(2)]
+
+    digests = outbox.coalesce_messages("sms", legacy)
+
+    assert [(digest["body"], [m["id"] for m in items]) for digest, items in digests] == [
+        ("body 1", [1]), ("body 2", [2])]
+
+def test_a_provider_error_fails_every_message_of_the_batch(monkeypatch):
+    def send_sms_many(messages):
+        raise ConnectionError("provider down")
+    monkeypatch.setattr(outbox, "send_sms_many", send_sms_many)
+    messages = [message(1), message(2, recipient="+15550000002")]
+
+    results = outbox._send_all("sms", messages)
+
+    assert [(m["id"], ok, error) for m, ok, error in results] == [
+        (1, False, "provider down"), (2, False, "provider down")]
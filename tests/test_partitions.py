@@ -0,0 +1,61 @@
+from datetime import date
+import partitions
+from partitions import ensure_partitions, month_start
+
+class FakeCursor:
+    """Answers the catalog queries ensure_partitions makes and records everything else."""
+    def __init__(self, partitioned=True, existing=()):
+        self.partitioned = partitioned
+        self.existing = [(name,) for name in existing]
+        self.executed = []
+        self.result = None
+
+    def execute(self, sql, params=None):
+        self.executed.append(" ".join(sql.split()))
+        if "pg_partitioned_table" in sql:
+            self.result = [(self.partitioned,)]
+        elif "pg_inherits" in sql:
+            self.result = self.existing
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def created_tables(self):
+        return [sql.split()[2] for sql in self.executed if sql.startswith("CREATE TABLE")]
+
+def test_month_start_rolls_over_year_boundaries():
+    assert month_start(date(2026, 11, 15)) == date(2026, 11, 1)
+    assert month_start(date(2026, 11, 15), 2) == date(2027, 1, 1)
+    assert month_start(date(2026, 1, 31), -1) == date(2025, 12, 1)
+    assert month_start(date(2026, 3, 1), -15) == date(2024, 12, 1)
+
+def test_nothing_is_created_when_dose_history_is_not_partitioned():
+    cur = FakeCursor(partitioned=False)
+
+    assert ensure_partitions(cur, months_ahead=3, today=date(2026, 11, 15)) == []
+    assert cur.created_tables() == []
+
+def test_missing_months_are_created_through_months_ahead():
+    cur = FakeCursor(existing=["dose_history_y2026m12", "dose_history_default"])
+
+    created = ensure_partitions(cur, months_ahead=2, today=date(2026, 11, 15))
+
+    assert created == ["dose_history_y2026m11", "dose_history_y2027m01"]
+    assert cur.created_tables() == created
+    attaches = [sql for sql in cur.executed if "ATTACH PARTITION" in sql]
+    assert [sql.split()[5] for sql in attaches] == created
+
+def test_first_month_backfills_earlier_partitions():
+    cur = FakeCursor(existing=["dose_history_y2026m10", "dose_history_y2026m11"])
+
+    created = ensure_partitions(cur, months_ahead=0, first_month=date(2026, 8, 1), today=date(2026, 11, 2))
+
+    assert created == ["dose_history_y2026m08", "dose_history_y2026m09"]
+
+def test_an_existing_partition_set_creates_nothing():
+    cur = FakeCursor(existing=[partitions.partition_name(date(2026, month, 1)) for month in (11, 12)])
+
+    assert ensure_partitions(cur, months_ahead=1, today=date(2026, 11, 30)) == []
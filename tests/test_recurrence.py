@@ -0,0 +1,92 @@
+from datetime import date, time
+import pytest
+from recurrence import expand, expand_medications, parse_rule
+
+def rule(**fields):
+    normalized, _ = parse_rule(fields, today=date(2026, 1, 1))
+    return normalized
+
+def test_every_days_counts_from_the_start_date():
+    every_third = rule(times=["09:00"], every_days=3, start="2026-01-01")
+
+    doses = expand(every_third, date(2026, 1, 5), date(2026, 1, 12), None)
+
+    assert [day for day, _, _ in doses] == [date(2026, 1, 7), date(2026, 1, 10)]
+
+def test_every_hours_continues_across_midnight_from_mid_cycle():
+    every_five = rule(times=["22:00"], every_hours=5, start="2026-01-01")
+
+    doses = expand(every_five, date(2026, 1, 2), date(2026, 1, 2), None)
+
+    # 22:00 on the 1st, then 03:00, 08:00, ... on the 2nd; the 1st's dose is outside the window.
+    assert [t for _, t, _ in doses] == [time(3), time(8), time(13), time(18), time(23)]
+
+def test_every_hours_keeps_local_times_across_a_dst_change():
+    # Clocks in the US move forward on 2026-03-08. Rules run in the user's local time, so
+    # the doses stay at the same times of day; due_at is derived per dose from the timezone.
+    every_eight = rule(times=["08:00"], every_hours=8, start="2026-03-07")
+
+    doses = expand(every_eight, date(2026, 3, 8), date(2026, 3, 9), None)
+
+    assert [(day.day, t) for day, t, _ in doses] == [
+        (8, time(0)), (8, time(8)), (8, time(16)), (9, time(0)), (9, time(8)), (9, time(16))]
+
+def test_taper_steps_run_back_to_back_and_end_the_medication():
+    taper = rule(times=["08:00"], start="2026-01-01",
+                 taper=[{"days": 2, "dosage": "40 mg"}, {"days": 3, "dosage": "20 mg"}])
+
+    doses = expand(taper, date(2025, 12, 30), date(2026, 1, 10), None, dosage="10 mg")
+
+    assert [(day.day, dosage) for day, _, dosage in doses] == [
+        (1, "40 mg"), (2, "40 mg"), (3, "20 mg"), (4, "20 mg"), (5, "20 mg")]
+
+def test_weekdays_filter_the_days():
+    weekdays = rule(times=["08:00", "20:00"], weekdays=["sat", "Sunday"], start="2026-01-01")
+
+    doses = expand(weekdays, date(2026, 1, 1), date(2026, 1, 7), None)
+
+    # 2026-01-03 is a Saturday.
+    assert [(day.day, t) for day, t, _ in doses] == [(3, time(8)), (3, time(20)), (4, time(8)), (4, time(20))]
+
+def test_parse_rule_normalizes_times_and_defaults_the_start():
+    normalized, first_time = parse_rule({"times": ["20:00", "08:00", "08:00"]}, today=date(2026, 1, 1))
+
+    assert normalized == {"times": ["08:00:00", "20:00:00"], "start": "2026-01-01"}
+    assert first_time == "08:00:00"
+
+@pytest.mark.parametrize("bad_rule", [
+    ["08:00"],
+    {"times": ["08:00"], "every_month": 1},
+    {"times": []},
+    {"times": ["8 o'clock"]},
+    {"times": ["08:00", "20:00"], "every_hours": 8},
+    {"times": ["08:00"], "every_hours": 8, "every_days": 2},
+    {"times": ["08:00"], "every_hours": 24 * 7 + 1},
+    {"times": ["08:00"], "every_days": 0},
+    {"times": ["08:00"], "every_days": True},
+    {"times": ["08:00"], "weekdays": ["someday"]},
+    {"times": ["08:00"], "start": "2026-02-01", "end": "2026-01-01"},
+    {"times": ["08:00"], "start": "01/02/2026"},
+    {"times": ["08:00"], "taper": [{"days": 0, "dosage": "5 mg"}]},
+    {"times": ["08:00"], "taper": ["5 mg"]},
+])
+def test_parse_rule_rejects_bad_input(bad_rule):
+    with pytest.raises(ValueError):
+        parse_rule(bad_rule)
+
+def test_expand_medications_fans_shared_rules_out_to_each_medication():
+    twice = rule(times=["08:00", "20:00"], start="2026-01-01")
+    medications = [
+        {"id": 1, "user_id": 10, "time_to_take": "08:00:00", "recurrence": twice},
+        {"id": 2, "user_id": 11, "time_to_take": "08:00:00", "recurrence": dict(twice)},
+        {"id": 3, "user_id": 11, "time_to_take": "12:30:00", "recurrence": None},
+    ]
+
+    rows = expand_medications(medications, date(2026, 1, 1), date(2026, 1, 2))
+
+    assert [row for row in rows if row[1] == 2] == [
+        (11, 2, date(2026, 1, 1), time(8), None), (11, 2, date(2026, 1, 1), time(20), None),
+        (11, 2, date(2026, 1, 2), time(8), None), (11, 2, date(2026, 1, 2), time(20), None)]
+    assert [row[2:] for row in rows if row[1] == 1] == [row[2:] for row in rows if row[1] == 2]
+    assert [row for row in rows if row[1] == 3] == [
+        (11, 3, date(2026, 1, 1), "12:30:00", None), (11, 3, date(2026, 1, 2), "12:30:00", None)]
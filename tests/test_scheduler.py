@@ -0,0 +1,86 @@
+import contextlib
+import threading
+from datetime import datetime, timedelta, timezone
+import scheduler
+
+class FakeLock:
+    def __init__(self, held):
+        self.held = held
+        self.attempts = threading.Event()
+
+    def acquire(self):
+        self.attempts.set()
+        return self.held
+
+    def release(self):
+        pass
+
+def run_once(monkeypatch, lock):
+    """Starts a scheduler with `lock` and waits until it has tried to take the lock."""
+    monkeypatch.setattr(scheduler, "SCHEDULER_STANDBY_SECONDS", 60)
+    monkeypatch.setattr(scheduler.DoseScheduler, "rebuild",
+                        lambda self: setattr(self, "_last_reload", datetime.now(timezone.utc)))
+    dose_scheduler = scheduler.DoseScheduler(on_overdue=lambda dose_ids: None, lock=lock).start()
+    assert lock.attempts.wait(5)
+    return dose_scheduler
+
+def test_standby_scheduler_tracks_nothing(monkeypatch):
+    dose_scheduler = run_once(monkeypatch, FakeLock(held=False))
+    dose_scheduler.add(1, 10, datetime.now(timezone.utc) + timedelta(hours=1))
+    dose_scheduler.stop()
+
+    assert not dose_scheduler.active
+    assert len(dose_scheduler) == 0
+
+def test_lock_holder_tracks_doses(monkeypatch):
+    dose_scheduler = run_once(monkeypatch, FakeLock(held=True))
+    for _ in range(100):
+        if dose_scheduler.active:
+            break
+        threading.Event().wait(0.01)
+    dose_scheduler.add(1, 10, datetime.now(timezone.utc) + timedelta(hours=1))
+    dose_scheduler.stop()
+
+    assert dose_scheduler.active
+    assert len(dose_scheduler) == 1
+
+def test_rebuild_keeps_changes_made_while_it_reads(monkeypatch):
+    now = datetime.now(timezone.utc)
+    dose_scheduler = scheduler.DoseScheduler(on_overdue=lambda dose_ids: None, lock=FakeLock(held=True))
+    dose_scheduler.active = True
+
+    class Repo:
+        def pending_doses(self, since, until):
+            # Committed while the snapshot was being read: a new dose, and a confirmation.
+            dose_scheduler.add(2, 10, now + timedelta(hours=2))
+            dose_scheduler.discard(1)
+            return [{"id": 1, "medication_id": 10, "due_at": now + timedelta(hours=1)}]
+
+    class Storage:
+        def transaction(self):
+            return contextlib.nullcontext(Repo())
+
+    monkeypatch.setattr(scheduler, "get_storage", lambda: Storage())
+    dose_scheduler.rebuild()
+
+    assert sorted(dose_scheduler._entries) == [2]
+    dose_scheduler.add(3, 10, now + timedelta(hours=3))  # No longer recorded for replay.
+    assert dose_scheduler._changes is None
+    assert sorted(dose_scheduler._entries) == [2, 3]
+
+def test_deleting_a_medication_by_string_id_untracks_its_doses(monkeypatch, storage, user_id):
+    import backend
+    with storage.transaction() as repo:
+        medication_id, = repo.add_medications(user_id, [("Aspirin", "1 tablet", "08:00", None)])
+    dose_scheduler = scheduler.DoseScheduler(on_overdue=lambda dose_ids: None, lock=FakeLock(held=True))
+    dose_scheduler.active = True
+    dose_scheduler.add(1, medication_id, datetime.now(timezone.utc) + timedelta(hours=1))
+    monkeypatch.setattr(backend, "storage", storage)  # Chosen when backend was first imported.
+    monkeypatch.setattr(backend, "dose_scheduler", dose_scheduler)
+    client = backend.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+
+    assert client.post("/api/delete_medication", json={"medication_id": "Aspirin"}).status_code == 400
+    assert client.post("/api/delete_medication", json={"medication_id": str(medication_id)}).status_code == 200
+    assert len(dose_scheduler) == 0
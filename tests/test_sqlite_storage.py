@@ -0,0 +1,58 @@
+import sqlite3
+import pytest
+import repository
+
+def test_uses_wal_mode(storage, user_id):
+    conn = storage.connect()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        storage.release(conn)
+
+def test_a_failed_transaction_rolls_back_and_publishes_nothing(storage, user_id):
+    stream = repository.broker.subscribe(user_id)
+    try:
+        with pytest.raises(RuntimeError):
+            with storage.transaction() as repo:
+                repo.add_medications(user_id, [("Aspirin", "1 tablet", "08:00", None)])
+                repo.publish_event(user_id, "schedule_changed")
+                raise RuntimeError("request failed")
+
+        with storage.transaction() as repo:
+            assert repo.list_medications(user_id) == []
+        assert stream.empty()
+    finally:
+        repository.broker.unsubscribe(user_id, stream)
+
+def test_events_are_published_once_the_transaction_commits(storage, user_id):
+    stream = repository.broker.subscribe(user_id)
+    try:
+        with storage.transaction() as repo:
+            repo.publish_event(user_id, "schedule_changed")
+            assert stream.empty()
+        assert stream.get_nowait() == {"user_id": user_id, "type": "schedule_changed", "data": {}}
+    finally:
+        repository.broker.unsubscribe(user_id, stream)
+
+def test_readers_are_not_blocked_by_an_open_write(storage, user_id):
+    writer = storage.connect()
+    try:
+        writer.execute("UPDATE users SET age = 71 WHERE id = ?", (user_id,))  # takes the write lock
+        with storage.transaction() as repo:
+            assert repo.get_data_revision(user_id) == 0
+            assert repo.find_user("alice")["id"] == user_id
+    finally:
+        writer.rollback()
+        storage.release(writer)
+
+def test_a_second_writer_waits_for_the_busy_timeout_then_fails(storage, user_id, monkeypatch):
+    monkeypatch.setattr(repository, "SQLITE_BUSY_TIMEOUT_MS", 50)
+    writer = storage.connect()
+    try:
+        writer.execute("UPDATE users SET age = 71 WHERE id = ?", (user_id,))
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            with storage.transaction() as repo:
+                repo.bump_data_revision([user_id])
+    finally:
+        writer.rollback()
+        storage.release(writer)
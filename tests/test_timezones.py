@@ -0,0 +1,66 @@
+import sqlite3
+from datetime import date, datetime, time, timedelta, timezone
+import pytest
+import timezones
+from timezones import due_at, valid_timezone
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_due_at_follows_the_dst_change():
+    # Europe/Berlin moves from UTC+1 to UTC+2 on 2026-03-29 and back on 2026-10-25.
+    assert due_at(date(2026, 3, 28), time(8, 0), "Europe/Berlin") == utc(2026, 3, 28, 7, 0)
+    assert due_at(date(2026, 3, 29), time(8, 0), "Europe/Berlin") == utc(2026, 3, 29, 6, 0)
+    assert due_at("2026-10-25", "08:00", "Europe/Berlin") == utc(2026, 10, 25, 7, 0)
+    # America/New_York: UTC-5 until 2026-03-08, UTC-4 after.
+    assert due_at("2026-03-07", "21:30:00", "America/New_York") == utc(2026, 3, 8, 2, 30)
+    assert due_at("2026-03-08", "21:30:00", "America/New_York") == utc(2026, 3, 9, 1, 30)
+
+def test_times_skipped_or_repeated_by_the_change_use_the_earlier_offset():
+    # 02:30 doesn't exist on the spring-forward day and happens twice on the fall-back day.
+    assert due_at("2026-03-29", "02:30", "Europe/Berlin") == utc(2026, 3, 29, 1, 30)
+    assert due_at("2026-10-25", "02:30", "Europe/Berlin") == utc(2026, 10, 25, 0, 30)
+
+def test_users_without_a_timezone_get_the_default(monkeypatch):
+    monkeypatch.setattr(timezones, "DEFAULT_TIMEZONE", "Asia/Kolkata")
+
+    assert due_at("2026-03-29", "08:00", None) == utc(2026, 3, 29, 2, 30)
+
+def test_unknown_timezones_are_rejected():
+    assert valid_timezone(" Europe/Berlin ") == "Europe/Berlin"
+    for name in ("Mars/Olympus_Mons", "", None):
+        with pytest.raises(ValueError):
+            valid_timezone(name)
+
+def login(monkeypatch, storage, client_timezone):
+    import backend
+    import hashing
+    monkeypatch.setattr(backend, "storage", storage)  # Chosen when backend was first imported.
+    monkeypatch.setattr(hashing.pool, "check_password", lambda password_hash, password: True)
+    return backend.app.test_client().post("/api/login", json={"name": "alice", "password": "secret",
+                                                              "timezone": client_timezone})
+
+def test_login_moves_pending_doses_to_the_client_timezone(monkeypatch, storage, user_id):
+    with storage.transaction() as repo:
+        repo.add_medications(user_id, [("Aspirin", "1 tablet", "08:00", None)])
+        # Pending doses from the last few days on are moved; a week ahead is always among them.
+        day = date.today() + timedelta(days=7)
+        repo.generate_doses(user_id, day, day)
+
+    response = login(monkeypatch, storage, "America/New_York")
+
+    assert response.status_code == 200 and response.get_json()["timezone"] == "America/New_York"
+    with storage.transaction() as repo:
+        [dose] = repo.get_schedule(user_id, day)
+        [dose] = repo._doses_by_id([dose["dose_id"]])
+    assert dose["due_at"] == due_at(day, "08:00", "America/New_York")
+
+def test_login_keeps_the_old_timezone_when_moving_fails(monkeypatch, storage, user_id):
+    import backend
+    def fail(*args):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(backend, "move_timezone", fail)
+
+    response = login(monkeypatch, storage, "America/New_York")
+
+    assert response.status_code == 200 and response.get_json()["timezone"] == "Europe/Berlin"
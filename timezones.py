@@ -0,0 +1,64 @@
+# /medication-reminder-app/timezones.py
+"""
+Per-user timezones. A dose is scheduled on the user's local date and time of day
+(dose_history.scheduled_for / scheduled_time); dose_history.due_at is the absolute instant
+that stands for, so overdue checks compare one timestamp against the current time,
+whatever timezone the server or the user is in.
+"""
+import os
+from datetime import date, datetime, timezone
+from datetime import time as time_of_day
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+@lru_cache(maxsize=None)
+def zone(name):
+    """The ZoneInfo for an IANA name such as 'Europe/Berlin'; raises ValueError if unknown."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        raise ValueError(f"Unknown timezone: {name}. Use an IANA name such as 'America/New_York'.") from None
+
+def valid_timezone(name):
+    """Returns `name` if it is a known IANA timezone, else raises ValueError."""
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("timezone must be an IANA name such as 'America/New_York'.")
+    zone(name.strip())
+    return name.strip()
+
+def system_timezone():
+    """
+    The IANA name of this machine's timezone (from TZ, /etc/timezone or the /etc/localtime
+    link), or None where it can't be told, e.g. on Windows.
+    """
+    candidates = [os.getenv("TZ", "").lstrip(":")]
+    try:
+        with open("/etc/timezone") as f:
+            candidates.append(f.read().strip())
+    except OSError:
+        pass
+    localtime = os.path.realpath("/etc/localtime")
+    if "zoneinfo" + os.sep in localtime:
+        candidates.append(localtime.split("zoneinfo" + os.sep, 1)[1])
+    for name in candidates:
+        try:
+            return valid_timezone(name)
+        except ValueError:
+            continue
+    return None
+
+# The timezone of users who haven't chosen one, including every user that existed before
+# timezones were added: by default the server's own, which is what their dose times meant.
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE") or system_timezone() or "UTC"
+
+def local_today(name):
+    """Today's date in the given timezone."""
+    return datetime.now(zone(name or DEFAULT_TIMEZONE)).date()
+
+def due_at(day, time_to_take, name):
+    """The UTC instant of a local date and time of day in the given timezone."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    if isinstance(time_to_take, str):
+        time_to_take = time_of_day.fromisoformat(time_to_take)
+    return datetime.combine(day, time_to_take, tzinfo=zone(name or DEFAULT_TIMEZONE)).astimezone(timezone.utc)
@@ -0,0 +1,12 @@
+# /medication-reminder-app/wsgi.py
+"""
+Production entry point. Serve the backend with a multi-process WSGI server instead of
+Flask's development server, e.g.:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py starts the per-process background services in each worker after it forks.
+"""
+from backend import app
+
+__all__ = ["app"]